@@ -49,6 +49,14 @@ export interface SessionState {
   reference_categories: string[];
   query_string?: string;
   action_log?: LogEntry[];
+  version?: number;
+  gdata_start?: number;
+  action_log_start?: number;
+}
+export interface SessionStateDelta {
+  version: number;
+  changes: Imdata[];
+  action_log?: LogEntry[];
 }
 export interface SessionParams {
   index_spec: IndexSpec;
@@ -76,6 +84,9 @@ export interface Imdata {
   boxes?: Box[];
   activations?: ActivationData[];
   timing?: Interval[];
+  thumbnail_url?: string;
+  width?: number; // original image size, sent with thumbnail_url
+  height?: number;
 }
 export interface Interval {
   start_ms: number;
@@ -0,0 +1,65 @@
+import argparse
+import time
+import io
+import numpy as np
+import PIL.Image
+
+from seesaw.dataset_manager import GlobalDataManager
+from seesaw.indices.multiscale.multiscale_tools import multiscale_tiling_batch, batch_tx
+
+parser = argparse.ArgumentParser(description="compare full and reduced resolution (fast_decode) pyramid construction on a dataset sample: throughput and embedding drift")
+parser.add_argument("--root_dir", type=str, help="seesaw root folder")
+parser.add_argument("--dataset", type=str, help="dataset name")
+parser.add_argument("--sample_size", type=int, default=200, help="number of images to sample")
+parser.add_argument("--min_tile_size", type=int, default=224)
+parser.add_argument("--model_path", type=str, default=None, help="if given, also compares tile embeddings from both paths")
+parser.add_argument("--device", type=str, default='cpu')
+args = parser.parse_args()
+
+gdm = GlobalDataManager(args.root_dir)
+ds = gdm.get_dataset(args.dataset)
+
+rng = np.random.default_rng(0)
+dbidxs = rng.choice(ds.file_meta.index.values, size=min(args.sample_size, ds.size()), replace=False)
+binaries = [open(f'{ds.image_root}/{ds.paths[dbidx]}', 'rb').read() for dbidx in dbidxs]
+
+def run(fast_decode):
+    """ decode + tiling of every sample image, one image per call as in the extraction pipeline """
+    start = time.time()
+    all_tiles = []
+    for b in binaries:
+        tiles, _, _ = multiscale_tiling_batch([PIL.Image.open(io.BytesIO(b))], tile_size=224, factor=.5,
+                                                min_tile_size=args.min_tile_size, fast_decode=fast_decode)
+        all_tiles.append(tiles)
+    elapsed = time.time() - start
+    tiles = np.concatenate(all_tiles)
+    print(f'{fast_decode=}: {len(binaries)/elapsed:.1f} images/s {tiles.shape[0]/elapsed:.1f} tiles/s')
+    return tiles
+
+full_tiles = run(fast_decode=False)
+fast_tiles = run(fast_decode=True)
+assert full_tiles.shape == fast_tiles.shape, 'both paths should produce the same tiles'
+
+pixel_diff = np.abs(full_tiles.astype(np.float32) - fast_tiles.astype(np.float32)).mean(axis=(1,2,3))
+print(f'mean abs pixel difference per tile: mean {pixel_diff.mean():.2f} max {pixel_diff.max():.2f}')
+
+if args.model_path is not None:
+    import pandas as pd
+    import torch
+    from ray.data.extensions import TensorArray
+    from seesaw.models.model import ImageEmbedding
+
+    model = ImageEmbedding(device=args.device, jit_path=args.model_path, add_slide=False)
+
+    def embed(tiles):
+        vecs = []
+        for start in range(0, tiles.shape[0], 200):
+            batch = batch_tx(pd.DataFrame({'tile':TensorArray(tiles[start:start + 200])}))
+            tensor = torch.from_numpy(batch.tile.values.to_numpy()).to(args.device)
+            vecs.append(model(preprocessed_image=tensor).to(torch.float32).cpu().numpy())
+        return np.concatenate(vecs)
+
+    full_vecs = embed(full_tiles)
+    fast_vecs = embed(fast_tiles)
+    cosine = (full_vecs * fast_vecs).sum(axis=1) # embeddings are normalized
+    print(f'embedding cosine similarity per tile: mean {cosine.mean():.4f} min {cosine.min():.4f} p1 {np.quantile(cosine, .01):.4f}')
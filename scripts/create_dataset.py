@@ -1,5 +1,5 @@
 import argparse
-from seesaw.dataset import create_dataset
+from seesaw.dataset import create_dataset, rescan_dataset, SeesawDataset
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -15,5 +15,19 @@ if __name__ == "__main__":
         "--output_path", type=str, help="Folder where dataset will live"
     )
 
+    parser.add_argument(
+        "--record_stats", action="store_true", help="store file size and mtime in file_meta"
+    )
+    parser.add_argument(
+        "--rescan", action="store_true", help="add files not yet in the existing dataset at output_path"
+    )
+    parser.add_argument(
+        "--num_threads", type=int, default=32, help="directories listed concurrently"
+    )
+
     args = parser.parse_args()
-    ds = create_dataset(image_src=args.image_src, output_path=args.output_path)
+    if args.rescan:
+        ds = rescan_dataset(SeesawDataset(args.output_path), num_threads=args.num_threads)
+    else:
+        ds = create_dataset(image_src=args.image_src, output_path=args.output_path, 
+                            record_stats=args.record_stats, num_threads=args.num_threads)
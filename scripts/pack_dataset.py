@@ -0,0 +1,18 @@
+import argparse
+from seesaw.dataset_manager import GlobalDataManager
+from seesaw.dataset import pack_dataset_shards
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="pack the images of a dataset into large parquet shards, read by as_ray_dataset instead of the individual files"
+    )
+    parser.add_argument("--root_dir", type=str, help="seesaw root folder")
+    parser.add_argument("--dataset", type=str, help="dataset name")
+    parser.add_argument("--shard_mb", type=int, default=512, help="approximate shard size in MB")
+    parser.add_argument("--io_threads", type=int, default=16, help="image files read concurrently")
+    parser.add_argument("--force", action="store_true", help="overwrite existing shards")
+
+    args = parser.parse_args()
+    gdm = GlobalDataManager(args.root_dir)
+    ds = gdm.get_dataset(args.dataset)
+    pack_dataset_shards(ds, shard_bytes=args.shard_mb*2**20, io_threads=args.io_threads, force=args.force)
@@ -18,6 +18,9 @@ parser.add_argument("--num_cpus", type=int, default=2, help="cpus assigned to wo
 parser.add_argument(
     "--no_block", action="store_true", help="start server without blocking"
 )
+parser.add_argument(
+    "--background_refine", action="store_true", help="refine and compute the next batch while the user labels"
+)
 
 args = parser.parse_args()
 
@@ -38,7 +41,8 @@ except:
     pass
 
 session_manager = SessionManagerActor.options(name=actor_name).remote(
-    root_dir=seesaw_root, save_path=save_path, num_cpus_per_session=args.num_cpus
+    root_dir=seesaw_root, save_path=save_path, num_cpus_per_session=args.num_cpus,
+    background_refine=args.background_refine
 )
 
 ray.get(session_manager.ready.remote())
@@ -37,6 +37,9 @@ class Imdata(BaseModel):
     ]  # None means not labelled (neutral). [] means positively no boxes.
     activations: Optional[List[ActivationData]]
     timing: List[Interval] = []
+    thumbnail_url: Optional[str] = None # reduced size version of url, when the session has a thumbnail_size
+    width: Optional[int] = None # original image size, sent along with thumbnail_url since boxes are in original pixels
+    height: Optional[int] = None
 
 
 def is_image_accepted(imdata: Imdata):
@@ -73,6 +76,8 @@ class SessionParams(BaseModel):
     image_vector_strategy: Optional[Literal[ "matched", 'computed']]
     other_params: Optional[dict]
     start_policy: Optional[Literal['from_start', 'after_first_batch', 'after_first_negative', 'after_first_positive', 'after_first_positive_and_negative', 'after_first_reversal']] = 'from_start'
+    latency_budget: Optional[float] = None # seconds per refine or next_batch call. loops stop iterating and use their best result so far once exceeded
+    thumbnail_size: Optional[int] = None # also send thumbnail urls for the panels, with this longest side
 
 class LogEntry(BaseModel):
     logger: Literal["server", 'client']
@@ -90,6 +95,19 @@ class SessionState(BaseModel):
     reference_categories: List[str]
     query_string: Optional[str]
     action_log: List[LogEntry] = []
+    version: int = 0 # number of label updates applied by the server so far
+    gdata_start: int = 0 # gdata[i] is batch gdata_start + i. non-zero when only recent batches were requested
+    action_log_start: int = 0 # likewise, action_log[i] is entry action_log_start + i
+
+
+class SessionStateDelta(BaseModel):
+    """ label updates relative to the server state with the given version.
+        changes includes every image whose labels changed, plus every image of batches
+        received since that version (all images sent back count as seen).
+    """
+    version: int
+    changes: List[Imdata]
+    action_log: List[LogEntry] = [] # entries logged since that version
 
 
 class BenchParams(BaseModel):
@@ -349,6 +349,23 @@ def box_iou(df1, df2, return_containment=False):
     else:
         return ious, containment1
 
+def max_iou_xyxy(boxes : np.ndarray, others : np.ndarray) -> np.ndarray:
+    """ numpy version of box_iou(...).max(axis=1) for (n,4) and (m,4) arrays of x1,y1,x2,y2.
+        returns 0 for every box when others is empty.
+    """
+    if others.shape[0] == 0 or boxes.shape[0] == 0:
+        return np.zeros(boxes.shape[0], dtype=np.float32)
+
+    b = boxes[:, None, :]
+    o = others[None, :, :]
+    iw = np.clip(np.minimum(b[..., 2], o[..., 2]) - np.maximum(b[..., 0], o[..., 0]), 0, None)
+    ih = np.clip(np.minimum(b[..., 3], o[..., 3]) - np.maximum(b[..., 1], o[..., 1]), 0, None)
+    inter = iw * ih
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    area_o = (o[..., 2] - o[..., 0]) * (o[..., 3] - o[..., 1])
+    ious = inter / (area_b + area_o - inter)
+    return ious.max(axis=1)
+
 def _iou_df(df1, df2, iou_min = 0):
     """ assumes df1 and df2 have boxes in them.
     """
@@ -24,6 +24,12 @@ def compute_calibrated_probabilities(vector_scorer, X,  y):
     return ccv.predict_proba(X)[:,1]
 
 import scipy.special
+import hashlib
+
+def vector_key(vec) -> str:
+    """ hash of a query vector's values, for memoizing per query work """
+    vec = np.ascontiguousarray(vec)
+    return hashlib.sha1(str(vec.dtype).encode() + vec.tobytes()).hexdigest()
 
 class GroundTruthCalibrator:
     def __init__(self, X, y):
@@ -31,15 +37,30 @@ class GroundTruthCalibrator:
         self.X = X
         self.y = y
         self._mean = y.mean()
+        self._fits = {} # vector_key -> fitted calibration
+
+    def get_mean(self):
+        return self._mean
 
-    def get_probabilities(self, vector_scorer, vectors):
-        ### fit with given labels then apply to given vectors.
-        sc = _SigmoidCalibration()
-        raw_scores = self.X @ vector_scorer.reshape(-1)
-        sc.fit(raw_scores.reshape(-1,1), self.y)
+    def _fit(self, vector_scorer, raw_scores=None):
+        key = vector_key(vector_scorer)
+        sc = self._fits.get(key)
+        if sc is None:
+            if raw_scores is None:
+                raw_scores = self.X @ vector_scorer.reshape(-1)
+            sc = _SigmoidCalibration()
+            sc.fit(raw_scores.reshape(-1,1), self.y)
+            self._fits[key] = sc
+        return sc
 
-        infer_scores = vectors @ vector_scorer.reshape(-1)
-        return sc.predict(infer_scores)
+    def get_probabilities(self, vector_scorer, vectors, scores=None):
+        """ fit with given labels then apply to given vectors. 
+            scores: vectors @ vector_scorer if already computed. fits are memoized per vector_scorer
+        """
+        if scores is None:
+            scores = vectors @ vector_scorer.reshape(-1)
+        sc = self._fit(vector_scorer, raw_scores=scores if vectors is self.X else None)
+        return sc.predict(scores)
 
 class FixedCalibrator:
     def __init__(self, a : float, b : float, sigmoid : bool):
@@ -47,8 +68,9 @@ class FixedCalibrator:
         self.a = a
         self.b = b
 
-    def get_probabilities(self, vector_scorer, vectors):
-        sc = vectors @ vector_scorer.reshape(-1)
+    def get_probabilities(self, vector_scorer, vectors, scores=None):
+        """ scores: vectors @ vector_scorer if already computed """
+        sc = vectors @ vector_scorer.reshape(-1) if scores is None else scores
         rescaled = self.a*(sc + self.b)
         
         if self.sigmoid:
@@ -8,18 +8,70 @@ import glob
 import json
 
 
-def list_image_paths(basedir, prefixes=[""], extensions=["jpg", "jpeg", "png", 'tif', 'tiff']):
-    acc = []
-    extensions = set(extensions)
-    for prefix in prefixes:
-        pattern = f"{basedir}/{prefix}/**/*.*"
-        files = glob.glob(pattern, recursive=True)
-        imgs = [f for f in files if f.split(".")[-1].lower() in extensions]
-        acc.extend(imgs)
-        print(f"found {len(imgs)} files with pattern in {extensions}...")
+_image_extensions = ["jpg", "jpeg", "png", 'tif', 'tiff']
 
-    relative_paths = [f[len(basedir) :].lstrip("./") for f in acc]
-    return sorted(list(set(relative_paths)))
+def _scan_dir(path, relpath, extensions, stat):
+    """ lists one directory, returns (files, subdirs) """
+    files = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith('.'): # as glob does
+                continue
+            entry_relpath = f'{relpath}/{entry.name}' if relpath else entry.name
+            if entry.is_dir():
+                subdirs.append((entry.path, entry_relpath))
+            elif entry.name.split(".")[-1].lower() in extensions:
+                if stat:
+                    st = entry.stat()
+                    files.append((entry_relpath, st.st_size, st.st_mtime))
+                else:
+                    files.append(entry_relpath)
+    return files, subdirs
+
+def scan_image_files(basedir, prefixes=[""], extensions=_image_extensions, num_threads=32, stat=False):
+    """ yields the image paths under basedir (relative to it) as directories are listed, in no particular order.
+        directories are listed concurrently by num_threads threads, which hides the latency of network file systems.
+        stat: yields (path, size, mtime) tuples instead.
+    """
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+    extensions = set(extensions)
+    with ThreadPoolExecutor(num_threads) as pool:
+        pending = set()
+        for prefix in prefixes:
+            relpath = os.path.normpath(prefix).strip('/') if prefix else ''
+            relpath = '' if relpath == '.' else relpath
+            pending.add(pool.submit(_scan_dir, f'{basedir}/{relpath}', relpath, extensions, stat))
+
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                files, subdirs = fut.result()
+                for (path, relpath) in subdirs:
+                    pending.add(pool.submit(_scan_dir, path, relpath, extensions, stat))
+                yield from files
+
+def list_image_paths(basedir, prefixes=[""], extensions=_image_extensions, num_threads=32):
+    paths = sorted(set(scan_image_files(basedir, prefixes=prefixes, extensions=extensions, num_threads=num_threads)))
+    print(f"found {len(paths)} files with extension in {extensions}...")
+    return paths
+
+def list_image_files(basedir, prefixes=[""], extensions=_image_extensions, num_threads=32) -> pd.DataFrame:
+    """ like list_image_paths, with columns file_path, size and mtime """
+    files = scan_image_files(basedir, prefixes=prefixes, extensions=extensions, num_threads=num_threads, stat=True)
+    df = pd.DataFrame.from_records(list(files), columns=['file_path', 'size', 'mtime'])
+    df = df.drop_duplicates('file_path').sort_values('file_path').reset_index(drop=True)
+    print(f"found {df.shape[0]} files with extension in {extensions}...")
+    return df
+
+def thumbnail_url(dataset_name, dbidx, size, box=None, host='/') -> str:
+    """ served by the /thumb endpoint of the session server, box is (x1, y1, x2, y2) in original pixels.
+        not normalized with os.path.normpath, which keeps a leading '//' (a protocol relative url)
+    """
+    url = f"{host.rstrip('/')}/api/thumb/{dataset_name}/{int(dbidx)}?size={int(size)}"
+    if box is not None:
+        url += '&box=' + ','.join(f'{float(v):g}' for v in box)
+    return url
 
 
 def infer_qgt_from_boxes(box_data, num_files):
@@ -100,14 +152,25 @@ class BaseDataset: # common interface for datasets and their subsets
     def get_url(self, dbidx, host) -> str:
         raise NotImplementedError
 
-    def get_urls(self, dbidxs, host='/'):
+    def get_thumbnail_url(self, dbidx, size, box=None, host='/') -> str:
+        raise NotImplementedError
+
+    def get_image_size(self, dbidx):
+        """ (width, height) of the original image, with its exif orientation applied (as displayed by browsers) """
+        raise NotImplementedError
+
+    def get_urls(self, dbidxs, host='/', thumbnail_size=None):
+        """ thumbnail_size: urls of cached thumbnails with that longest side instead (see seesaw.web.thumbnail_cache) """
         urls = []
         for dbidx in dbidxs:
-            url = self.get_url(dbidx, host=host)
+            if thumbnail_size is None:
+                url = self.get_url(dbidx, host=host)
+            else:
+                url = self.get_thumbnail_url(dbidx, size=thumbnail_size, host=host)
             urls.append(url)
         return urls
 
-    def as_ray_dataset(self, limit=None, parallelism=-1) -> ray.data.Dataset:
+    def as_ray_dataset(self, limit=None, parallelism=-1, dbidx_range=None, exclude=None) -> ray.data.Dataset:
         raise NotImplementedError
 
     def load_eval_categories(self):
@@ -219,20 +282,87 @@ class SeesawDataset(BaseDataset):
         ## remove any extra slashes etc
         return os.path.normpath(path)
 
+    def get_thumbnail_url(self, dbidx, size, box=None, host='/') -> str:
+        return thumbnail_url(self.dataset_name, dbidx, size, box=box, host=host)
+
+    def get_image_size(self, dbidx):
+        import PIL.Image
+        from .web.thumbnail_cache import oriented_size
+        with PIL.Image.open(f'{self.image_root}/{self.paths[dbidx]}') as im: # only reads the header
+            return oriented_size(im)
+
     def show_image(self, dbidx, host='/'):
         from IPython.display import Image
         url = self.get_url(dbidx)
         return Image(url=f'{host}/{url}')
 
 
-    def as_ray_dataset(self, limit=None, parallelism=-1) -> ray.data.Dataset:
+    def shards_path(self):
+        return f'{self.path}/shards'
+
+    def load_shard_offsets(self):
+        """ returns the offsets index of the packed shards (see pack_dataset_shards), 
+            or None if there are none or they no longer match file_meta
+        """
+        offsets_path = f'{self.shards_path()}/offsets.parquet'
+        if not os.path.exists(offsets_path):
+            return None
+
+        offsets = pd.read_parquet(offsets_path)
+        if not np.array_equal(offsets.dbidx.values, np.sort(self.file_meta.index.values)):
+            print(f'shards in {self.shards_path()} are out of date with file_meta, reading image files instead')
+            return None
+        return offsets
+
+    def _read_shards(self, offsets, limit, parallelism, dbidx_range, exclude) -> ray.data.Dataset:
+        if dbidx_range is not None:
+            (start, end) = dbidx_range
+            offsets = offsets[(offsets.dbidx >= start) & (offsets.dbidx < end)]
+        if limit is not None:
+            offsets = offsets.iloc[:limit]
+        if offsets.shape[0] == 0:
+            return ray.data.from_pandas(pd.DataFrame({'dbidx':[], 'file_path':[], 'bytes':[]}))
+
+        ## offsets are in dbidx order and shards are contiguous, so the selection is a dbidx range
+        bounds = (int(offsets.dbidx.iloc[0]), int(offsets.dbidx.iloc[-1]) + 1)
+        shard_names = np.unique(offsets.shard.values)
+        read_paths = [f'{self.shards_path()}/{name}' for name in shard_names]
+
+        def select_rows(batch_df, bounds, exclude):
+            ## only the first and last shards have extra rows
+            dbidxs = batch_df.dbidx.values
+            mask = (dbidxs >= bounds[0]) & (dbidxs < bounds[1])
+            if exclude is not None:
+                mask &= np.array([d not in exclude for d in dbidxs], dtype=bool)
+            return batch_df[mask][['dbidx', 'file_path', 'bytes']]
+
+        shards = ray.data.read_parquet(read_paths, parallelism=parallelism)
+        return shards.map_batches(select_rows, batch_format='pandas', fn_kwargs=dict(bounds=bounds, exclude=exclude))
+
+    def as_ray_dataset(self, limit=None, parallelism=-1, dbidx_range=None, exclude=None) -> ray.data.Dataset:
         """ with schema {'dbidx', 'file_path, 'bytes'}
             and note: path is in self.paths
+            dbidx_range: (start, end), only reads the images with start <= dbidx < end
+            exclude: dbidxs to leave out, eg. duplicates (see find_duplicate_images)
+            reads from the packed shards when they exist (see pack_dataset_shards), otherwise from the image files.
         """
+        offsets = self.load_shard_offsets()
+        if offsets is not None:
+            return self._read_shards(offsets, limit=limit, parallelism=parallelism, dbidx_range=dbidx_range, exclude=exclude)
+
         from ray.data.datasource.file_meta_provider import DefaultFileMetadataProvider
 
         real_prefix = f"{os.path.realpath(self.image_root)}/"
-        read_paths = (real_prefix + self.paths).tolist()
+        paths = self.paths
+        dbidxs = self.file_meta.index.values
+        mask = np.ones(dbidxs.shape[0], dtype=bool)
+        if dbidx_range is not None:
+            (start, end) = dbidx_range
+            mask &= (dbidxs >= start) & (dbidxs < end)
+        if exclude is not None:
+            mask &= ~np.isin(dbidxs, np.array(exclude))
+        paths = paths[mask]
+        read_paths = (real_prefix + paths).tolist()
         read_paths = read_paths[:limit]
         fix_map = self.dbidx_map
         
@@ -335,9 +465,11 @@ class SeesawDataset(BaseDataset):
     ### can be used by indices over the subset?
 from seesaw.util import transactional_folder
 
-def create_dataset(image_src, output_path, paths=[], force=False) -> SeesawDataset:
+def create_dataset(image_src, output_path, paths=[], force=False, record_stats=False, num_threads=32) -> SeesawDataset:
     """
     if not given explicit paths, it assumes every jpg, jpeg and png is wanted
+    record_stats: also stores the size and mtime of every file in file_meta (only when listing the files)
+    num_threads: see scan_image_files
     """
     with transactional_folder(output_path, force=force) as tmp_output_path:
         image_src = resolve_path(image_src)
@@ -345,16 +477,109 @@ def create_dataset(image_src, output_path, paths=[], force=False) -> SeesawDatas
 
         image_path = f"{tmp_output_path}/images"
         os.symlink(image_src, image_path)
-        if len(paths) == 0:
-            paths = list_image_paths(image_src)
+        if len(paths) == 0 and record_stats:
+            df = list_image_files(image_src, num_threads=num_threads)
+            df = df.assign(dbidx=np.arange(df.shape[0]))[['dbidx', 'file_path', 'size', 'mtime']]
+        else:
+            if len(paths) == 0:
+                paths = list_image_paths(image_src, num_threads=num_threads)
+            df = pd.DataFrame({'dbidx':np.arange(len(paths)), "file_path": paths})
 
-        df = pd.DataFrame({'dbidx':np.arange(len(paths)), "file_path": paths})
         df.to_parquet(f"{tmp_output_path}/file_meta.parquet")
 
         _ = SeesawDataset(tmp_output_path) # test read, abort if not well formed
 
     return SeesawDataset(output_path)
+
+def rescan_dataset(ds : SeesawDataset, num_threads=32) -> SeesawDataset:
+    """ lists the image folder again and appends the files not yet in file_meta, with new dbidxs after the current ones.
+        existing dbidxs are kept as they are, even for files that have been removed, so indices built before remain valid.
+        records size and mtime for the new files if file_meta already has them.
+        returns the reloaded dataset.
+    """
+    file_meta = ds.file_meta
+    has_stats = 'mtime' in file_meta.columns
+    if has_stats:
+        found = list_image_files(ds.image_root, num_threads=num_threads)
+    else:
+        found = pd.DataFrame({'file_path':list_image_paths(ds.image_root, num_threads=num_threads)})
+
+    new_files = found[~found.file_path.isin(file_meta.file_path)]
+    num_missing = (~file_meta.file_path.isin(found.file_path)).sum()
+    if num_missing > 0:
+        print(f'warning: {num_missing} files in file_meta no longer exist, keeping their entries')
+
+    if new_files.shape[0] == 0:
+        print('no new files found')
+        return ds
+
+    start = file_meta.index.max() + 1 if file_meta.shape[0] > 0 else 0
+    dbidxs = np.arange(start, start + new_files.shape[0])
+    new_files = new_files.assign(dbidx=dbidxs).set_index(dbidxs).reindex(columns=file_meta.columns)
+    file_meta = pd.concat([file_meta, new_files])
+
+    meta_path = f'{ds.path}/file_meta.parquet'
+    file_meta.to_parquet(meta_path + '.tmp')
+    os.replace(meta_path + '.tmp', meta_path)
+    print(f'added {new_files.shape[0]} new files to {ds}')
+    return SeesawDataset(ds.path)
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def pack_dataset_shards(ds : SeesawDataset, shard_bytes=512*2**20, row_group_size=256, io_threads=16, force=False):
+    """ packs the dataset images into parquet shards of about shard_bytes each under {ds.path}/shards,
+        with columns dbidx, file_path, bytes. images are in dbidx order, so each shard holds a contiguous dbidx range.
+        shards/offsets.parquet maps every dbidx to its shard and row.
+        as_ray_dataset reads from the shards from then on, which avoids opening (and stat-ing) every image file,
+        the main cost on network file systems.
+        io_threads: number of image files read concurrently while packing.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from concurrent.futures import ThreadPoolExecutor
+
+    file_meta = ds.file_meta.sort_index()
+    schema = pa.schema([('dbidx', pa.int64()), ('file_path', pa.string()), ('bytes', pa.binary())])
+
+    offsets = []
+    with transactional_folder(ds.shards_path(), force=force) as tmp_path, ThreadPoolExecutor(io_threads) as pool:
+        shard = 0
+        writer = None
+        written = 0
+        row = 0
+        for start in range(0, file_meta.shape[0], row_group_size):
+            chunk = file_meta.iloc[start:start + row_group_size]
+            binaries = list(pool.map(_read_file, [f'{ds.image_root}/{p}' for p in chunk.file_path.values]))
+
+            if writer is None:
+                name = f'shard_{shard:05d}.parquet'
+                writer = pq.ParquetWriter(f'{tmp_path}/{name}', schema, compression='none') # images are compressed already
             
+            table = pa.table({'dbidx':chunk.index.values.astype(np.int64), 'file_path':chunk.file_path.values, 'bytes':binaries}, schema=schema)
+            writer.write_table(table, row_group_size=row_group_size)
+            offsets.append(pd.DataFrame({'dbidx':chunk.index.values, 'shard':name, 'row':np.arange(row, row + chunk.shape[0])}))
+            written += sum(len(b) for b in binaries)
+            row += chunk.shape[0]
+
+            if written >= shard_bytes:
+                writer.close()
+                print(f'wrote {name} with {row} images')
+                writer = None
+                shard += 1
+                written = 0
+                row = 0
+
+        if writer is not None:
+            writer.close()
+
+        offsets = pd.concat(offsets, ignore_index=True) if len(offsets) > 0 else pd.DataFrame({'dbidx':[], 'shard':[], 'row':[]})
+        offsets.to_parquet(f'{tmp_path}/offsets.parquet')
+
+    print(f'packed {file_meta.shape[0]} images into {offsets.shard.nunique()} shards')
+    return offsets
+
 ### subset. need some way for tools to get path so they can build more stuff underneath
 ### index subset (easily computed)
 ### ground truth subset (easily computed)
@@ -431,7 +656,13 @@ class SeesawDatasetSubset(BaseDataset):
         ## url should be same as before
         return self.parent.get_url(dbidx, host)
 
-    def as_ray_dataset(self, limit=None, parallelism=-1) -> ray.data.Dataset:
+    def get_thumbnail_url(self, dbidx, size, box=None, host='/') -> str:
+        return self.parent.get_thumbnail_url(dbidx, size, box=box, host=host)
+
+    def get_image_size(self, dbidx):
+        return self.parent.get_image_size(dbidx)
+
+    def as_ray_dataset(self, limit=None, parallelism=-1, dbidx_range=None, exclude=None) -> ray.data.Dataset:
         raise NotImplementedError()
     
 
@@ -465,5 +696,11 @@ class LeaveOneOutSubset(BaseDataset):
         ## url should be same as before
         return self.parent.get_url(dbidx, host)
 
-    def as_ray_dataset(self, limit=None, parallelism=-1) -> ray.data.Dataset:
+    def get_thumbnail_url(self, dbidx, size, box=None, host='/') -> str:
+        return self.parent.get_thumbnail_url(dbidx, size, box=box, host=host)
+
+    def get_image_size(self, dbidx):
+        return self.parent.get_image_size(dbidx)
+
+    def as_ray_dataset(self, limit=None, parallelism=-1, dbidx_range=None, exclude=None) -> ray.data.Dataset:
         raise NotImplementedError()
@@ -27,6 +27,7 @@ class CoarseIndex(AccessMethod):
         self.vectors = vectors
         self.vector_meta = vector_meta
         self.all_indices = pr.FrozenBitMap(self.vector_meta.dbidx.values)
+        self._init_row_ranges()
         # assert len(self.images) >= self.vectors.shape[0]
 
     def string2vec(self, string: str) -> np.ndarray:
@@ -113,9 +114,7 @@ class CoarseQuery(InteractiveQuery):
         super().__init__(db)
 
     def getXy(self, get_positions=False):
-        positions = np.array(
-            [self.index.all_indices.rank(idx) - 1 for idx in self.label_db.get_seen()]
-        ).astype('int')
+        positions = self.index.dbidx2first_row(np.array(self.label_db.get_seen()))
 
         Xt = self.index.vectors[positions]
         yt = np.array(
@@ -132,3 +131,9 @@ class CoarseQuery(InteractiveQuery):
             return pos, neg
         else:
             return Xt, yt.astype('float')
+
+    def image_labels(self, dbidx):
+        boxes = self.label_db.get(dbidx, format="box")
+        if boxes is None:
+            return None
+        return self.index.dbidx2first_row(np.array([dbidx])), np.array([float(len(boxes) > 0)])
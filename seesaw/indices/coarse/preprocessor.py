@@ -19,7 +19,67 @@ def infer_coarse_embedding(pdtab):
     return ser.assign(vectors=TensorArray(normres))
 
 
+def _normalize(vecs):
+    return vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-6)
+
+def _group_sums(dbidxs, vecs, counts=None):
+    """ sums the vectors (and counts, default 1 per vector) of each run of equal (sorted) dbidxs """
+    starts = np.concatenate([[0], np.nonzero(np.diff(dbidxs))[0] + 1]).astype(np.int64)
+    if counts is None:
+        counts = np.ones(dbidxs.shape[0], dtype=np.int64)
+    return dbidxs[starts], np.add.reduceat(vecs.astype(np.float64), starts, axis=0), np.add.reduceat(counts, starts)
+
+def _coarse_file_partials(path, batch_size=50000):
+    """ streams one fine grained vector file (sorted by dbidx) and returns (dbidxs, vector sums, counts)
+        over the top zoom level of each image. memory is bounded by the file's images, not its tiles.
+    """
+    import pyarrow.parquet as pq
+    import ray.data.extensions # registers the tensor extension type
+
+    acc = []
+    pf = pq.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size=batch_size, columns=['dbidx', 'zoom_level', 'max_zoom_level', 'vectors']):
+        cols = dict(zip(batch.schema.names, batch.columns))
+        mask = cols['zoom_level'].to_numpy() == cols['max_zoom_level'].to_numpy()
+        if not mask.any():
+            continue
+        dbidxs = cols['dbidx'].to_numpy()[mask]
+        vecs = cols['vectors'].to_numpy()[mask]
+        acc.append(_group_sums(dbidxs, vecs))
+
+    if len(acc) == 0:
+        return np.zeros(0, dtype=np.int64), None, np.zeros(0, dtype=np.int64)
+
+    ## an image can span batches: sum again over the concatenated per batch sums
+    dbidxs, sums, counts = [np.concatenate(x) for x in zip(*acc)]
+    return _group_sums(dbidxs, sums, counts)
+
+def _write_coarse(path, dbidxs, sums, counts):
+    from ray.data.extensions import TensorArray
+    import pandas as pd
+    vecs = _normalize(sums / counts.reshape(-1, 1)).astype(np.float32)
+    pd.DataFrame({'dbidx':dbidxs, 'vectors':TensorArray(vecs)}).to_parquet(path)
+
+def _coarse_part(input_path, output_prefix):
+    """ writes the coarse vectors of the images inside the file to {output_prefix}_1.parquet.
+        the first and last image may continue in the neighbouring files, so their partial sums are returned instead.
+    """
+    dbidxs, sums, counts = _coarse_file_partials(input_path)
+    if dbidxs.shape[0] == 0:
+        return []
+
+    if dbidxs.shape[0] > 2:
+        _write_coarse(f'{output_prefix}_1.parquet', dbidxs[1:-1], sums[1:-1], counts[1:-1])
+
+    edges = [0] if dbidxs.shape[0] == 1 else [0, dbidxs.shape[0] - 1]
+    return [(slot, dbidxs[i], sums[i], counts[i]) for (slot, i) in zip([0, 2], edges)]
+
 def from_fine_grained(fine_grained_path, output_path):
+    """ averages the top level tile vectors of each image into one vector per image.
+        runs one streaming task per fine grained vector file. the files are dbidx sorted, so only
+        the first and last image of each file can be split across files, those are merged here 
+        and written to their own part files, named so that every part sorts in dbidx order.
+    """
     fine_grained_path = resolve_path(fine_grained_path)
     output_path = resolve_path(output_path)
     assert os.path.isdir(fine_grained_path)
@@ -44,9 +104,24 @@ def from_fine_grained(fine_grained_path, output_path):
     vector_path = f"{output_path}/vectors"
     os.makedirs(vector_path)
 
-    df = ray.data.read_parquet(f"{fine_grained_path}/vectors.sorted.cached").to_pandas()
-    coarse_emb = infer_coarse_embedding(df)
-    assert coarse_emb.dbidx.is_monotonic_increasing
-    coarse_emb.to_parquet(vector_path + "/part0.parquet")
+    input_folder = f"{fine_grained_path}/vectors.sorted.cached"
+    input_files = sorted(f for f in os.listdir(input_folder) if f.endswith('.parquet'))
+    coarse_part = ray.remote(_coarse_part)
+    refs = [coarse_part.remote(f'{input_folder}/{f}', f'{vector_path}/part_{k:05d}') for (k, f) in enumerate(input_files)]
+
+    ## merge the edge images by dbidx, writing each one at the first (file, slot) it appears in
+    edges = {}
+    for (k, file_edges) in enumerate(ray.get(refs)):
+        for (slot, dbidx, vsum, count) in file_edges:
+            if dbidx in edges:
+                (first, prev_sum, prev_count) = edges[dbidx]
+                edges[dbidx] = (first, prev_sum + vsum, prev_count + count)
+            else:
+                edges[dbidx] = ((k, slot), vsum, count)
+
+    for (dbidx, ((k, slot), vsum, count)) in edges.items():
+        _write_coarse(f'{vector_path}/part_{k:05d}_{slot}.parquet', np.array([dbidx]), vsum.reshape(1, -1), np.array([count]))
 
+    coarse_df = get_parquet(vector_path, columns=['dbidx'], parallelism=0, cache=False)
+    assert coarse_df.dbidx.is_monotonic_increasing
     os.rename(output_path, final_output_path)
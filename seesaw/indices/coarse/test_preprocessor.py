@@ -0,0 +1,17 @@
+from seesaw.indices.coarse.preprocessor import _group_sums
+import numpy as np
+
+
+def test_group_sums():
+    dbidxs = np.array([1, 1, 2, 5, 5, 5])
+    vecs = np.arange(12).reshape(6, 2)
+    ids, sums, counts = _group_sums(dbidxs, vecs)
+    assert (ids == [1, 2, 5]).all()
+    assert (counts == [2, 1, 3]).all()
+    assert (sums == [[2, 4], [4, 5], [24, 27]]).all()
+
+    ## partial sums for the same dbidx get merged
+    ids2, sums2, counts2 = _group_sums(np.array([1, 2, 2]), sums[[0, 1, 1]], counts[[0, 1, 1]])
+    assert (ids2 == [1, 2]).all()
+    assert (counts2 == [2, 2]).all()
+    assert (sums2[1] == [8, 10]).all()
@@ -7,8 +7,45 @@ from ..definitions import resolve_path
 from ..basic_types  import get_constructor
 
 
+def dbidx_row_ranges(dbidxs : np.ndarray):
+    """ for vector metadata sorted by dbidx, returns arrays (start, end) indexed by dbidx,
+        such that rows start[d]:end[d] hold the vectors for image d.
+        dbidxs without vectors get an empty range.
+    """
+    dbidxs = np.asarray(dbidxs)
+    assert (dbidxs[1:] >= dbidxs[:-1]).all(), 'vector meta must be sorted by dbidx'
+    size = int(dbidxs[-1]) + 1 if dbidxs.shape[0] > 0 else 0
+    keys = np.arange(size)
+    start = np.searchsorted(dbidxs, keys, side='left')
+    end = np.searchsorted(dbidxs, keys, side='right')
+    return start, end
+
+
 class AccessMethod:
     path : str
+    dbidx_row_start : np.ndarray
+    dbidx_row_end : np.ndarray
+
+    def _init_row_ranges(self):
+        """ precomputes dbidx -> vector row lookup tables. call once vector_meta is set """
+        self.dbidx_row_start, self.dbidx_row_end = dbidx_row_ranges(self.vector_meta.dbidx.values)
+
+    def dbidx2first_row(self, dbidxs) -> np.ndarray:
+        """ position of the first vector of each dbidx within vectors/vector_meta """
+        dbidxs = np.asarray(dbidxs, dtype=np.int64)
+        rows = self.dbidx_row_start[dbidxs]
+        assert (rows < self.dbidx_row_end[dbidxs]).all(), 'some dbidxs have no vectors'
+        return rows
+
+    def dbidx2rows(self, dbidxs) -> np.ndarray:
+        """ positions of all vectors for the given dbidxs, in the order given """
+        dbidxs = np.asarray(dbidxs, dtype=np.int64)
+        if dbidxs.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts = self.dbidx_row_start[dbidxs]
+        lengths = self.dbidx_row_end[dbidxs] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
 
     def string2vec(self, string: str) -> np.ndarray:
         raise NotImplementedError("implement me")
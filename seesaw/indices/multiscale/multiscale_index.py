@@ -13,7 +13,7 @@ from seesaw.definitions import resolve_path
 import os
 
 
-from ...box_utils import box_iou
+from ...box_utils import box_iou, max_iou_xyxy
 
 def augment_score2(tup, vec_meta, vecs, *, agg_method, rescore_method, aug_larger):
     assert tup.shape[0] == 1
@@ -62,14 +62,18 @@ def augment_score2(tup, vec_meta, vecs, *, agg_method, rescore_method, aug_large
 
 from seesaw.box_utils import left_iou_join
 
-def match_labels_to_vectors(label_db: LabelDB, vec_meta: pd.DataFrame, target_description=None):
+def match_labels_to_vectors(label_db: LabelDB, vec_meta: pd.DataFrame, target_description=None, seen_rows : np.ndarray = None):
     ''' given a set of box labels, and a vector index with box info, 
         for each vector in an image, find the maximum label overlap with it
         and use that as a score.
 
+        seen_rows: if given, positions within vec_meta of the vectors for seen images (see AccessMethod.dbidx2rows)
     '''
-    idxs = label_db.get_seen()
-    vec_meta = vec_meta[vec_meta.dbidx.isin(idxs)]
+    if seen_rows is None:
+        idxs = label_db.get_seen()
+        vec_meta = vec_meta[vec_meta.dbidx.isin(idxs)]
+    else:
+        vec_meta = vec_meta.iloc[seen_rows]
     boxdf = label_db.get_box_df(return_description=True)
     #print(f'{boxdf=}')
 
@@ -83,6 +87,75 @@ def match_labels_to_vectors(label_db: LabelDB, vec_meta: pd.DataFrame, target_de
     return vec_meta_new
 
 
+class LabeledTileTable:
+    """ columnar equivalent of match_labels_to_vectors (vector rows, dbidx, max_iou, ys),
+        kept up to date from the label db change log so that only images whose labels
+        changed since the last call are re-matched.
+    """
+    def __init__(self, index : AccessMethod, target_description=None):
+        self.index = index
+        self.target_description = target_description
+        self.log_position = 0
+        self.rows = {} # dbidx -> vector rows of that image
+        self.max_iou = {} # dbidx -> max iou of each of those rows with the target boxes
+        self._table = None
+
+    def _target_boxes(self, cols : dict) -> np.ndarray:
+        if self.target_description is not None:
+            mask = cols['description'] == self.target_description
+        else:
+            mask = cols['marked_accepted']
+        return np.stack([cols[c][mask] for c in ['x1', 'y1', 'x2', 'y2']], axis=1)
+
+    def sync(self, label_db : LabelDB):
+        """ re-matches images changed since the last call, without materializing the table. returns them """
+        changed, self.log_position = label_db.changes_since(self.log_position)
+
+        for dbidx in changed:
+            boxes = label_db.get(dbidx, format='columns')
+            if boxes is None:
+                self.rows.pop(dbidx, None)
+                self.max_iou.pop(dbidx, None)
+                continue
+
+            rows = self.index.dbidx2rows(np.array([dbidx]))
+            tiles = self.index.vector_meta.iloc[rows][['x1', 'y1', 'x2', 'y2']].values
+            self.rows[dbidx] = rows
+            self.max_iou[dbidx] = max_iou_xyxy(tiles, self._target_boxes(boxes))
+
+        if len(changed) > 0:
+            self._table = None
+        return changed
+
+    def image_labels(self, label_db : LabelDB, dbidx : int):
+        """ (vector rows, ys) for one image, None if it has not been seen """
+        self.sync(label_db)
+        rows = self.rows.get(dbidx)
+        if rows is None:
+            return None
+        return rows, (self.max_iou[dbidx] > 0).astype('float')
+
+    def update(self, label_db : LabelDB) -> pd.DataFrame:
+        self.sync(label_db)
+        if self._table is None:
+            self._table = self._materialize()
+
+        return self._table
+
+    def _materialize(self) -> pd.DataFrame:
+        dbidxs = np.array(sorted(self.rows.keys()), dtype=np.int64)
+        if dbidxs.shape[0] == 0:
+            return pd.DataFrame({'dbidx':np.array([], dtype=np.int64), 'ys':np.array([]), 
+                                    'max_iou':np.array([], dtype=np.float32)})
+
+        rows = np.concatenate([self.rows[dbidx] for dbidx in dbidxs])
+        max_iou = np.concatenate([self.max_iou[dbidx] for dbidx in dbidxs])
+        lengths = np.array([self.rows[dbidx].shape[0] for dbidx in dbidxs])
+        return pd.DataFrame({'dbidx':np.repeat(dbidxs, lengths),
+                             'ys':(max_iou > 0).astype('float'), 
+                             'max_iou':max_iou}, index=rows)
+
+
 def filter_mask(meta, min_level_inclusive):
     gpmax = meta.groupby("dbidx").zoom_level.max().rename("zoom_level_max")
     aug_meta = pd.merge(meta, gpmax, left_on="dbidx", right_index=True)
@@ -210,11 +283,14 @@ class MultiscaleIndex(AccessMethod):
         vec_index=None,
         min_zoom_level=1,
         path : str = None,
-        excluded : pr.BitMap = None
+        excluded : pr.BitMap = None,
+        aliases : pd.DataFrame = None
     ):
+        """ aliases: (dbidx, canonical_dbidx) rows for near duplicate images stored without vectors of their own """
         self.embedding = embedding
         self.path = path
         self.excluded = pr.BitMap([]) if excluded is None else excluded
+        self.aliases = aliases
 
         if min_zoom_level == 1:
             self.vectors = vectors
@@ -229,7 +305,8 @@ class MultiscaleIndex(AccessMethod):
 
             self.vec_index = None  # no index constructed here
             self.all_indices = pr.FrozenBitMap(self.vector_meta.dbidx.values) - self.excluded
-        
+
+        self._init_row_ranges()
 
     @staticmethod
     def from_path(index_path: str, *, use_vec_index=True, **options):
@@ -259,13 +336,17 @@ class MultiscaleIndex(AccessMethod):
         ]
         fine_grained_embedding = df["vectors"].values.to_numpy()
 
+        aliases_path = f"{index_path}/vector_aliases.parquet"
+        aliases = pd.read_parquet(aliases_path) if os.path.exists(aliases_path) else None
+
         return MultiscaleIndex(
             embedding=embedding,
             vectors=fine_grained_embedding,
             vector_meta=fine_grained_meta,
             vec_index=vec_index,
             path = index_path,
-            excluded=options.get('excluded', None)
+            excluded=options.get('excluded', None),
+            aliases=aliases
         )
 
     def get_knng(self, path=None):
@@ -339,7 +420,7 @@ class MultiscaleIndex(AccessMethod):
         )
 
         candidate_id = pr.BitMap(candidate_df['dbidx'].values)
-        ilocs = np.where(self.vector_meta.dbidx.isin(candidate_id))[0]
+        ilocs = self.dbidx2rows(np.array(candidate_id))
         fullmeta : pd.DataFrame = self.vector_meta.iloc[ilocs]
         vectors = self.vectors[ilocs]
         scores = vectors @ qvec.reshape(-1)
@@ -356,11 +437,27 @@ class MultiscaleIndex(AccessMethod):
         return BoxFeedbackQuery(self)
 
     def get_data(self, dbidx) -> pd.DataFrame:
-        vmeta = self.vector_meta[self.vector_meta.dbidx == dbidx]
-        vectors = self.vectors[vmeta.index]
+        rows = self.dbidx2rows(np.array([dbidx]))
+        vmeta = self.vector_meta.iloc[rows].assign(dbidx=dbidx) # an alias is reported under its own dbidx
+        vectors = self.vectors[rows]
 
         return vmeta.assign(vectors=TensorArray(vectors))
 
+    def dbidx2rows(self, dbidxs) -> np.ndarray:
+        """ images deduplicated at extraction time (aliases) get the rows of the image they duplicate,
+            so labels on them are matched against those tiles
+        """
+        return super().dbidx2rows(self.canonical_dbidxs(dbidxs))
+
+    def canonical_dbidxs(self, dbidxs) -> np.ndarray:
+        """ maps images deduplicated at extraction time to the image whose vectors they share """
+        dbidxs = np.asarray(dbidxs, dtype=np.int64)
+        if self.aliases is None or self.aliases.shape[0] == 0 or dbidxs.shape[0] == 0:
+            return dbidxs
+        alias_dbidxs = self.aliases.dbidx.values # sorted
+        pos = np.minimum(np.searchsorted(alias_dbidxs, dbidxs), alias_dbidxs.shape[0] - 1)
+        return np.where(alias_dbidxs[pos] == dbidxs, self.aliases.canonical_dbidx.values[pos], dbidxs)
+
     def subset(self, indices: pr.BitMap) -> AccessMethod:
         mask = self.vector_meta.dbidx.isin(indices)
         if mask.all():
@@ -373,6 +470,7 @@ class MultiscaleIndex(AccessMethod):
             vectors=vectors,
             vector_meta=vector_meta,
             vec_index=None,
+            aliases=self.aliases,
         )
 
 
@@ -419,6 +517,7 @@ class BoxFeedbackQuery(InteractiveQuery):
         super().__init__(db)
         assert self.index is not None
         self.all_dbidx = pr.FrozenBitMap(self.index.vector_meta.dbidx)
+        self._tile_tables = {} # target_description -> LabeledTileTable
 
 
     def query_random(self, batch_size):
@@ -431,12 +530,22 @@ class BoxFeedbackQuery(InteractiveQuery):
         }
 
 
+    def _tile_table(self, target_description) -> LabeledTileTable:
+        table = self._tile_tables.get(target_description)
+        if table is None:
+            table = LabeledTileTable(self.index, target_description=target_description)
+            self._tile_tables[target_description] = table
+        return table
+
+    def image_labels(self, dbidx, target_description=None):
+        return self._tile_table(target_description).image_labels(self.label_db, dbidx)
+
     def getXy(self, get_positions=False, target_description=None):
-        matched_df = match_labels_to_vectors(self.label_db, self.index.vector_meta, target_description=target_description)
+        matched_df = self._tile_table(target_description).update(self.label_db)
     
         if get_positions:
             pos = matched_df.index[matched_df.ys > 0].values
             neg = matched_df.index[matched_df.ys == 0].values
             return pos, neg
         else:
-            return matched_df[['dbidx', 'ys', 'max_iou']]
\ No newline at end of file
+            return matched_df[['dbidx', 'ys', 'max_iou']]
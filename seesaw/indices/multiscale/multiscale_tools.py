@@ -7,20 +7,20 @@ from ray.data.extensions import TensorArray
 
 
 
-def rescale(im, scale, min_size):
-    (w, h) = im.size
+def _rescaled_size(size, scale, min_size):
+    (w, h) = size
     target_w = max(math.floor(w * scale), min_size)
     target_h = max(math.floor(h * scale), min_size)
-    return im.resize(size=(target_w, target_h), resample=PIL.Image.BILINEAR)
+    return (target_w, target_h)
 
-def pyramid(im, factor, abs_min):
-    ## example values: factor .71, abs_min 224
-    ## if im size is less tha the minimum, expand image to fit minimum
-    ## try following: orig size and abs min size give you bounds
-    ## returns pyramid from smaller to larger image
+def rescale(im, scale, min_size):
+    return im.resize(size=_rescaled_size(im.size, scale, min_size), resample=PIL.Image.BILINEAR)
+
+def pyramid_factors(size, factor, abs_min):
+    """ scale factors of the pyramid levels for an image of the given (w, h) size, from larger to smaller """
     assert factor < 1.0
     factor = 1.0 / factor
-    size = min(im.size)
+    size = min(size)
     end_size = abs_min
     start_size = max(size, abs_min)
 
@@ -34,6 +34,14 @@ def pyramid(im, factor, abs_min):
     factors = np.geomspace(
         start=start_scale, stop=end_scale, num=ntimes + 1, endpoint=True
     ).tolist()
+    return factors
+
+def pyramid(im, factor, abs_min):
+    ## example values: factor .71, abs_min 224
+    ## if im size is less tha the minimum, expand image to fit minimum
+    ## try following: orig size and abs min size give you bounds
+    ## returns pyramid from smaller to larger image
+    factors = pyramid_factors(im.size, factor=factor, abs_min=abs_min)
     ims = []
     for sf in factors:
         imout = rescale(im, scale=sf, min_size=abs_min)
@@ -93,28 +101,105 @@ def strided_tiling(img1, tile_size):
 
     return pd.concat(all_res, ignore_index=True)
 
-def generate_multiscale_tiling(im, tile_size, factor, min_tile_size):
-    pdf = pyramid(im, factor=factor, abs_min=tile_size)
-
-    mask = (224/pdf.scale_factor >= min_tile_size) | (pdf.index == 0) # keep largest at least
-    pdf = pdf[mask]
-    assert pdf.shape[0] > 0, 'mask eliminated all images. should keep at least one'
-
-    acc = []
-    max_zoom_level = pdf.zoom_level.max()
-    for tup in pdf.itertuples():
-        df = strided_tiling(tup.image, tile_size=tile_size)
-        df['scale_factor'] = tup.scale_factor
-        df['scale_factor'] = df.scale_factor.astype('float32')
-        df['zoom_level'] = tup.zoom_level
-        df = df.assign(scale_factor=df.scale_factor.astype('float32'), zoom_level=df.zoom_level.astype('int16'))
-        df = df.assign(**(df[['x1', 'x2', 'y1', 'y2']]/tup.scale_factor).astype('float32'))
-        acc.append(df)
-    batch_df = pd.concat(acc, ignore_index=True)
-    batch_df = batch_df.assign(patch_id=np.arange(batch_df.shape[0], dtype=np.int16), max_zoom_level=max_zoom_level)
-    batch_df = batch_df.assign(max_zoom_level=batch_df.max_zoom_level.astype('int16'))
-
-    return batch_df
+def _tiling_levels(size, tile_size, factor, min_tile_size):
+    """ pyramid levels used for tiling an image of the given (w, h) size, smallest scale first,
+        as (scale_factor, zoom_level, (w, h)) tuples. the smallest level is always kept.
+    """
+    factors = pyramid_factors(size, factor=factor, abs_min=tile_size)
+    levels = sorted(zip(factors, range(len(factors))))
+    kept = [(sf, zl) for (k, (sf, zl)) in enumerate(levels) if tile_size/sf >= min_tile_size or k == 0]
+    return [(sf, zl, _rescaled_size(size, sf, tile_size)) for (sf, zl) in kept]
+
+def _strided_grids(w, h, tile_size):
+    """ (shift_x, shift_y, rows, cols) of the four half-tile shifted grids, in the same order as strided_tiling """
+    stride = tile_size // 2
+    return [(stride*i, stride*j, (h - stride*j)//tile_size, (w - stride*i)//tile_size) for i in [0,1] for j in [0,1]]
+
+def _num_tiles(levels, tile_size):
+    return sum(rows*cols for (_, _, (w, h)) in levels for (_, _, rows, cols) in _strided_grids(w, h, tile_size))
+
+def _fill_tiles(tiles, meta, pos, arr, tile_size, scale_factor, zoom_level):
+    """ copies the strided tiles of arr (h, w, c) into tiles[pos:], and their boxes, in original image coordinates, into meta.
+        returns the position after the last tile written
+    """
+    (h, w, c) = arr.shape
+    for (shift_x, shift_y, rows, cols) in _strided_grids(w, h, tile_size):
+        n = rows*cols
+        if n == 0:
+            continue
+
+        grid = arr[shift_y:shift_y + rows*tile_size, shift_x:shift_x + cols*tile_size].reshape(rows, tile_size, cols, tile_size, c)
+        tiles[pos:pos + n].reshape(rows, cols, tile_size, tile_size, c)[...] = grid.transpose(0, 2, 1, 3, 4)
+
+        ii, jj = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+        x1 = jj.reshape(-1)*tile_size + shift_x
+        y1 = ii.reshape(-1)*tile_size + shift_y
+        meta['x1'][pos:pos + n] = x1/scale_factor
+        meta['y1'][pos:pos + n] = y1/scale_factor
+        meta['x2'][pos:pos + n] = (x1 + tile_size)/scale_factor
+        meta['y2'][pos:pos + n] = (y1 + tile_size)/scale_factor
+        meta['scale_factor'][pos:pos + n] = scale_factor
+        meta['zoom_level'][pos:pos + n] = zoom_level
+        pos += n
+    return pos
+
+_tile_meta_dtypes = {'x1':np.float32, 'y1':np.float32, 'x2':np.float32, 'y2':np.float32, 'scale_factor':np.float32, 
+                    'zoom_level':np.int16, 'patch_id':np.int16, 'max_zoom_level':np.int16}
+
+def _level_images(im, sizes, fast_decode):
+    """ im resized to each of the given sizes (smallest first), in RGB mode.
+        fast_decode: jpegs are decoded directly at the smallest DCT scale (1/2, 1/4 or 1/8) that is still at least as
+        large as the largest level, and each level is resized from the next larger one rather than from the full image.
+        the image must not be loaded yet for the reduced decode to apply.
+    """
+    if fast_decode and im.format == 'JPEG':
+        im.draft('RGB', sizes[-1])
+
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+
+    if not fast_decode:
+        return [im.resize(size=size, resample=PIL.Image.BILINEAR) for size in sizes]
+
+    ims = []
+    for size in reversed(sizes):
+        im = im.resize(size=size, resample=PIL.Image.BILINEAR)
+        ims.append(im)
+    return ims[::-1]
+
+def multiscale_tiling_batch(images, tile_size, factor, min_tile_size, fast_decode=False):
+    """ strided tiles over the pyramid of each PIL image, all written into one preallocated uint8 array.
+        returns (tiles, meta, counts): tiles has shape (n, tile_size, tile_size, 3), 
+        meta maps each column (see _tile_meta_dtypes) to a numpy array of length n,
+        counts[i] is the number of tiles of images[i], which come in order.
+        image sizes are read from the header, so the array is allocated before decoding anything.
+        fast_decode: see _level_images. tiles and boxes correspond one to one with the default path, pixels differ slightly.
+    """
+    all_levels = [_tiling_levels(im.size, tile_size=tile_size, factor=factor, min_tile_size=min_tile_size) for im in images]
+    counts = np.array([_num_tiles(levels, tile_size) for levels in all_levels], dtype=np.int64)
+    total = int(counts.sum())
+
+    tiles = np.empty((total, tile_size, tile_size, 3), dtype=np.uint8)
+    meta = {c:np.empty(total, dtype=t) for (c,t) in _tile_meta_dtypes.items()}
+
+    pos = 0
+    for (im, levels, count) in zip(images, all_levels, counts):
+        start = pos
+        level_ims = _level_images(im, [size for (_, _, size) in levels], fast_decode=fast_decode)
+        for (level_im, (scale_factor, zoom_level, _)) in zip(level_ims, levels):
+            arr = np.asarray(level_im)
+            pos = _fill_tiles(tiles, meta, pos, arr, tile_size=tile_size, scale_factor=scale_factor, zoom_level=zoom_level)
+
+        assert pos - start == count
+        meta['patch_id'][start:pos] = np.arange(count)
+        meta['max_zoom_level'][start:pos] = max(zl for (_, zl, _) in levels)
+
+    return tiles, meta, counts
+
+def generate_multiscale_tiling(im, tile_size, factor, min_tile_size, fast_decode=False):
+    tiles, meta, _ = multiscale_tiling_batch([im], tile_size=tile_size, factor=factor, min_tile_size=min_tile_size, 
+                                                fast_decode=fast_decode)
+    return pd.DataFrame({'tile':TensorArray(tiles), **meta})
 
 def display_tiles(res):
     from IPython.display import display
@@ -140,29 +225,65 @@ def multiscale_preproc_tup(rowtup, min_tile_size):
         tile_df = None
     return tile_df
 
-def multiscale_preproc_batch(batch_df, min_tile_size):
-    dfs =[]
-    for tup in batch_df.itertuples():
-        tile_df = multiscale_preproc_tup(tup, min_tile_size=min_tile_size)
-        if tile_df is None:
-            continue # empty df messes up types
-        
-        tile_df = tile_df.assign(**tup._asdict())
-        tile_df = tile_df.drop(['bytes', 'Index'], axis=1)
-        dfs.append(tile_df)
-
-
-    ### reorder id columns to show up first.
-    cols = ['dbidx', 'file_path', 'patch_id']
-    res = pd.concat(dfs, ignore_index=True)
-
-    for i,c in enumerate(cols):
-        colval = res[c]
-        res = res.drop([c], axis=1)
-        res.insert(i, c, colval)
-        
-    return res
+def multiscale_preproc_batch(batch_df, min_tile_size, fast_decode=False, exclude=None):
+    """ exclude: dbidxs to skip, eg. duplicates of another image (see find_duplicate_images) """
+    if exclude is not None: # membership per row, isin would convert the whole bitmap on every batch
+        batch_df = batch_df[np.array([d not in exclude for d in batch_df.dbidx.values], dtype=bool)]
+
+    images = []
+    positions = []
+    for (i, tup) in enumerate(batch_df.itertuples()):
+        try:
+            images.append(PIL.Image.open(io.BytesIO(tup.bytes)))
+            positions.append(i)
+        except PIL.UnidentifiedImageError:
+            warnings.warn(f'error parsing binary {tup.file_path}. Ignoring...')
+
+    tiles, meta, counts = multiscale_tiling_batch(images, factor=.5, tile_size=224, min_tile_size=min_tile_size, 
+                                                    fast_decode=fast_decode)
+    image_cols = batch_df.drop(['bytes'], axis=1).iloc[np.repeat(np.array(positions, dtype=np.int64), counts)]
+
+    ### id columns show up first.
+    cols = {'dbidx':image_cols.dbidx.values, 'file_path':image_cols.file_path.values, 'patch_id':meta.pop('patch_id'), 
+            'tile':TensorArray(tiles), **meta}
+    for c in image_cols.columns:
+        if c not in cols:
+            cols[c] = image_cols[c].values
+
+    return pd.DataFrame(cols)
+
+
+def dhash(im, hash_size=8) -> bytes:
+    """ perceptual difference hash: signs of the horizontal gradients of a (hash_size + 1) x hash_size grayscale thumbnail.
+        near identical images (re-encoded, slightly shifted video frames) get the same hash
+    """
+    if im.format == 'JPEG':
+        im.draft('L', (8*hash_size, 8*hash_size)) # no need to decode at full resolution
+    arr = np.asarray(im.convert('L').resize((hash_size + 1, hash_size), resample=PIL.Image.BILINEAR), dtype=np.int16)
+    return np.packbits(arr[:, 1:] > arr[:, :-1]).tobytes()
 
+def image_hash_batch(batch_df, hash_size):
+    hashes = []
+    for tup in batch_df.itertuples():
+        try:
+            hashes.append(dhash(PIL.Image.open(io.BytesIO(tup.bytes)), hash_size=hash_size))
+        except PIL.UnidentifiedImageError:
+            hashes.append(None) # never a duplicate
+    return pd.DataFrame({'dbidx':batch_df.dbidx.values, 'hash':hashes})
+
+def find_duplicate_images(ds, hash_size=8) -> pd.DataFrame:
+    """ groups the images of ds by dhash. returns an alias table with a row (dbidx, canonical_dbidx)
+        for each image that duplicates another one. the canonical image of a group is the one with the smallest dbidx.
+    """
+    import ray
+    hash_ds = ds.as_ray_dataset(parallelism=100).map_batches(image_hash_batch, batch_format='pandas', batch_size=50, 
+                                                                fn_kwargs=dict(hash_size=hash_size))
+    hashes = pd.concat(ray.get(hash_ds.to_pandas_refs()), ignore_index=True).dropna(subset=['hash'])
+    canonical = hashes.groupby('hash').dbidx.transform('min')
+    aliases = pd.DataFrame({'dbidx':hashes.dbidx.values, 'canonical_dbidx':canonical.values})
+    aliases = aliases[aliases.dbidx != aliases.canonical_dbidx].sort_values('dbidx').reset_index(drop=True)
+    print(f'found {aliases.shape[0]} duplicates among {hashes.shape[0]} images')
+    return aliases
 
 def batch_tx(batch_df):
     import torch
@@ -183,54 +304,334 @@ def batch_tx(batch_df):
     return batch_df.assign(tile=TensorArray(normalized.numpy()))
 
 from seesaw.models.model import ImageEmbedding
+from seesaw.util import reset_num_cpus
+from .pipeline_stats import new_stats_collector, record_batch, timed_batch, drop_ready_col, stage_sums, merge_stage_sums, stage_report
+import time
 
 class InferenceActor:
-    def __init__(self, model_path):
-        self.model = ImageEmbedding(device='cuda:0', 
+    def __init__(self, model_path, device=None, num_cpus=None, precision='fp32', stats=None):
+        """ device: defaults to cuda:0 when available, else cpu.
+            num_cpus: intra-op threads for cpu inference.
+            precision: 'fp32', 'bf16' (autocast) or 'int8' (dynamic quantization of the linear layers, cpu only)
+            stats: StageStatsCollector actor to record batch timings into, or None
+        """
+        import torch
+        if device is None:
+            device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+        assert precision in ['fp32', 'bf16', 'int8']
+        assert precision != 'int8' or device == 'cpu', 'dynamic quantization only runs on cpu'
+
+        if num_cpus is not None:
+            reset_num_cpus(num_cpus)
+
+        self.device = device
+        self.precision = precision
+        self.num_threads = torch.get_num_threads()
+        self.model = ImageEmbedding(device=device, 
                                     jit_path=model_path, 
                                     add_slide=False)
 
+        if precision == 'int8':
+            self.model.model = torch.quantization.quantize_dynamic(self.model.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self.stats = stats
+        self.num_tiles = 0
+        self.num_batches = 0
+        self.total_time = 0.
+
+    def _gpu_util(self):
+        import torch
+        if not self.device.startswith('cuda'):
+            return None
+        try:
+            return float(torch.cuda.utilization(self.device))
+        except Exception: # needs pynvml
+            return None
+
     def __call__(self, batch_df):
+        start, cpu_start = time.time(), time.process_time()
+        batch_in = batch_df
         if not isinstance(batch_df.tile.values, TensorArray):
             batch_df = batch_df.assign(tile=TensorArray(batch_df.tile.values))
 
         arr = batch_df.tile.values.to_numpy()
         import torch
         tensor = torch.from_numpy(arr).to(self.model.device)
-        ans = self.model(preprocessed_image=tensor).to(torch.float32)
-        batch_df = batch_df.drop(['tile'], axis=1).assign(vectors=TensorArray(ans.to('cpu').numpy()))
+        with torch.autocast(device_type=self.device.split(':')[0], dtype=torch.bfloat16, enabled=(self.precision == 'bf16')):
+            ans = self.model(preprocessed_image=tensor).to(torch.float32)
+        ans = ans.to('cpu').numpy()
+        self._record_throughput(arr.shape[0], time.time() - start)
+
+        batch_df = batch_df.drop(['tile'], axis=1).assign(vectors=TensorArray(ans))
+        if self.stats is not None:
+            batch_df = record_batch(self.stats, stage='inference', batch_in=batch_in, batch_out=batch_df, 
+                                    start=start, cpu_start=cpu_start, gpu_util=self._gpu_util())
         return batch_df
 
+    def _record_throughput(self, num_tiles, elapsed):
+        self.num_tiles += num_tiles
+        self.total_time += elapsed
+        self.num_batches += 1
+        if self.num_batches % 10 == 0:
+            tiles_per_sec = self.num_tiles / self.total_time
+            print(f'InferenceActor {self.device=} {self.precision=}: {tiles_per_sec:.1f} tiles/s, '
+                    f'{tiles_per_sec/self.num_threads:.1f} tiles/s per core ({self.num_threads} threads)')
+
 from seesaw.util import transactional_folder, is_valid_filename
 from seesaw.definitions import resolve_path
+from pydantic import BaseModel
+from typing import Optional
 import json
 
-def run_multiscale_extraction_pipeline(ds, model_path, vector_output_path, min_tile_size):
+class ExtractionTuning(BaseModel):
+    """ batch and pool sizes for run_multiscale_extraction_pipeline, see calibrate_extraction """
+    preproc_batch_size : int = 5 # images per preprocessing call
+    preproc_blocks_factor : int = 10 # blocks after preprocessing, per input block
+    inference_batch_size : int = 200 # tiles per normalization and inference call
+    output_blocks : int = 30
+    max_actors : Optional[int] = None # inference pool size, defaults to 2 on gpu, see _default_cpu_actors on cpu
+    preproc_cpu_fraction : float = .25 # on cpu, share of the cores kept free for preprocessing when max_actors is not set
+
+def _default_cpu_actors(total_cpus, cpus_per_actor, preproc_cpu_fraction):
+    """ inference actors fitting in the cpus left after reserving preproc_cpu_fraction of them (at least one) 
+        for the preprocessing tasks feeding the pool 
+    """
+    reserved = max(1, math.ceil(total_cpus*preproc_cpu_fraction))
+    return max(1, (total_cpus - reserved) // cpus_per_actor)
+
+
+def _count_parquet_rows(path):
+    import pyarrow.parquet as pq
+    import glob
+    return sum(pq.read_metadata(f).num_rows for f in glob.glob(f'{path}/*.parquet'))
+
+def run_multiscale_extraction_pipeline(ds, model_path, vector_output_path, min_tile_size, 
+                                        device='cuda', precision='fp32', cpus_per_actor=4, fast_decode=False, dbidx_range=None, 
+                                        exclude_dbidxs=None, tuning : ExtractionTuning = None, collect_stats=True):
+    """ dbidx_range: (start, end) to only extract images with start <= dbidx < end.
+        exclude_dbidxs: images to skip, eg. the duplicates found by find_duplicate_images.
+        fast_decode: reduced resolution jpeg decoding, see _level_images.
+        device 'cuda' runs inference on up to 2 gpu actors.
+        device 'cpu' runs a pool of actors with cpus_per_actor intra-op threads each, sized to the cluster cpus
+        minus a preprocessing share (see ExtractionTuning.preproc_cpu_fraction).
+        precision: see InferenceActor.
+        tuning: batch and pool sizes, defaults to ExtractionTuning().
+        collect_stats: records per stage timings (see pipeline_stats), returned under 'stages'.
+        returns throughput stats for the whole run.
+    """
+    import ray
     from ray.data import ActorPoolStrategy
 
-    rds = ds.as_ray_dataset(parallelism=100)
-
-    (rds.map_batches(multiscale_preproc_batch, batch_format='pandas', batch_size=5, 
-                                fn_kwargs=dict(min_tile_size=min_tile_size))
-            .repartition(num_blocks=rds.num_blocks()*10)
-            .map_batches(batch_tx, batch_format='pandas', batch_size=200)
-            .map_batches(InferenceActor, batch_format='pandas', batch_size=200,
-                        compute=ActorPoolStrategy(min_size=1, max_size=2), 
-                        fn_constructor_kwargs=dict(model_path=model_path), num_gpus=1)
-            .repartition(num_blocks=30)
+    tuning = ExtractionTuning() if tuning is None else tuning
+    stats_actor = new_stats_collector() if collect_stats else None
+
+    if device == 'cuda':
+        max_actors = tuning.max_actors or 2
+        inference_kwargs = dict(compute=ActorPoolStrategy(min_size=1, max_size=max_actors), num_gpus=1,
+                                fn_constructor_kwargs=dict(model_path=model_path, device='cuda:0', precision=precision, 
+                                                            stats=stats_actor))
+        num_cores = None
+    elif device == 'cpu':
+        total_cpus = int(ray.available_resources().get('CPU', 1))
+        max_actors = tuning.max_actors or _default_cpu_actors(total_cpus, cpus_per_actor, tuning.preproc_cpu_fraction)
+        inference_kwargs = dict(compute=ActorPoolStrategy(min_size=1, max_size=max_actors), num_cpus=cpus_per_actor,
+                                fn_constructor_kwargs=dict(model_path=model_path, device='cpu', 
+                                                            num_cpus=cpus_per_actor, precision=precision, stats=stats_actor))
+        num_cores = max_actors * cpus_per_actor
+        print(f'cpu inference: up to {max_actors} actors with {cpus_per_actor} threads each, {total_cpus=}')
+    else:
+        assert False, f'unknown {device=}'
+
+    start = time.time()
+    rds = ds.as_ray_dataset(parallelism=100, dbidx_range=dbidx_range, exclude=exclude_dbidxs) # excluded images are never read
+
+    preproc_kwargs = dict(min_tile_size=min_tile_size, fast_decode=fast_decode)
+    (rds.map_batches(timed_batch, batch_format='pandas', batch_size=tuning.preproc_batch_size, 
+                                fn_kwargs=dict(fn=multiscale_preproc_batch, stage='preproc', stats=stats_actor, fn_kwargs=preproc_kwargs))
+            .repartition(num_blocks=rds.num_blocks()*tuning.preproc_blocks_factor)
+            .map_batches(timed_batch, batch_format='pandas', batch_size=tuning.inference_batch_size,
+                                fn_kwargs=dict(fn=batch_tx, stage='tx', stats=stats_actor, fn_kwargs={}))
+            .map_batches(InferenceActor, batch_format='pandas', batch_size=tuning.inference_batch_size, **inference_kwargs)
+            .repartition(num_blocks=tuning.output_blocks)
+            .map_batches(timed_batch, batch_format='pandas', # also measures the wait in the repartition before writing
+                                fn_kwargs=dict(fn=drop_ready_col, stage='output', stats=stats_actor, fn_kwargs={}, last=True))
             .write_parquet(vector_output_path)
     )
 
+    elapsed = time.time() - start
+    num_tiles = _count_parquet_rows(vector_output_path)
+    stats = {'device':device, 'precision':precision, 'num_tiles':num_tiles, 'elapsed':elapsed, 
+                'tiles_per_sec':num_tiles/elapsed}
+    if num_cores is not None:
+        stats['tiles_per_sec_per_core'] = stats['tiles_per_sec']/num_cores
+    print(f'extraction done {stats=}')
+
+    if stats_actor is not None:
+        stats['stages'] = stage_sums(ray.get(stats_actor.get.remote()))
+        ray.kill(stats_actor)
+        for (stage, rates) in stage_report(stats['stages']).items():
+            print(f'{stage=} {rates=}')
+    return stats
+
+def calibrate_extraction(ds, *, sample_size=500, target_batch_seconds=1., device='cuda', cpus_per_actor=4, **pipeline_kwargs) -> ExtractionTuning:
+    """ runs the pipeline with the default tuning over the first sample_size images, then picks
+        batch sizes so preprocessing and inference calls take about target_batch_seconds each.
+        on cpu, sizes the inference pool so inference keeps up with preprocessing on the remaining cores.
+        on gpu, uses one actor per gpu.
+    """
+    import ray
+    import tempfile
+    dbidxs = np.sort(ds.file_meta.index.values)[:sample_size]
+    with tempfile.TemporaryDirectory() as tmp_path:
+        stats = run_multiscale_extraction_pipeline(ds, vector_output_path=f'{tmp_path}/vectors', device=device, cpus_per_actor=cpus_per_actor,
+                                                    dbidx_range=(int(dbidxs[0]), int(dbidxs[-1]) + 1), collect_stats=True, **pipeline_kwargs)
+
+    report = stage_report(stats['stages'])
+    assert 'preproc' in report and 'inference' in report, 'calibration sample produced no tiles'
+    preproc = report['preproc']
+    inference = report['inference']
+
+    sec_per_image = preproc['wall']/preproc['rows_in']
+    sec_per_tile = inference['wall']/inference['rows_in']
+    tiles_per_image = preproc['rows_out']/preproc['rows_in']
+
+    tuning = ExtractionTuning(
+        preproc_batch_size=int(np.clip(round(target_batch_seconds/sec_per_image), 1, 50)),
+        inference_batch_size=int(np.clip(round(target_batch_seconds/sec_per_tile/32)*32, 32, 1024)),
+    )
+
+    if device == 'cpu':
+        ## n actors embed n/sec_per_tile tiles/s, the remaining cores preprocess (total - n*cpus_per_actor)*tiles_per_image/sec_per_image
+        total_cpus = int(ray.available_resources().get('CPU', 1))
+        preproc_rate = tiles_per_image/sec_per_image
+        inference_rate = 1./sec_per_tile
+        balanced = total_cpus*preproc_rate/(inference_rate + cpus_per_actor*preproc_rate)
+        tuning.max_actors = int(np.clip(round(balanced), 1, max(1, (total_cpus - 1) // cpus_per_actor))) # leave a core to preprocessing
+    else:
+        tuning.max_actors = max(1, int(ray.cluster_resources().get('GPU', 1)))
+
+    print(f'calibrated {tuning=} from {sec_per_image=:.3f} {sec_per_tile=:.4f} {tiles_per_image=:.1f}')
+    return tuning
+
+import os
+import shutil
+import pyroaring as pr
+
+def _part_ranges(dbidxs, part_size):
+    """ splits the sorted dbidxs into [start, end) ranges of part_size images each """
+    n = dbidxs.shape[0]
+    return [(int(dbidxs[i]), int(dbidxs[min(i + part_size, n) - 1]) + 1) for i in range(0, n, part_size)]
+
+def _dump_json_atomic(obj, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+def run_extraction_parts(ds, parts_path, *, part_size, output_params, **pipeline_kwargs) -> dict:
+    """ runs the extraction pipeline one dbidx range (part_size images) at a time, each part written to parts_path/part_{k:05d}.
+        parts_path/manifest.json records each finished part with its range and timing, so rerunning after a failure
+        skips the finished parts and only extracts the missing ranges.
+        output_params: the parameters that determine the output, parts extracted with other values are not reused.
+        returns the manifest
+    """
+    os.makedirs(parts_path, exist_ok=True)
+    manifest_path = f'{parts_path}/manifest.json'
+
+    dbidxs = np.sort(ds.file_meta.index.values)
+    config = json.loads(json.dumps({'output_params':output_params, 'part_size':part_size, 'num_images':int(dbidxs.shape[0])}))
+    if os.path.exists(manifest_path):
+        manifest = json.load(open(manifest_path))
+        if manifest['config'] != config:
+            raise Exception(f'parts in {parts_path} were extracted with {manifest["config"]=}, not {config=}. remove the folder to start over')
+    else:
+        manifest = {'config':config, 'parts':{}}
+
+    ranges = _part_ranges(dbidxs, part_size)
+    for (k, dbidx_range) in enumerate(ranges):
+        name = f'part_{k:05d}'
+        if name in manifest['parts']:
+            print(f'{name} {dbidx_range=} already extracted, skipping')
+            continue
+
+        print(f'extracting {name} ({k+1}/{len(ranges)}) {dbidx_range=}')
+        part_path = f'{parts_path}/{name}'
+        tmp_path = f'{part_path}.tmp'
+        for path in [tmp_path, part_path]: # left over by a run that failed before recording the part
+            shutil.rmtree(path, ignore_errors=True)
+
+        stats = run_multiscale_extraction_pipeline(ds, vector_output_path=tmp_path, dbidx_range=dbidx_range, **pipeline_kwargs)
+        os.rename(tmp_path, part_path)
+        manifest['parts'][name] = {'dbidx_range':list(dbidx_range), **stats}
+        _dump_json_atomic(manifest, manifest_path)
+
+    return manifest
+
+def _gather_parts(parts_path, manifest, output_path):
+    """ links the files of every part into output_path, named so they sort in dbidx order """
+    os.makedirs(output_path)
+    for name in sorted(manifest['parts']):
+        for fname in sorted(os.listdir(f'{parts_path}/{name}')):
+            src = f'{parts_path}/{name}/{fname}'
+            dst = f'{output_path}/{name}_{fname}'
+            try:
+                os.link(src, dst)
+            except OSError: # eg. a different file system
+                shutil.copy2(src, dst)
+
 from seesaw.vector_index import build_annoy_idx
 
-def create_multiscale_index(ds, index_name, model_path, min_tile_size=224, force=False, build_vec_index=False):
+def create_multiscale_index(ds, index_name, model_path, min_tile_size=224, force=False, build_vec_index=False, 
+                            device='cuda', precision='fp32', cpus_per_actor=4, fast_decode=False, part_size=10000,
+                            dedup=False, dedup_hash_size=8, auto_tune=False):
+    """ device, precision, cpus_per_actor, fast_decode: see run_multiscale_extraction_pipeline.
+        dedup: only embeds one image of each group of near duplicates (see find_duplicate_images). 
+        the others are stored as aliases of it in vector_aliases.parquet, and have no vectors of their own.
+        extraction is checkpointed in parts of part_size images under indices/.parts_{index_name} (see run_extraction_parts),
+        calling this again after a failure resumes from the finished parts.
+        the index folder itself is still created atomically, once every part is done.
+        auto_tune: picks batch and pool sizes with calibrate_extraction before extracting.
+        per stage throughput over all parts is saved in extraction_report.json.
+    """
     assert is_valid_filename(index_name), index_name
 
     index_output_path = f'{ds.path}/indices/{index_name}'
+    if os.path.exists(index_output_path) and not force: # fail before extracting anything
+        raise Exception(f'folder {index_output_path} already exists. use "force=True" to allow overwrite')
+
+    model_path = resolve_path(model_path)
+    parts_path = f'{ds.path}/indices/.parts_{index_name}'
+    os.makedirs(parts_path, exist_ok=True)
+
+    aliases = None
+    exclude_dbidxs = None
+    if dedup:
+        aliases_path = f'{parts_path}/aliases_{dedup_hash_size}.parquet' # also checkpointed
+        if os.path.exists(aliases_path):
+            aliases = pd.read_parquet(aliases_path)
+        else:
+            aliases = find_duplicate_images(ds, hash_size=dedup_hash_size)
+            aliases.to_parquet(aliases_path)
+        exclude_dbidxs = pr.BitMap(aliases.dbidx.values)
+
+    pipeline_kwargs = dict(model_path=model_path, min_tile_size=min_tile_size, device=device, precision=precision, 
+                            cpus_per_actor=cpus_per_actor, fast_decode=fast_decode, exclude_dbidxs=exclude_dbidxs)
+    tuning = ExtractionTuning()
+    if auto_tune:
+        tuning_path = f'{parts_path}/tuning.json' # also checkpointed
+        if os.path.exists(tuning_path):
+            tuning = ExtractionTuning.parse_file(tuning_path)
+        else:
+            tuning = calibrate_extraction(ds, **pipeline_kwargs)
+            _dump_json_atomic(tuning.dict(), tuning_path)
+
+    manifest = run_extraction_parts(ds, parts_path, part_size=part_size, 
+                                    output_params=dict(model_path=model_path, min_tile_size=min_tile_size, 
+                                                        precision=precision, fast_decode=fast_decode, 
+                                                        dedup_hash_size=dedup_hash_size if dedup else None),
+                                    tuning=tuning, **pipeline_kwargs)
 
     with transactional_folder(index_output_path, force=force) as tmp_output_path:
-        model_path = resolve_path(model_path)
-
         info = {
             "constructor": "seesaw.indices.multiscale.multiscale_index.MultiscaleIndex", 
             "model": model_path, 
@@ -238,12 +639,15 @@ def create_multiscale_index(ds, index_name, model_path, min_tile_size=224, force
         }
 
         json.dump(info, open(f'{tmp_output_path}/info.json', 'w'), indent=2)
-
-        run_multiscale_extraction_pipeline(ds, model_path=model_path, 
-                                       vector_output_path=f'{tmp_output_path}/vectors.sorted.cached',
-                                       min_tile_size=min_tile_size
-                                       )
-        
+        json.dump(manifest, open(f'{tmp_output_path}/extraction_manifest.json', 'w'), indent=2)
+        stages = merge_stage_sums([part.get('stages', {}) for part in manifest['parts'].values()])
+        report = {'tuning':tuning.dict(), 'stages':stage_report(stages)}
+        json.dump(report, open(f'{tmp_output_path}/extraction_report.json', 'w'), indent=2)
+        _gather_parts(parts_path, manifest, f'{tmp_output_path}/vectors.sorted.cached')
+        if aliases is not None:
+            aliases.to_parquet(f'{tmp_output_path}/vector_aliases.parquet')
+
+    shutil.rmtree(parts_path)
 
     # now try loading it
     idx  = ds.load_index(index_name, options=dict(use_vec_index=False))
@@ -0,0 +1,95 @@
+import time
+import pandas as pd
+
+_ready_col = '_ready_at' # time at which the upstream stage finished the row, to measure queue wait
+
+class StageStatsCollector:
+    """ ray actor receiving one record per batch from every instrumented stage """
+    def __init__(self):
+        self.records = []
+
+    def add(self, record : dict):
+        self.records.append(record)
+
+    def get(self):
+        return self.records
+
+def new_stats_collector():
+    import ray
+    return ray.remote(StageStatsCollector).remote()
+
+def _batch_bytes(batch_df):
+    return int(batch_df.memory_usage(index=False, deep=True).sum())
+
+def record_batch(stats, *, stage, batch_in, batch_out, start, cpu_start, gpu_util=None, stamp=True):
+    """ sends the record for a batch processed by stage and, unless stamp=False, stamps the output rows with their ready time """
+    end = time.time()
+    wait = None
+    if _ready_col in batch_in.columns and batch_in.shape[0] > 0:
+        wait = start - batch_in[_ready_col].max()
+
+    stats.add.remote({'stage':stage, 'rows_in':batch_in.shape[0], 'rows_out':batch_out.shape[0],
+                        'bytes_out':_batch_bytes(batch_out), 'start':start, 'end':end, 'wall':end - start,
+                        'cpu':time.process_time() - cpu_start, 'wait':wait, 'gpu_util':gpu_util})
+    if not stamp:
+        return batch_out
+    return batch_out.assign(**{_ready_col:end})
+
+def timed_batch(batch_df, *, fn, stage, stats, fn_kwargs, last=False):
+    """ runs fn(batch_df, **fn_kwargs) as a map_batches stage, recording its timing into stats (if not None).
+        last: the output is not stamped, use for the stage before writing
+    """
+    start, cpu_start = time.time(), time.process_time()
+    batch_out = fn(drop_ready_col(batch_df), **fn_kwargs)
+    if stats is None:
+        return batch_out
+
+    return record_batch(stats, stage=stage, batch_in=batch_df, batch_out=batch_out, start=start, cpu_start=cpu_start, stamp=not last)
+
+def drop_ready_col(batch_df):
+    return batch_df.drop([_ready_col], axis=1, errors='ignore')
+
+def stage_sums(records) -> dict:
+    """ per stage totals of the batch records, these add up across runs (see stage_report) """
+    if len(records) == 0:
+        return {}
+
+    df = pd.DataFrame.from_records(records)
+    sums = {}
+    for (stage, sdf) in df.groupby('stage', sort=False):
+        waits = sdf.wait.dropna()
+        gpu_utils = sdf.gpu_util.dropna()
+        sums[stage] = {'batches':int(sdf.shape[0]), 'rows_in':int(sdf.rows_in.sum()), 'rows_out':int(sdf.rows_out.sum()),
+                        'bytes_out':int(sdf.bytes_out.sum()), 'wall':float(sdf.wall.sum()), 'cpu':float(sdf.cpu.sum()),
+                        'span':float(sdf.end.max() - sdf.start.min()),
+                        'wait':float(waits.sum()), 'waits':int(waits.shape[0]),
+                        'gpu_util':float(gpu_utils.sum()), 'gpu_utils':int(gpu_utils.shape[0])}
+    return sums
+
+def merge_stage_sums(all_sums) -> dict:
+    merged = {}
+    for sums in all_sums:
+        for (stage, s) in sums.items():
+            if stage not in merged:
+                merged[stage] = dict(s)
+            else:
+                merged[stage] = {k:merged[stage][k] + v for (k,v) in s.items()}
+    return merged
+
+def stage_report(sums) -> dict:
+    """ adds rates to the stage sums.
+        rows_per_sec: stage throughput over the time the stage was active.
+        rows_per_sec_per_worker: per batch call, ie. excluding parallelism.
+        cpu_util: process cpu time per wall second of the stage calls (can be above 1 with intra-op threads).
+        mean_wait: time rows waited in between the previous stage and this one.
+    """
+    report = {}
+    for (stage, s) in sums.items():
+        report[stage] = {**s,
+            'rows_per_sec':s['rows_out']/s['span'] if s['span'] > 0 else None,
+            'rows_per_sec_per_worker':s['rows_out']/s['wall'] if s['wall'] > 0 else None,
+            'cpu_util':s['cpu']/s['wall'] if s['wall'] > 0 else None,
+            'mean_wait':s['wait']/s['waits'] if s['waits'] > 0 else None,
+            'gpu_util':s['gpu_util']/s['gpu_utils'] if s['gpu_utils'] > 0 else None,
+        }
+    return report
@@ -0,0 +1,13 @@
+from seesaw.indices.multiscale.multiscale_index import MultiscaleIndex
+import numpy as np
+import pandas as pd
+
+
+def test_alias_rows():
+    vector_meta = pd.DataFrame({'dbidx':[0, 0, 2, 3], 'zoom_level':0, 'x1':0., 'y1':0., 'x2':1., 'y2':1.})
+    aliases = pd.DataFrame({'dbidx':[1, 4], 'canonical_dbidx':[0, 2]})
+    idx = MultiscaleIndex(embedding=None, vectors=np.eye(4, dtype=np.float32), vector_meta=vector_meta, aliases=aliases)
+    assert (idx.canonical_dbidxs([4, 1, 3]) == [2, 0, 3]).all()
+    assert (idx.dbidx2rows([1, 3]) == [0, 1, 3]).all()
+    assert (idx.get_data(4).dbidx == 4).all()
+    assert 1 not in idx.all_indices # aliases are never returned by queries
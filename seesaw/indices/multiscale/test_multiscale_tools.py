@@ -4,7 +4,8 @@ import PIL, PIL.Image
 from PIL import Image, ImageDraw, ImageFont
 import math
 
-from .multiscale_tools import reconstruct_patch, rearrange_into_tiles, strided_tiling, generate_multiscale_tiling
+import pandas as pd
+from .multiscale_tools import reconstruct_patch, rearrange_into_tiles, strided_tiling, generate_multiscale_tiling, pyramid, multiscale_tiling_batch, _part_ranges, dhash, _default_cpu_actors
 
 def create_image_with_text(text):
     # Set image dimensions and background color (white)
@@ -86,4 +87,53 @@ def test_num_patches():
 
     img1 = make_test_image(1,1)
     d1 = rearrange_into_tiles(img1, tile_size=224)
-    assert d1['tile'].shape[0] == 1
\ No newline at end of file
+    assert d1['tile'].shape[0] == 1
+
+def _reference_multiscale_tiling(im, tile_size, factor, min_tile_size):
+    """ dataframe based version of generate_multiscale_tiling """
+    pdf = pyramid(im, factor=factor, abs_min=tile_size)
+    pdf = pdf[(224/pdf.scale_factor >= min_tile_size) | (pdf.index == 0)]
+
+    acc = []
+    for tup in pdf.itertuples():
+        df = strided_tiling(tup.image, tile_size=tile_size)
+        df = df.assign(**(df[['x1', 'x2', 'y1', 'y2']]/tup.scale_factor).astype('float32'))
+        acc.append(df.assign(scale_factor=np.float32(tup.scale_factor), zoom_level=np.int16(tup.zoom_level)))
+    df = pd.concat(acc, ignore_index=True)
+    return df.assign(patch_id=np.arange(df.shape[0], dtype=np.int16), max_zoom_level=np.int16(pdf.zoom_level.max()))
+
+def test_vectorized_tiling():
+    img1 = make_test_image(2.3, 3.6)
+    img2 = make_test_image(1, 1.5)
+    for min_tile_size in [56, 224]:
+        tiles, meta, counts = multiscale_tiling_batch([img1, img2], tile_size=224, factor=.5, min_tile_size=min_tile_size)
+
+        start = 0
+        for (img, count) in zip([img1, img2], counts):
+            ref = _reference_multiscale_tiling(img, tile_size=224, factor=.5, min_tile_size=min_tile_size)
+            assert ref.shape[0] == count
+            assert (ref['tile'].values.to_numpy() == tiles[start:start + count]).all()
+            for (c, col) in meta.items():
+                assert col.dtype == ref[c].dtype, c
+                assert (col[start:start + count] == ref[c].values).all(), c
+            start += count
+        assert start == tiles.shape[0]
+
+def test_part_ranges():
+    dbidxs = np.array([0, 1, 2, 5, 6, 9, 10])
+    ranges = _part_ranges(dbidxs, part_size=3)
+    assert ranges == [(0, 3), (5, 10), (10, 11)]
+    covered = [d for d in dbidxs for (start, end) in ranges if start <= d < end]
+    assert covered == dbidxs.tolist()
+
+def test_dhash():
+    img1 = make_test_image(2, 3)
+    assert len(dhash(img1)) == 8
+    assert dhash(img1) == dhash(img1.copy())
+    assert dhash(img1) != dhash(img1.transpose(PIL.Image.FLIP_LEFT_RIGHT))
+
+def test_default_cpu_actors():
+    assert _default_cpu_actors(32, 4, .25) == 6
+    assert _default_cpu_actors(8, 4, .25) == 1 # 2 cores reserved, only one full actor fits in the rest
+    assert _default_cpu_actors(4, 4, .25) == 1 # always at least one actor
+    assert _default_cpu_actors(16, 4, 0.) == 3 # still leaves a core
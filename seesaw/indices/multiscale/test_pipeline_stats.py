@@ -0,0 +1,16 @@
+from seesaw.indices.multiscale.pipeline_stats import stage_sums, stage_report, merge_stage_sums
+
+
+def test_stage_report():
+    records = [{'stage':'a', 'rows_in':5, 'rows_out':50, 'bytes_out':100, 'start':0., 'end':2., 'wall':2., 'cpu':1., 'wait':None, 'gpu_util':None},
+               {'stage':'a', 'rows_in':5, 'rows_out':30, 'bytes_out':60, 'start':1., 'end':3., 'wall':2., 'cpu':3., 'wait':None, 'gpu_util':None},
+               {'stage':'b', 'rows_in':80, 'rows_out':80, 'bytes_out':10, 'start':3., 'end':4., 'wall':1., 'cpu':1., 'wait':.5, 'gpu_util':40.}]
+    sums = stage_sums(records)
+    report = stage_report(merge_stage_sums([sums, sums]))
+    assert report['a']['rows_out'] == 160
+    assert report['a']['rows_per_sec'] == 160/6.
+    assert report['a']['rows_per_sec_per_worker'] == 160/8.
+    assert report['a']['cpu_util'] == 1.
+    assert report['a']['mean_wait'] is None
+    assert report['b']['mean_wait'] == .5
+    assert report['b']['gpu_util'] == 40.
@@ -0,0 +1,10 @@
+from seesaw.indices.interface import AccessMethod, dbidx_row_ranges
+import numpy as np
+
+
+def test_dbidx_row_ranges():
+    am = AccessMethod()
+    am.dbidx_row_start, am.dbidx_row_end = dbidx_row_ranges(np.array([0, 0, 2, 2, 2, 5]))
+    assert (am.dbidx2first_row([5, 0, 2]) == np.array([5, 0, 2])).all()
+    assert (am.dbidx2rows([2, 1, 0, 5]) == np.array([2, 3, 4, 0, 1, 5])).all()
+    assert am.dbidx2rows([]).shape[0] == 0
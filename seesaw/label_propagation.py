@@ -42,7 +42,8 @@ class LabelPropagation:
         new_fvalues[label_ids] = label_values
         return new_fvalues
 
-    def fit_transform(self, *, label_ids, label_values, reg_values = None, start_value=None):
+    def fit_transform(self, *, label_ids, label_values, reg_values = None, start_value=None, deadline=None):
+        """ deadline (see loops.util.Deadline): if it expires before convergence, returns the latest iterate """
         if reg_values is not None:
             assert reg_values.shape[0] == self.n
             self.reg_values = reg_values
@@ -73,7 +74,13 @@ class LabelPropagation:
             else:
                 old_fvalues = new_fvalues
 
+            if deadline is not None and deadline.expired():
+                break
+
         if not converged:
-            print(f'warning: did not converge after {i} iterations')
+            if deadline is not None and deadline.hit:
+                print(f'prop. stopped at the deadline after {i} iterations')
+            else:
+                print(f'warning: did not converge after {i} iterations')
             
         return old_fvalues
@@ -1,75 +1,167 @@
 from .basic_types import Box, List
 import pandas as pd
+import numpy as np
 import pyroaring as pr
 
+_box_columns = ['x1', 'y1', 'x2', 'y2']
+_dtypes = {'dbidx':np.int32, 'x1':np.float64, 'y1':np.float64, 'x2':np.float64, 'y2':np.float64, # float64 so boxes read back exactly as put
+            'description':np.int32, 'marked_accepted':np.bool_}
+
 class LabelDB:
+    """ box labels for every seen image, stored column-wise in growable numpy arrays.
+        the rows for a dbidx are contiguous: offsets[dbidx] = (start, end).
+        putting an image again appends its new rows, stale rows are dropped on compaction.
+        descriptions are stored as integer codes into self.descriptions (-1 means None).
+    """
     def __init__(self):
-        self.ldata = {}
+        self.offsets = {}
+        self.descriptions = []
+        self._description_codes = {None:-1}
+        self._data = {c:np.zeros(16, dtype=t) for (c,t) in _dtypes.items()}
+        self._size = 0 # rows in use, including stale ones
+        self._live = 0 # rows referenced from offsets
+        self._change_log = [] # dbidxs in the order their labels were modified
 
     def get_seen(self):
-        return pr.BitMap(self.ldata.keys())
+        return pr.BitMap(self.offsets.keys())
 
-    def put(self, dbidx: int, boxes: List[Box]):
-        self.ldata[dbidx] = boxes
+    def _code(self, description):
+        code = self._description_codes.get(description)
+        if code is None:
+            code = len(self.descriptions)
+            self.descriptions.append(description)
+            self._description_codes[description] = code
+        return code
 
-    def fill(self, df):
-        for dbidx, gp in df.groupby('dbidx'):
-            gp = gp.assign(description=gp.category, marked_accepted=True)
-            df = gp[['x1', 'y1', 'x2', 'y2', 'description', 'marked_accepted']]
-            boxes = [Box(**b) for b in df.to_dict(orient="records")]
-            self.put(int(dbidx), boxes=boxes)
+    def _boxes_to_columns(self, dbidx, boxes : List[Box]) -> dict:
+        boxes = [] if boxes is None else boxes
+        cols = {c:np.array([getattr(b, c) for b in boxes], dtype=_dtypes[c]) for c in _box_columns}
+        cols['description'] = np.array([self._code(b.description) for b in boxes], dtype=np.int32)
+        cols['marked_accepted'] = np.array([b.marked_accepted for b in boxes], dtype=np.bool_)
+        cols['dbidx'] = np.full(len(boxes), dbidx, dtype=np.int32)
+        return cols
 
-    def get_box_df(self, return_description=False):
-        empty_df = pd.DataFrame([], columns=["dbidx", 'description', 'marked_accepted', "x1", "x2", "y1", "y2"]).astype("float32")
-        empty_df = empty_df.assign(dbidx=empty_df.dbidx.astype('int32'))
+    def _is_stored(self, dbidx, cols : dict) -> bool:
+        if dbidx not in self.offsets:
+            return False
+
+        start, end = self.offsets[dbidx]
+        if end - start != cols['dbidx'].shape[0]:
+            return False
+        return all((self._data[c][start:end] == cols[c]).all() for c in _dtypes)
+
+    def _append(self, dbidxs, cols : dict):
+        """ appends rows for dbidxs (sorted by dbidx) and points their offsets to them """
+        n = cols['dbidx'].shape[0]
+        if self._size + n > self._data['dbidx'].shape[0]:
+            capacity = max(2*self._data['dbidx'].shape[0], self._size + n)
+            for c in _dtypes:
+                arr = np.zeros(capacity, dtype=_dtypes[c])
+                arr[:self._size] = self._data[c][:self._size]
+                self._data[c] = arr
 
-        dfs = [ empty_df ]
+        for c in _dtypes:
+            self._data[c][self._size:self._size + n] = cols[c]
 
-        for dbidx,v in self.ldata.items():
-            if v == [] or v is None:
-                continue
-            
-            cols = ["x1", "x2", "y1", "y2", ]
-            if return_description:
-                cols.append('description')
-                cols.append('marked_accepted')
+        ## offsets for every dbidx, including the ones with no rows
+        starts = self._size + np.searchsorted(cols['dbidx'], dbidxs, side='left')
+        ends = self._size + np.searchsorted(cols['dbidx'], dbidxs, side='right')
+        for (dbidx, start, end) in zip(dbidxs, starts, ends):
+            old = self.offsets.get(dbidx)
+            if old is not None:
+                self._live -= old[1] - old[0]
+            self.offsets[dbidx] = (int(start), int(end))
 
-            df = pd.DataFrame([b.dict() for b in v])[cols]
+        self._size += n
+        self._live += n
+        self._change_log.extend(dbidxs)
 
-            df = df.assign(**df[['x1', 'x2', 'y1', 'y2']].astype('float32'))
-            df = df.assign(dbidx=dbidx)
-            df = df.assign(dbidx=df.dbidx.astype('int32'))
+        if self._size > 2*self._live + 1024:
+            self._compact()
 
-            dfs.append(df)
+    def _live_rows(self) -> np.ndarray:
+        if len(self.offsets) == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts, ends = np.array(list(self.offsets.values()), dtype=np.int64).reshape(-1, 2).T
+        lengths = ends - starts
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
 
-        c = pd.concat(dfs, ignore_index=True)
-        return c
+    def _compact(self):
+        """ drops stale rows, leaving rows in offsets order """
+        rows = self._live_rows()
+        for c in _dtypes:
+            self._data[c] = self._data[c][rows]
+
+        pos = 0
+        for (dbidx, (start, end)) in self.offsets.items():
+            self.offsets[dbidx] = (pos, pos + end - start)
+            pos += end - start
+
+        self._size = rows.shape[0]
+        self._live = rows.shape[0]
+
+    def put(self, dbidx: int, boxes: List[Box]) -> bool:
+        """ returns True if the labels for dbidx changed """
+        dbidx = int(dbidx)
+        cols = self._boxes_to_columns(dbidx, boxes)
+        if self._is_stored(dbidx, cols):
+            return False # re-sending the same labels is not a change
 
+        self._append([dbidx], cols)
+        return True
+
+    def changes_since(self, position : int):
+        """ returns the dbidxs modified after the given change log position, and the new position.
+            start from position 0 to get every labeled dbidx.
+        """
+        return pr.BitMap(self._change_log[position:]), len(self._change_log)
+
+    def fill(self, df):
+        """ bulk put of ground truth boxes (columns dbidx, x1, y1, x2, y2, category), all marked accepted """
+        df = df.sort_values('dbidx', kind='stable')
+        codes, uniques = pd.factorize(df.category)
+        code_map = np.append(np.array([self._code(u) for u in uniques], dtype=np.int32), -1) # -1 for nan
+        cols = {c:df[c].values.astype(_dtypes[c]) for c in _box_columns}
+        cols['description'] = code_map[codes]
+        cols['marked_accepted'] = np.ones(df.shape[0], dtype=np.bool_)
+        cols['dbidx'] = df.dbidx.values.astype(np.int32)
+        self._append([int(d) for d in np.unique(cols['dbidx'])], cols)
+
+    def _get_columns(self, start, end) -> dict:
+        cols = {c:self._data[c][start:end] for c in _dtypes}
+        cols['description'] = np.array(self.descriptions + [None], dtype=object)[cols['description']]
+        return cols
+
+    def get_box_df(self, return_description=False):
+        if self._size != self._live:
+            self._compact()
+
+        cols = self._get_columns(0, self._size)
+        df = pd.DataFrame({c:cols[c] for c in ["dbidx", 'description', 'marked_accepted', "x1", "x2", "y1", "y2"]}, copy=False)
+        if not return_description:
+            df = df.drop(['description', 'marked_accepted'], axis=1)
+        return df
 
     def get(self, dbidx: int, format: str):
         dbidx = int(dbidx)
-        if dbidx not in self.ldata:
+        if dbidx not in self.offsets:
             return None  # has not been seen. used when sending data
 
-        boxes = self.ldata[dbidx]
-        if boxes is None:  # seen by user but not labeled. consider negative for now
-            boxes = []
+        # seen by user but not labeled is stored as no boxes. consider negative for now
+        start, end = self.offsets[dbidx]
 
         if format == "df":
-            if boxes == []:
-                return pd.DataFrame(boxes, columns=["x1", "x2", "y1", "y2"]).astype(
-                    "float32"
-                )  # cols in case it is empty
-            else:
-                return pd.DataFrame([b.dict() for b in boxes])[
-                    ["x1", "x2", "y1", "y2"]
-                ].astype("float32")
+            return pd.DataFrame({c:self._data[c][start:end] for c in ["x1", "x2", "y1", "y2"]}, copy=False)
+        elif format == 'columns':
+            return self._get_columns(start, end)
         elif format == "box":
-            return boxes
+            cols = self._get_columns(start, end)
+            return [Box(x1=x1, y1=y1, x2=x2, y2=y2, description=desc, marked_accepted=acc)
+                        for (x1, y1, x2, y2, desc, acc) in zip(*[cols[c].tolist() for c in _box_columns + ['description', 'marked_accepted']])]
         elif format == 'binary':
-            if len(boxes) == 0:
+            if end - start == 0:
                 return 0
             else:
                 return 1
         else:
-            assert False, 'unknown format'
\ No newline at end of file
+            assert False, 'unknown format'
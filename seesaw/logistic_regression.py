@@ -10,6 +10,7 @@ from .basic_trainer import BasicTrainer
 import numpy as np
 
 import math
+import scipy.linalg
 from sklearn.preprocessing import StandardScaler
 from seesaw.rank_loss import cheap_pairwise_rank_loss
 
@@ -419,3 +420,183 @@ class LogisticRegressionPT:
             ps = logits.sigmoid()
 
         return ps.reshape(-1,1).numpy()
+
+
+class LogisticRegressionNP:
+    ''' same model and objective as LogisticRegressionPT, solved in numpy with a damped Newton method
+        (IRLS for the data term plus the exact regularizer Hessian). with a few hundred 512-d examples
+        each step is a single d x d solve, avoiding torch dispatch and module construction per fit.
+        later fits warm start from the previous solution.
+    '''
+    def __init__(self, *, class_weights, scale, reg_lambda,  
+            regularizer_vector, fit_intercept, verbose=False, max_iter=100, tol=1e-6, **kwargs):
+        ''' kwargs only used by the torch solver (eg. lr) are ignored '''
+        assert scale in ['centered', None]
+        self.class_weights = class_weights
+        self.scale = scale
+        self.reg_lambda = reg_lambda
+        self.fit_intercept = fit_intercept
+        self.verbose = verbose
+        self.max_iter = int(max_iter)
+        self.tol = tol
+        self.mu_ = None
+        self.coef_ = None
+        self.intercept_ = 0.
+        self.n_iter_ = 0
+
+        if isinstance(regularizer_vector, np.ndarray):
+            vec = regularizer_vector.reshape(-1).astype(np.float64)
+            self.regularizer_vector = vec/np.linalg.norm(vec)
+            self.regularization_type = 'vector'
+        elif isinstance(regularizer_vector, str):
+            assert regularizer_vector in ['norm1', 'norm']
+            self.regularizer_vector = None
+            self.regularization_type = regularizer_vector
+        elif regularizer_vector is None:
+            self.regularizer_vector = None
+            self.regularization_type = None
+        else:
+            assert False
+
+    def _regularizer(self, w, order):
+        ''' (weight.norm() - norm_target)**2 + (normalize(weight) - regularizer_vector).norm()**2, like _regularizer_func
+            in the torch version, with its gradient and Hessian when order == 2
+        '''
+        d = w.shape[0]
+        if self.regularization_type is None:
+            return 0., np.zeros(d), np.zeros((d,d))
+        elif self.regularization_type == 'norm':
+            return w@w, 2*w, 2*np.eye(d)
+
+        r = np.linalg.norm(w)
+        u = w/r
+        value = (r - 1.)**2
+        if self.regularization_type == 'vector':
+            vu = self.regularizer_vector@u
+            value += 2. - 2.*vu # same as ||u - v||^2 for unit v
+
+        if order == 0:
+            return value, None, None
+
+        uu = np.outer(u, u)
+        grad = 2.*(r - 1.)*u
+        hess = 2.*uu + 2.*(r - 1.)/r*(np.eye(d) - uu)
+        if self.regularization_type == 'vector':
+            v = self.regularizer_vector
+            grad += -2./r*(v - vu*u)
+            hess += 2./r**2*(np.outer(v, u) + np.outer(u, v) + vu*np.eye(d) - 3.*vu*uu)
+
+        return value, grad, hess
+
+    def _objective(self, theta, X, y, sample_weights, pos_weight, reg_weight, order):
+        ''' mean weighted cross entropy + reg_weight * regularizer. X includes a column of ones when fitting the intercept '''
+        n, d = X.shape[0], self.dim_
+        z = X@theta
+        label_weight = sample_weights*(pos_weight*y + 1. - y)/n
+        value = (sample_weights*(pos_weight*y*np.logaddexp(0., -z) + (1. - y)*np.logaddexp(0., z))).sum()/n
+
+        reg_value, reg_grad, reg_hess = self._regularizer(theta[:d], order)
+        value += reg_weight*reg_value
+        if order == 0:
+            return value, None, None
+
+        p = np.exp(-np.logaddexp(0., -z)) # sigmoid
+        grad = X.T@(label_weight*p - sample_weights*pos_weight*y/n)
+        hess = (X.T*(label_weight*p*(1. - p)))@X
+        grad[:d] += reg_weight*reg_grad
+        hess[:d,:d] += reg_weight*reg_hess
+        return value, grad, hess
+
+    @staticmethod
+    def _newton_step(grad, hess):
+        ''' solves (hess + damping*I) step = -grad with the smallest damping that makes it positive definite '''
+        damping = 0.
+        scale = max(1., np.abs(np.diag(hess)).max())
+        while True:
+            try:
+                factor = scipy.linalg.cho_factor(hess + damping*np.eye(hess.shape[0]))
+                return -scipy.linalg.cho_solve(factor, grad)
+            except np.linalg.LinAlgError:
+                damping = max(2*damping, 1e-8*scale)
+
+    def fit(self, X, y, sample_weights=None):
+        n_examples = X.shape[0]
+        X = X.astype(np.float64)
+        y = y.reshape(-1).astype(np.float64)
+        sample_weights = np.ones_like(y) if sample_weights is None else sample_weights.reshape(-1).astype(np.float64)
+
+        if self.scale == 'centered':
+            self.mu_ = X.mean(axis=0)
+            X = X - self.mu_
+
+        if self.class_weights == 'balanced':
+            pseudo_pos = max((y == 1).sum(), 1)
+            pseudo_neg = max((y == 0).sum(), 1)
+            pos_weight = pseudo_neg / pseudo_pos
+        else:
+            pos_weight = self.class_weights
+
+        reg_weight = self.reg_lambda/n_examples
+        self.dim_ = X.shape[1]
+        if self.fit_intercept:
+            X = np.concatenate([X, np.ones((n_examples, 1))], axis=1)
+
+        if self.coef_ is not None: # warm start
+            w = self.coef_
+        elif self.regularization_type == 'vector':
+            w = self.regularizer_vector.copy()
+        elif self.regularization_type == 'norm1':
+            w = np.ones(self.dim_)/math.sqrt(self.dim_)
+        else:
+            w = np.zeros(self.dim_)
+        theta = np.concatenate([w, [self.intercept_]]) if self.fit_intercept else w.copy()
+
+        args = (X, y, sample_weights, pos_weight, reg_weight)
+        value, grad, hess = self._objective(theta, *args, order=2)
+        n_iter = 0
+        for n_iter in range(self.max_iter):
+            if np.abs(grad).max() < self.tol:
+                break
+
+            step = self._newton_step(grad, hess)
+            t = 1.
+            while t > 1e-10: # backtracking line search
+                new_value, _, _ = self._objective(theta + t*step, *args, order=0)
+                if new_value <= value + 1e-4*t*(grad@step):
+                    break
+                t *= .5
+
+            theta = theta + t*step
+            value, grad, hess = self._objective(theta, *args, order=2)
+
+        if not np.isfinite(value):
+            raise ValueError('regression training failed with a nan')
+
+        self.n_iter_ = n_iter
+        self.coef_ = theta[:self.dim_]
+        self.intercept_ = theta[self.dim_] if self.fit_intercept else 0.
+        if self.verbose:
+            print(f'regression converged after {self.n_iter_} iterations. {value=} {np.abs(grad).max()=}')
+
+    def get_coeff(self):
+        return self.coef_.reshape(1,-1).astype(np.float32)
+
+    def get_intercept(self):
+        mu = 0. if self.mu_ is None else self.mu_
+        return np.array([self.intercept_ - self.coef_@mu], dtype=np.float32)
+
+    def predict_proba(self, X):
+        if self.mu_ is not None:
+            X = X - self.mu_
+        z = X.astype(np.float64)@self.coef_ + self.intercept_
+        return np.exp(-np.logaddexp(0., -z)).reshape(-1,1)
+
+
+def make_logistic_regression(*, solver='torch', **kwargs):
+    ''' solver is 'torch' (LogisticRegressionPT, LBFGS) or 'newton' (LogisticRegressionNP) '''
+    if solver == 'torch':
+        return LogisticRegressionPT(**kwargs)
+    elif solver == 'newton':
+        return LogisticRegressionNP(**kwargs)
+    else:
+        assert False, f'unknown {solver=}'
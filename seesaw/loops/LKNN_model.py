@@ -6,7 +6,61 @@ from typing import Tuple
 import pyroaring as pr
 import math
 
+def _bitmap_to_array(bitmap) -> np.ndarray:
+    """ bitmaps iterate in ascending order, so the result is sorted """
+    return np.fromiter(bitmap, dtype=np.int64, count=len(bitmap))
+
+def _sorted_isin(query : np.ndarray, sorted_ref : np.ndarray) -> np.ndarray:
+    """ boolean mask with True where query[i] is in sorted_ref """
+    if sorted_ref.shape[0] == 0:
+        return np.zeros(query.shape[0], dtype=bool)
+    pos = np.searchsorted(sorted_ref, query)
+    pos = np.minimum(pos, sorted_ref.shape[0] - 1)
+    return sorted_ref[pos] == query
+
+def _first_k_unmasked(desc_idxs, desc_scores, excluded : np.ndarray, k : int):
+    """ returns first k elements of the (descending) stream whose ids are not in excluded.
+        at most len(excluded) elements can be skipped, so we only need to look at a prefix
+    """
+    prefix = k + excluded.shape[0]
+    idxs = desc_idxs[:prefix]
+    scores = desc_scores[:prefix]
+    keep = ~_sorted_isin(idxs, excluded)
+    return idxs[keep][:k], scores[keep][:k]
+
+def merge_top_k(k : int, desc_idxs : np.ndarray, desc_scores : np.ndarray, seen : np.ndarray,
+                desc_changed_idxs : np.ndarray = None, desc_changed_scores : np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ vectorized equivalent of merging both descending streams (see LazyTopK.iter_desc) and taking the first k.
+        seen: sorted array of ids to exclude from both streams.
+        ids in desc_changed_idxs override their entries in desc_idxs.
+        on score ties, elements of the first stream come first.
+    """
+    if desc_changed_idxs is None:
+        return _first_k_unmasked(desc_idxs, desc_scores, seen, k)
+
+    changed = np.sort(desc_changed_idxs.reshape(-1))
+    ignore = np.union1d(seen, changed)
+    idxs1, scores1 = _first_k_unmasked(desc_idxs, desc_scores, ignore, k)
+    idxs2, scores2 = _first_k_unmasked(desc_changed_idxs, desc_changed_scores, seen, k)
+
+    ## merge two descending streams: final position = own rank + number of elements from the other stream ahead of it
+    neg1 = -scores1
+    neg2 = -scores2
+    pos1 = np.arange(neg1.shape[0]) + np.searchsorted(neg2, neg1, side='left')
+    pos2 = np.arange(neg2.shape[0]) + np.searchsorted(neg1, neg2, side='right')
+
+    total = neg1.shape[0] + neg2.shape[0]
+    out_idxs = np.empty(total, dtype=np.result_type(idxs1, idxs2))
+    out_scores = np.empty(total, dtype=np.result_type(scores1, scores2))
+    out_idxs[pos1] = idxs1
+    out_idxs[pos2] = idxs2
+    out_scores[pos1] = scores1
+    out_scores[pos2] = scores2
+    return out_idxs[:k], out_scores[:k]
+
 class LazyTopK:
+    """ generator based merge. kept as a reference implementation for tests of merge_top_k
+    """
     def __init__(self, dataset : Dataset, desc_idxs, desc_scores, desc_changed_idxs, desc_changed_scores):
         self.dataset : Dataset = dataset
 
@@ -105,6 +159,7 @@ class LKNNModel(ProbabilityModel):
             self.changed_idx_set = pr.FrozenBitMap()
 
         self.ignore_set = self.dataset.seen_indices.union(self.changed_idx_set)
+        self._seen_array = _bitmap_to_array(self.dataset.seen_indices)
 
     @staticmethod
     def from_dataset( dataset : Dataset, weight_matrix : sp.csr_array, gamma : np.ndarray):
@@ -150,14 +205,9 @@ class LKNNModel(ProbabilityModel):
         if curr_label is None:
             numerator_delta = y
             denominator_delta = 1
-        elif curr_label != y:
-            assert False, 'no benchmark scenario should reach this'
+        else: # label changed (eg. seen, then accepted) or repeated. neighbors already count this point
             numerator_delta = (y - curr_label)
             denominator_delta = 0
-        else:
-            assert False, 'no benchmark scenario should reach here'
-            numerator_delta = 0
-            denominator_delta = 0
 
         desc_changed_idx, desc_changed_score, score_change, num_change, denom_change = self._compute_updated_arrays(neighbors,
                      numerator_delta, denominator_delta, ret_num_denom=ret_num_denom)
@@ -265,6 +315,11 @@ class LKNNModel(ProbabilityModel):
 
     def top_k_remaining(self, top_k : int) -> Tuple[np.ndarray, np.ndarray]:
         ## cheap form of finding the top k highest scoring without materializing all scores
+        return merge_top_k(top_k, self.desc_idx, self.desc_score, self._seen_array,
+                            self.desc_changed_idx, self.desc_changed_score)
+
+    def _top_k_remaining_iter(self, top_k : int) -> Tuple[np.ndarray, np.ndarray]:
+        ## generator version of top_k_remaining, used as reference in tests
         vals = []
         idxs = []
         for i, (idx, val) in enumerate(self.iter_desc()):
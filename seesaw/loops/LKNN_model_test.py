@@ -51,3 +51,33 @@ def test_bound():
 
 
 
+
+
+def test_top_k_remaining():
+    dataset = Dataset.from_vectors(np.random.random((5,10)))
+    matrix = sp.csr_array(np.roll(np.eye(5), 1, axis=1) + np.roll(np.eye(5), -1, axis=1))
+    model = LKNNModel.from_dataset(dataset, weight_matrix=matrix, gamma=np.linspace(.1, .9, 5))
+    for k in [1, 3, 5]:
+        idxs, scores = model.condition(2, 1).top_k_remaining(top_k=k)
+        ref_idxs, ref_scores = model.condition(2, 1)._top_k_remaining_iter(top_k=k)
+        assert np.equal(idxs, ref_idxs).all()
+        assert np.isclose(scores, ref_scores).all()
+
+
+def test_label_change():
+    ## an image is first reported seen (0), then accepted (1) within the same session
+    def make_model():
+        dataset = Dataset.from_vectors(np.random.random((5,10)))
+        matrix = sp.csr_array(np.roll(np.eye(5), 1, axis=1) + np.roll(np.eye(5), -1, axis=1))
+        return LKNNModel.from_dataset(dataset, weight_matrix=matrix, gamma=np.full(5, .5))
+
+    model = make_model()
+    model.condition_(2, 0)
+    model.condition_(2, 1)
+
+    ref = make_model()
+    ref.condition_(2, 1)
+    points = np.array([0,1,2,3,4])
+    assert np.isclose(model.predict_proba(points), ref.predict_proba(points)).all()
+    assert np.equal(model.denominators, ref.denominators).all()
+    assert model.dataset.idx2label[2] == 1
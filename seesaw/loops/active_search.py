@@ -33,6 +33,13 @@ class ActiveSearch(LoopBase):
         self.scores = None
         dataset = Dataset.from_vectors(q.index.vectors)
 
+        ## planner: 'ens' (default) or 'ceas', which also needs target_positives: number of positives the user wants to find
+        planner = params.interactive_options.get('planner', 'ens')
+        assert planner in ['ens', 'ceas'], f'unknown {planner=}'
+        if planner == 'ceas':
+            target = params.interactive_options.get('target_positives')
+            assert isinstance(target, int) and target > 0, f"planner 'ceas' needs interactive_options['target_positives'] > 0, got {target=}"
+
 
         '''
         - gamma:
@@ -77,13 +84,20 @@ class ActiveSearch(LoopBase):
         self.scores = self.q.index.score(tvec)
         
         if self.gamma['mode'] == 'clip':
-            probs = self._calibrator.get_probabilities(tvec, self.q.index.vectors)
+            probs = self._calibrator.get_probabilities(tvec, self.q.index.vectors, scores=self.scores)
             self.prob_model = self.prob_model.with_gamma(probs)
         else:
             pass
 
     def get_stats(self):
-        return {'pruned_fractions':self.pruned_fractions}
+        return {'pruned_fractions':self.pruned_fractions, **(super().get_stats() or {})}
+
+    def batch_stats(self):
+        return {'pruned_fractions':list(self.pruned_fractions), **super().batch_stats()}
+
+    def set_batch_stats(self, stats):
+        super().set_batch_stats(stats)
+        self.pruned_fractions = list(stats['pruned_fractions'])
 
     def next_batch(self):
         """
@@ -100,13 +114,27 @@ class ActiveSearch(LoopBase):
         assert adjusted_horizon > 0, f'need a non-negative horizon for reward to be defined {self.params.interactive_options["reward_horizon"]=} {remaining_steps=}'
 
         lookahead = min(2, adjusted_horizon) # 1 when time horizon is also 1
-        res = efficient_nonmyopic_search(self.prob_model,reward_horizon=adjusted_horizon, 
-                                            lookahead_limit=lookahead, 
-                                            pruning_on=self.params.interactive_options['pruning_on'], 
-                                            implementation=self.params.interactive_options['implementation'])
+        planner = self.params.interactive_options.get('planner', 'ens')
+        deadline = self._deadline()
+        if planner == 'ens':
+            res = efficient_nonmyopic_search(self.prob_model,reward_horizon=adjusted_horizon, 
+                                                lookahead_limit=lookahead, 
+                                                pruning_on=self.params.interactive_options['pruning_on'], 
+                                                implementation=self.params.interactive_options['implementation'],
+                                                deadline=deadline)
+        elif planner == 'ceas':
+            ## cost effective active search: minimize expected number of steps to find target_positives
+            found = sum(self.prob_model.dataset.idx2label.values())
+            r = max(self.params.interactive_options['target_positives'] - found, 1)
+            res = min_expected_cost_approx(r, t=lookahead, 
+                                            top_k=self.params.interactive_options.get('ceas_top_k', 10), 
+                                            model=self.prob_model, deadline=deadline)
+        else:
+            assert False, f'unknown {planner=}'
         top_idx = int(res.index) 
         print(f'{res.index=}, {res.value=}')
         self.pruned_fractions.append(res.pruned_fraction)
+        self._record_budget('next_batch', deadline)
 
         vec_idx = np.array([top_idx])
         abs_idx = self.q.index.vector_meta['dbidx'].iloc[vec_idx].values
@@ -143,9 +171,7 @@ class ActiveSearch(LoopBase):
                     translated_change.append((idx,0))
             else:
                 for (idx, y) in change:
-                    df = self.q.index.vector_meta
-                    idx2 = df.query(f'dbidx == {idx}').index[0]
-                    assert df.iloc[idx2].dbidx == idx
+                    idx2 = self.q.index.dbidx2first_row([idx])[0]
                     translated_change.append((idx2, y))
 
             for (idx, y) in translated_change:
@@ -187,7 +213,7 @@ class LKNNSearch(LoopBase):
             if self._calibrator is None:
                 probs = self.scores
             else:
-                probs = self._calibrator.get_probabilities(tvec, self.q.index.vectors)
+                probs = self._calibrator.get_probabilities(tvec, self.q.index.vectors, scores=self.scores)
             
             self.prob_model = self.prob_model.with_gamma(probs)
 
@@ -216,8 +242,6 @@ class LKNNSearch(LoopBase):
         else:
             print(f'updating model with {change=}')
             for (idx, y) in change:
-                df = self.q.index.vector_meta
-                idx2 = df.query(f'dbidx == {idx}').index[0]
-                assert df.iloc[idx2].dbidx == idx
+                idx2 = self.q.index.dbidx2first_row([idx])[0]
                 self.prob_model.condition_(idx2, y)
 
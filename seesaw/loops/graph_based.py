@@ -50,7 +50,8 @@ def lookup_weight_matrix(opts : WeightMatrixOptions, *,  use_cache : bool, X_vec
 
         return wm
 
-    return _cache_closure(init, key=key, use_cache=use_cache)
+    return _cache_closure(init, key=key, use_cache=use_cache, 
+                            recipe=(lookup_weight_matrix, (opts,), dict(use_cache=True, X_vectors=X_vectors)))
 
 def get_weight_matrix_from_index(idx, weight_matrix_options, xlx_matrix=False):
     opts = WeightMatrixOptions(**weight_matrix_options)
@@ -118,4 +119,6 @@ class KnnProp2(LoopBase):
         idxs = np.concatenate([pos,neg])
         labels = np.concatenate([np.ones_like(pos), np.zeros_like(neg)])
         s = self.state
-        s.knn_model.update(idxs, labels)
+        deadline = self._deadline()
+        s.knn_model.update(idxs, labels, deadline=deadline)
+        self._record_budget('refine', deadline)
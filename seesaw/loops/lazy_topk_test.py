@@ -75,4 +75,30 @@ def test_full():
 
     top_idxs, top_scores = ltk.top_k_remaining(k=10)
     assert np.equal(top_idxs, np.array([3, 0, 1, 4, 2]) ).all()
-    assert np.isclose(top_scores, np.array([.6, .5, .4, .1, 0])).all()
\ No newline at end of file
+    assert np.isclose(top_scores, np.array([.6, .5, .4, .1, 0])).all()
+
+def test_merge_top_k_matches_reference():
+    from seesaw.loops.LKNN_model import merge_top_k
+    rng = np.random.default_rng(0)
+    n = 50
+    for _ in range(20):
+        perm = rng.permutation(n)
+        changed = perm[:rng.integers(1, 10)]
+        dataset = Dataset.from_vectors(rng.normal(size=(n,3)))
+        for idx in perm[10:10 + rng.integers(0, 10)]:
+            dataset = dataset.with_label(int(idx), 1)
+
+        scores = rng.integers(0, 5, size=n)/5. # includes ties
+        desc_idxs = np.argsort(-scores, kind='stable')
+        changed_scores = rng.integers(0, 5, size=changed.shape[0])/5.
+        order = np.argsort(-changed_scores, kind='stable')
+
+        ltk = LazyTopK(dataset, desc_idxs=desc_idxs, desc_scores=scores[desc_idxs],
+                        desc_changed_idxs=changed[order], desc_changed_scores=changed_scores[order])
+        seen = np.array(dataset.seen_indices, dtype=np.int64)
+        for k in [1, 5, n]:
+            ref_idxs, ref_scores = ltk.top_k_remaining(k=k)
+            top_idxs, top_scores = merge_top_k(k, desc_idxs, scores[desc_idxs], seen,
+                                                changed[order], changed_scores[order])
+            assert np.equal(top_idxs, ref_idxs).all()
+            assert np.isclose(top_scores, ref_scores).all()
@@ -1,4 +1,4 @@
-from ..logistic_regression import LogisticRegressionPT
+from ..logistic_regression import LogisticRegressionPT, make_logistic_regression
 from .point_based import *
 from .loop_base import *
 
@@ -21,7 +21,8 @@ class LogReg2(PointBased):
         Xt, yt = self.q.getXy()
         
         if self.model is None:
-            self.model = LogisticRegressionPT(regularizer_vector=self.state.tvec, **self.params.interactive_options)
+            # interactive_options['solver'] picks the torch (default) or newton solver
+            self.model = make_logistic_regression(regularizer_vector=self.state.tvec, **self.params.interactive_options)
 
         ## if there are only positives, fitting should already do nothing due to regularization... except loss is not the same.
         if (yt == 1).all():
@@ -4,6 +4,7 @@ from dataclasses import dataclass
 
 from ..basic_types import SessionParams
 from ..query_interface import InteractiveQuery
+from .util import Deadline
 
 @dataclass
 class LoopState:
@@ -28,6 +29,7 @@ class LoopBase:
         self.curr_qvec = None
         self.reversal = False # will be modified by session
         self.started = False
+        self.budget_hits = {'refine':0, 'next_batch':0} # calls cut short by params.latency_budget
         if self.params.start_policy == 'from_start':
             self.started = True
 
@@ -37,7 +39,27 @@ class LoopBase:
             self.reversal = True
 
     def get_stats(self):
-        return None
+        if self.params.latency_budget is None:
+            return None
+        return {'budget_hits':dict(self.budget_hits)}
+
+    def batch_stats(self):
+        """ the stats next_batch adds to. sessions restore them after speculative batches, see Session.prepare_next """
+        return {'budget_hits':dict(self.budget_hits)}
+
+    def set_batch_stats(self, stats):
+        self.budget_hits = dict(stats['budget_hits'])
+
+    def _deadline(self) -> Deadline:
+        """ None when there is no latency budget """
+        if self.params.latency_budget is None:
+            return None
+        return Deadline(self.params.latency_budget)
+
+    def _record_budget(self, stage : str, deadline : Deadline):
+        if deadline is not None and deadline.hit:
+            print(f'{stage} hit the latency budget of {self.params.latency_budget}s, using the best result so far')
+            self.budget_hits[stage] += 1
 
     def set_text_vec(self, vec):
         self.curr_qvec = vec
@@ -17,10 +17,25 @@ import torch.nn.functional as F
 import torch.optim as opt
 
 import torch.nn as nn
-from ..rank_loss import ref_pairwise_logistic_loss, ref_pairwise_rank_loss
+from ..rank_loss import pairwise_logistic_loss, pairwise_rank_loss
 import pandas as pd
 import math
 
+class _QuadraticForm(torch.autograd.Function):
+    """ w @ S @ w for a constant symmetric S, with the closed form gradient 2 S w
+        instead of differentiating through the matrix product.
+    """
+    @staticmethod
+    def forward(ctx, w, S):
+        Sw = S @ w
+        ctx.save_for_backward(Sw)
+        return w @ Sw
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        Sw, = ctx.saved_tensors
+        return 2 * grad_output * Sw, None
+
 class RegModule(nn.Module):
     def __init__(self, *, dim, xlx_matrix, qvec,
          label_loss_type,  
@@ -28,7 +43,8 @@ class RegModule(nn.Module):
          use_qvec_norm,
          rank_loss_margin=0.,
          pos_weight,
-         verbose=False, max_iter=100, lr=1.):
+         verbose=False, max_iter=100, lr=1., tolerance_grad=1e-7, pairwise_loss_impl='ref'):
+        """ xlx_matrix is assumed symmetric (see MultiReg) """
         super().__init__()
 
         assert label_loss_type in ['ce_loss', 'pairwise_rank_loss', 'pairwise_logistic_loss']
@@ -42,7 +58,10 @@ class RegModule(nn.Module):
 
         self.max_iter = max_iter
         self.lr = lr
+        self.tolerance_grad = tolerance_grad
         self.verbose = verbose
+        self.Xmu = None # centering of the training vectors, applied to the logits
+        self._opt = None # kept across fits so LBFGS history carries over
 
         self.reg_query_lambda = reg_query_lambda
         self.use_qvec_norm = use_qvec_norm
@@ -51,12 +70,16 @@ class RegModule(nn.Module):
 
         self.pos_weight = pos_weight #'balanced' #torch.tensor([1.])
         self.rank_loss_margin = rank_loss_margin
+        self.pairwise_loss_impl = pairwise_loss_impl # 'ref' (all pairs, default) or 'sort' (n log n, opt in via options['pairwise_loss_impl'])
 
     def get_coeff(self):
         return F.normalize(self.weight.detach(), dim=-1).numpy()
 
     def forward(self, X, y=None):
-        return X @ self.weight
+        logits = X @ self.weight
+        if self.Xmu is not None:
+            logits = logits - self.Xmu @ self.weight # same as centering X, without copying it
+        return logits
     
     def _step(self, batch):
         assert not self.weight.isnan().any(), f'{self.weight=}'
@@ -105,14 +128,14 @@ class RegModule(nn.Module):
                 item_losses = celoss
             elif self.label_loss_type == 'pairwise_rank_loss':
                 if pos_total > 0 and neg_total > 0:
-                    per_item_loss, max_inv = ref_pairwise_rank_loss(y, scores=logits, 
+                    per_item_loss, max_inv = pairwise_rank_loss(y, scores=logits, impl=self.pairwise_loss_impl,
                                         aggregate='sum',margin=self.rank_loss_margin, return_max_inversions=True)
                     
                     per_item_normalized = per_item_loss/max_inv
                     item_losses = per_item_normalized
             elif self.label_loss_type == 'pairwise_logistic_loss':
                 if pos_total > 0 and neg_total > 0:
-                    per_item_loss, max_inv = ref_pairwise_logistic_loss(y, scores=logits, 
+                    per_item_loss, max_inv = pairwise_logistic_loss(y, scores=logits, impl=self.pairwise_loss_impl,
                                         aggregate='sum', return_max_inversions=True)
                     
                     per_item_normalized = per_item_loss/max_inv
@@ -127,7 +150,7 @@ class RegModule(nn.Module):
 
         #loss_norm = (self.weight.norm() - 1)**2
         loss_norm = self.reg_norm_lambda *  ( torch.cosh( (self.weight @ self.weight).log() ) - 1. )
-        loss_datareg = self.reg_data_lambda * ( self.weight @ ( self.xlx_matrix @ self.weight ) )
+        loss_datareg = self.reg_data_lambda * _QuadraticForm.apply(self.weight, self.xlx_matrix)
         loss_queryreg = self.reg_query_lambda * ( ( 1 - normalized_weight@self.qvec )/2. )
         loss_labels = item_losses.sum()
 
@@ -153,26 +176,73 @@ class RegModule(nn.Module):
         return losses
 
     def configure_optimizers(self):
-        return opt.LBFGS(self.parameters(), max_iter=self.max_iter, lr=self.lr, line_search_fn='strong_wolfe')
+        if self._opt is None:
+            self._opt = opt.LBFGS(self.parameters(), max_iter=self.max_iter, lr=self.lr, 
+                                tolerance_grad=self.tolerance_grad, line_search_fn='strong_wolfe')
+        return self._opt
+
+    def _reuse_history(self):
+        """ the curvature pairs from previous fits are kept, but the pair between the last point of the
+            previous fit and the first of this one spans two different objectives, so zero the last step to skip it
+        """
+        if self._opt is None:
+            return
+
+        state = self._opt.state[self._opt._params[0]]
+        if 'd' in state:
+            state['d'].zero_()
+
+    def _fit_until(self, trainer_, dl, deadline, chunk_iters=10):
+        """ runs the LBFGS steps a few iterations at a time, with the same total iteration and evaluation limits,
+            until LBFGS stops on its own or the deadline expires. 
+            the line search only accepts decreasing steps, so the weight left is the best so far.
+        """
+        opt_ = self.configure_optimizers()
+        group = opt_.param_groups[0]
+        state = opt_.state[opt_._params[0]]
+        max_iter, max_eval = group['max_iter'], group['max_eval']
+        losses_ = []
+        iters_done = 0
+        evals_done = 0
+        try:
+            while iters_done < max_iter and evals_done < max_eval and not deadline.expired():
+                step_iters = min(chunk_iters, max_iter - iters_done)
+                group['max_iter'] = step_iters
+                group['max_eval'] = max_eval - evals_done
+                iters_before, evals_before = state.get('n_iter', 0), state.get('func_evals', 0)
+                losses_.extend(trainer_.fit(dl))
+                iters = state['n_iter'] - iters_before
+                iters_done += iters
+                evals_done += state['func_evals'] - evals_before
+                if iters < step_iters: # converged, or out of evaluations
+                    break
+        finally:
+            group['max_iter'], group['max_eval'] = max_iter, max_eval
+        return losses_
 
-    def fit(self, X, y, matchdf):
+    def fit(self, X, y, matchdf, deadline=None):
+        """ starts from the current weight, so calling fit again after adding labels warm starts from the last solution.
+            deadline (see loops.util.Deadline) stops LBFGS early with the best weight so far
+        """
+        self._reuse_history()
         trainer_ = BasicTrainer(mod=self, max_epochs=1, verbose=self.verbose)
         
         ## 1/(nvecs for image)
-
-        vecs_per_image = matchdf.groupby('dbidx').size().rename('num_vecs').reset_index()
-        matchdf = pd.merge(matchdf, vecs_per_image, left_on='dbidx', right_on='dbidx')
-        vec_weight = matchdf.num_vecs.astype('float').pow(-1).values
+        _, inverse, counts = np.unique(matchdf.dbidx.values, return_inverse=True, return_counts=True)
+        vec_weight = 1./counts[inverse]
 
         if X.shape[0] > 0:
-            Xmu = X.mean(axis=0)
-            X = X - Xmu.reshape(1,-1) # center this
-            ds = TensorDataset(torch.from_numpy(X), torch.from_numpy(y), torch.from_numpy(vec_weight))
-            dl = DataLoader(ds, batch_size=X.shape[0], shuffle=True)
+            self.Xmu = torch.from_numpy(X.mean(axis=0))
+            dl = [(torch.from_numpy(X), torch.from_numpy(y), torch.from_numpy(vec_weight))] # a single full batch
         else:
+            self.Xmu = None
             dl= None
 
-        losses_ = trainer_.fit(dl)
+        if deadline is None:
+            losses_ = trainer_.fit(dl)
+        else:
+            losses_ = self._fit_until(trainer_, dl, deadline)
+
         if self.verbose:
             df = pd.DataFrame.from_records(losses_)
             agg_df= df.groupby('k').mean()
@@ -185,7 +255,9 @@ class MultiReg(PointBased):
         super().__init__(gdm, q, params)
         self.options = self.params.interactive_options
         xlx = get_weight_matrix_from_index(q.index, self.options['matrix_options'], xlx_matrix=True)
-        self.xlx_matrix = torch.from_numpy(xlx).float()
+        self.xlx_matrix = torch.from_numpy((xlx + xlx.T)/2).float() # symmetric part, same quadratic form
+        self._model = None # last fitted model, reused while the query vector stays the same
+        self._model_qvec = None
 
     @staticmethod
     def from_params(gdm: GlobalDataManager, q: InteractiveQuery, params: SessionParams):
@@ -208,7 +280,10 @@ class MultiReg(PointBased):
 
         assert self.curr_qvec is not None
 
-        model_ = RegModule(dim=X.shape[1], xlx_matrix=self.xlx_matrix, qvec=torch.from_numpy(self.curr_qvec).float(), 
+        warm_start = (self.options.get('warm_start', True) and self._model is not None 
+                        and np.array_equal(self._model_qvec, self.curr_qvec))
+        if not warm_start:
+            self._model = RegModule(dim=X.shape[1], xlx_matrix=self.xlx_matrix, qvec=torch.from_numpy(self.curr_qvec).float(), 
                             label_loss_type=self.options['label_loss_type'], 
                             rank_loss_margin=self.options['rank_loss_margin'], 
                             reg_data_lambda=self.options['reg_data_lambda'], 
@@ -218,10 +293,15 @@ class MultiReg(PointBased):
                             verbose=self.options['verbose'], 
                             max_iter=self.options['max_iter'], 
                             pos_weight=self.options['pos_weight'],
-                            lr=self.options['lr'])
-
-        model_.fit(X, y, matchdf)
-        self.curr_vec = model_.get_coeff()
+                            lr=self.options['lr'],
+                            tolerance_grad=self.options.get('tolerance_grad', 1e-7),
+                            pairwise_loss_impl=self.options.get('pairwise_loss_impl', 'ref'))
+            self._model_qvec = self.curr_qvec.copy()
+
+        deadline = self._deadline()
+        self._model.fit(X, y, matchdf, deadline=deadline)
+        self._record_budget('refine', deadline)
+        self.curr_vec = self._model.get_coeff()
 
     def next_batch(self):
         return super().next_batch()
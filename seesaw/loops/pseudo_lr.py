@@ -1,4 +1,4 @@
-from .log_reg import LogisticRegressionPT
+from .log_reg import LogisticRegressionPT, make_logistic_regression
 from .point_based import PointBased
 from .loop_base import *
 from .util import makeXy
@@ -33,7 +33,7 @@ class PseudoLR(PointBased):
         # if negatives it will try to help (not clear it works that way)
         
         X, y, is_real = makeXy(self.index, self.knn_based.state.knn_model, sample_size=self.options['sample_size'])
-        model = LogisticRegressionPT(regularizer_vector=self.state.tvec,  **self.log_reg_params)
+        model = make_logistic_regression(regularizer_vector=self.state.tvec,  **self.log_reg_params) # log_reg_params['solver'] as in LogReg2
 
         weights = np.ones_like(y)
         weights[is_real > 0] = self.real_sample_weight
@@ -35,6 +35,14 @@ class SwitchOver(LoopBase):
         self.method0.set_text_vec(tvec)
         self.method1.set_text_vec(tvec)
 
+    def batch_stats(self):
+        return {**super().batch_stats(), 'method0':self.method0.batch_stats(), 'method1':self.method1.batch_stats()}
+
+    def set_batch_stats(self, stats):
+        super().set_batch_stats(stats)
+        self.method0.set_batch_stats(stats['method0'])
+        self.method1.set_batch_stats(stats['method1'])
+
     def refine(self):
         self.method0.refine()
         self.method1.refine()
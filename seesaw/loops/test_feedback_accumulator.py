@@ -0,0 +1,31 @@
+from seesaw.loops.util import FeedbackAccumulator
+from seesaw.labeldb import LabelDB
+from seesaw.basic_types import Box
+import numpy as np
+
+
+def test_feedback_accumulator():
+    class Index:
+        vectors = np.arange(12, dtype=np.float32).reshape(6, 2) # 2 tiles per image
+
+    class Query:
+        index = Index()
+        label_db = LabelDB()
+        def image_labels(self, dbidx):
+            boxes = self.label_db.get(dbidx, format='box')
+            if boxes is None:
+                return None
+            return np.array([2*dbidx, 2*dbidx + 1]), np.array([float(len(boxes) > 0), 0.])
+
+    q = Query()
+    acc = FeedbackAccumulator(q)
+    q.label_db.put(0, [Box(x1=0, y1=0, x2=1, y2=1)])
+    q.label_db.put(1, [])
+    acc.update()
+    assert (acc.counts == [3, 1]).all()
+    q.label_db.put(0, []) # reversal
+    q.label_db.put(2, [Box(x1=0, y1=0, x2=1, y2=1)])
+    neg, pos = acc.update().means()
+    assert (acc.counts == [5, 1]).all()
+    assert np.allclose(pos, Index.vectors[4])
+    assert np.allclose(neg, Index.vectors[[0, 1, 2, 3, 5]].mean(axis=0))
@@ -0,0 +1,12 @@
+from seesaw.loops.multi_reg import _QuadraticForm
+import torch
+
+
+def test_quadratic_form_grad():
+    A = torch.randn(8, 8, dtype=torch.float64)
+    S = (A + A.T)/2
+    w = torch.randn(8, dtype=torch.float64, requires_grad=True)
+    _QuadraticForm.apply(w, S).backward()
+    w2 = w.detach().clone().requires_grad_(True)
+    (w2 @ (A @ w2)).backward()
+    assert torch.allclose(w.grad, w2.grad)
@@ -1,5 +1,6 @@
 import numpy as np
 import os
+import time
 
 def makeXy(idx, lr, sample_size, pseudoLabel=True):
     is_labeled = lr.is_labeled > 0
@@ -23,6 +24,67 @@ def makeXy(idx, lr, sample_size, pseudoLabel=True):
     return X,y,is_real
 
 
+class Deadline:
+    """ wall clock deadline for anytime computations, see SessionParams.latency_budget.
+        hit stays True once expired() has returned True.
+    """
+    def __init__(self, budget : float):
+        self.end = time.time() + budget
+        self.hit = False
+
+    def expired(self) -> bool:
+        if not self.hit and time.time() >= self.end:
+            self.hit = True
+        return self.hit
+
+
+class FeedbackAccumulator:
+    """ running sums and counts of the vectors of non relevant (ys == 0) and relevant (ys > 0) labeled tiles,
+        as given by q.getXy, for point based loops (eg. Rocchio means).
+        follows the label db change log, so an update costs O(tiles of changed images) rather than O(all labeled tiles).
+        when an image's labels change (eg. a reversal, or edited boxes) its previous contribution is subtracted first.
+    """
+    def __init__(self, q, target_description=None):
+        self.q = q
+        self.target_description = target_description
+        self.log_position = 0
+        dim = q.index.vectors.shape[1]
+        self.sums = np.zeros((2, dim)) # row 0 non relevant, row 1 relevant
+        self.counts = np.zeros(2, dtype=np.int64)
+        self._contributions = {} # dbidx -> (rows, relevant mask) currently added
+
+    def _add(self, rows, relevant, sign):
+        X = self.q.index.vectors[rows].astype(np.float64)
+        self.sums[0] += sign*X[~relevant].sum(axis=0)
+        self.sums[1] += sign*X[relevant].sum(axis=0)
+        self.counts[0] += sign*(~relevant).sum()
+        self.counts[1] += sign*relevant.sum()
+
+    def update(self):
+        changed, self.log_position = self.q.label_db.changes_since(self.log_position)
+        options = {} if self.target_description is None else {'target_description':self.target_description}
+        for dbidx in changed:
+            old = self._contributions.pop(dbidx, None)
+            if old is not None:
+                self._add(*old, sign=-1)
+
+            labels = self.q.image_labels(dbidx, **options)
+            if labels is None:
+                continue
+
+            rows, ys = labels
+            relevant = ys > 0
+            self._add(rows, relevant, sign=1)
+            self._contributions[dbidx] = (rows, relevant)
+
+        return self
+
+    def means(self):
+        """ (mean non relevant, mean relevant), zero when there are none """
+        means = self.sums / np.maximum(self.counts, 1).reshape(-1, 1)
+        return means[0], means[1]
+
+
 def get_image_paths(image_root, path_array, idxs):
     return [
         os.path.normpath(f"{image_root}/{path_array[int(i)]}").replace("//", "/")
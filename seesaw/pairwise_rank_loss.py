@@ -4,9 +4,16 @@ import torch.nn.functional as F
 import torch.autograd
 import torch.optim
 import numpy as np
+from .rank_loss import fast_pairwise_rank_loss, _max_inversions
 
 def all_pairs_margin_ranking_loss(target, *, scores, margin=0., return_all_pairs=False, return_inversions=False):
     assert target.shape == scores.shape
+    if not return_all_pairs and not return_inversions: # per element means only, avoid the n x n pairs
+        n = scores.reshape(-1).shape[0]
+        same_target = n - _max_inversions(target)
+        losses = fast_pairwise_rank_loss(target, scores=scores, margin=margin) + max(margin, 0.)*same_target
+        return (losses/n).reshape(scores.shape)
+
     pair_targets = (target.reshape(-1,1) - target.reshape(1,-1)).sign() # want -1 or 1 or 0
     scores1 = scores.reshape(-1,1).repeat(1,scores.shape[0])
         
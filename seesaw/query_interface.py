@@ -50,3 +50,7 @@ class InteractiveQuery(object):
 
     def getXy(self, **options):
         raise NotImplementedError("abstract")
+
+    def image_labels(self, dbidx : int, **options):
+        """ (vector rows, ys) of a single seen image, consistent with getXy. None if not seen """
+        raise NotImplementedError("abstract")
@@ -1,4 +1,6 @@
 import torch
+import torch.nn.functional as F
+import math
 
 def ref_signed_inversions(target, *, scores, margin):
     ''' computes the inversions (number of inversions) for the given scores,
@@ -95,6 +97,120 @@ def ref_pairwise_rank_loss(target, *, scores, margin, aggregate='none', return_m
     return loss_ij
 
 
+def _count_sum_at_least(ref, thresholds):
+    """ for each threshold, the number and the sum of elements of ref that are >= threshold """
+    sorted_ref, _ = torch.sort(ref)
+    suffix = torch.cat([sorted_ref.flip(0).cumsum(0).flip(0), sorted_ref.new_zeros(1)])
+    pos = torch.searchsorted(sorted_ref.detach().contiguous(), thresholds.detach().contiguous(), right=False)
+    return (ref.shape[0] - pos).to(ref.dtype), suffix[pos]
+
+def _count_sum_at_most(ref, thresholds):
+    """ for each threshold, the number and the sum of elements of ref that are <= threshold """
+    sorted_ref, _ = torch.sort(ref)
+    prefix = torch.cat([sorted_ref.new_zeros(1), sorted_ref.cumsum(0)])
+    pos = torch.searchsorted(sorted_ref.detach().contiguous(), thresholds.detach().contiguous(), right=True)
+    return pos.to(ref.dtype), prefix[pos]
+
+def _pairwise_hinge_sums(target, scores, margins, coeffs):
+    """ per item i, sum over k of coeffs[k] * sum over j of max(0, margins[k] - sign(target[i] - target[j])*(scores[i] - scores[j])),
+        skipping pairs with equal targets. same per item sums as ref_pairwise_rank_loss(aggregate='sum'), 
+        but using sorts and prefix sums: O(levels * k * n log n) for levels distinct target values, instead of O(n^2).
+        differentiable wrt scores. pairs exactly at the hinge count as active, like torch.clamp.
+    """
+    target = target.reshape(-1)
+    scores = scores.reshape(-1)
+    losses = scores*0. # keeps the result connected to scores even without pairs
+    margins = margins.to(scores.dtype).reshape(1, -1)
+    coeffs = coeffs.to(scores.dtype).reshape(1, -1)
+
+    for level in torch.unique(target):
+        lower = (target < level).nonzero().reshape(-1)
+        at = (target == level).nonzero().reshape(-1)
+        if lower.shape[0] == 0:
+            continue
+
+        ## every pair (hi, lo) with hi at this level and lo below it, loss max(0, margin + s_lo - s_hi)
+        s_hi = scores[at].reshape(-1, 1)
+        s_lo = scores[lower].reshape(-1, 1)
+
+        count, total = _count_sum_at_least(s_lo.reshape(-1), s_hi - margins)
+        hi_loss = ((total - count*(s_hi - margins))*coeffs).sum(1)
+
+        count, total = _count_sum_at_most(s_hi.reshape(-1), s_lo + margins)
+        lo_loss = ((count*(s_lo + margins) - total)*coeffs).sum(1)
+
+        losses = losses.index_add(0, at, hi_loss).index_add(0, lower, lo_loss)
+
+    return losses
+
+def _max_inversions(target):
+    """ number of items with a different target, per item """
+    _, inverse, counts = torch.unique(target.reshape(-1), return_inverse=True, return_counts=True)
+    return target.reshape(-1).shape[0] - counts[inverse]
+
+def fast_pairwise_rank_loss(target, *, scores, margin, aggregate='sum', return_max_inversions=False):
+    """ same as ref_pairwise_rank_loss(aggregate='sum') without materializing the n x n pairs.
+        exact, including the gradient.
+    """
+    assert target.shape == scores.shape
+    assert aggregate == 'sum', 'only per item sums are computed'
+    losses_sum = _pairwise_hinge_sums(target, scores, torch.tensor([margin]), torch.tensor([1.]))
+    if return_max_inversions:
+        return losses_sum, _max_inversions(target)
+    else:
+        return losses_sum
+
+def _softplus_hinges(max_error):
+    """ knots b_k and weights a_k so that log(1 + exp(x)) ~ softplus(b_0) + sum_k a_k max(0, x - b_k),
+        the piecewise linear interpolant of softplus on uniform knots, within max_error of it for any x.
+    """
+    ## chord error of softplus is at most h^2/8 * max softplus'' = h^2/32. 
+    # outside the knots the error is softplus(b_0) on the left and softplus(-b_K) on the right
+    step = math.sqrt(32*max_error)
+    bound = -math.log(math.expm1(max_error))
+    knots = torch.arange(-bound, bound + step, step, dtype=torch.float64)
+    values = F.softplus(knots)
+    slopes = torch.cat([torch.zeros(1, dtype=torch.float64), (values[1:] - values[:-1])/(knots[1:] - knots[:-1]),
+                        torch.ones(1, dtype=torch.float64)])
+    weights = slopes[1:] - slopes[:-1]
+    return knots, weights, values[0].item()
+
+def fast_pairwise_logistic_loss(target, *, scores, aggregate='sum', return_max_inversions=False, max_error=1e-3):
+    """ approximates ref_pairwise_logistic_loss(aggregate='sum') without materializing the n x n pairs, 
+        within max_error per pair (so within max_error * max_inversions per item), 
+        by writing softplus as a sum of hinges and using _pairwise_hinge_sums. 
+        costs O(n log n / sqrt(max_error)).
+    """
+    assert target.shape == scores.shape
+    assert aggregate == 'sum', 'only per item sums are computed'
+    knots, weights, offset = _softplus_hinges(max_error)
+    ## pair loss is softplus(s_lo - s_hi) and max(0, s_lo - s_hi - b) is the hinge with margin -b
+    max_inversions = _max_inversions(target)
+    losses_sum = _pairwise_hinge_sums(target, scores, -knots, weights) + offset*max_inversions.to(scores.dtype)
+    if return_max_inversions:
+        return losses_sum, max_inversions
+    else:
+        return losses_sum
+
+def pairwise_rank_loss(target, *, scores, margin, impl='ref', **kwargs):
+    """ impl='ref' uses the all pairs reference implementation, impl='sort' the O(n log n) one """
+    if impl == 'ref':
+        return ref_pairwise_rank_loss(target, scores=scores, margin=margin, **kwargs)
+    elif impl == 'sort':
+        return fast_pairwise_rank_loss(target, scores=scores, margin=margin, **kwargs)
+    else:
+        assert False, f'unknown {impl=}'
+
+def pairwise_logistic_loss(target, *, scores, impl='ref', **kwargs):
+    """ impl='ref' uses the all pairs reference implementation, impl='sort' the O(n log n) approximation """
+    if impl == 'ref':
+        return ref_pairwise_logistic_loss(target, scores=scores, **kwargs)
+    elif impl == 'sort':
+        return fast_pairwise_logistic_loss(target, scores=scores, **kwargs)
+    else:
+        assert False, f'unknown {impl=}'
+
+
 def ref_pairwise_rank_loss_gradient(target, *, scores, margin):
     ''' reference implementation of gradient for pairwise rank loss.
         use autograd to compute the gradient.
@@ -105,16 +105,15 @@ class ProbabilityModel:
     def top_k_remaining(self, top_k : int) -> Tuple[np.ndarray, np.ndarray]:
         # TODO: if scores are identical (can be in some cases), break ties randomly.
         idxs = self.dataset.remaining_indices()
-        curr_pred = self.predict_proba(idxs)
-        desc_order = np.argsort(-curr_pred)
-        ret_idxs = desc_order[:top_k]
-
-        ans = []
-        for idx in ret_idxs:
-            ans.append(idxs[int(idx)])
-
-        idx_ans = np.array(ans)
-        return idx_ans, curr_pred[ret_idxs]
+        idx_arr = np.fromiter(idxs, dtype=np.int64, count=len(idxs))
+        curr_pred = self.predict_proba(idx_arr)
+        if top_k < curr_pred.shape[0]:
+            top_pos = np.argpartition(-curr_pred, top_k)[:top_k]
+        else:
+            top_pos = np.arange(curr_pred.shape[0])
+
+        ret_idxs = top_pos[np.argsort(-curr_pred[top_pos])]
+        return idx_arr[ret_idxs], curr_pred[ret_idxs]
 
     def probability_bound(self, n) -> float:
         ''' upper bound on max p_i if we added n more positive results '''
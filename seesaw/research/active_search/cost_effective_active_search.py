@@ -1,4 +1,4 @@
-from  seesaw.research.npb_distribution import NPBDistribution
+from  seesaw.research.npb_distribution import NPBDistribution, npb_expectation_batch
 import math
 import numpy as np
 import torch
@@ -6,6 +6,34 @@ import torch
 from .common import ProbabilityModel, Result
 
 
+def _num_remaining(model : ProbabilityModel) -> int:
+    return len(model.dataset.all_indices) - len(model.dataset.seen_indices)
+
+def _desc_prefix(r : int, model : ProbabilityModel, prefix_len : int) -> np.ndarray:
+    """ highest remaining probabilities in descending order, just long enough for them to add up to r
+        (or all remaining ones if they never do)
+    """
+    n_remaining = _num_remaining(model)
+    length = min(prefix_len, n_remaining)
+    while True:
+        _, probs = model.top_k_remaining(top_k=length)
+        if length >= n_remaining or probs.sum() >= r:
+            return probs
+        length = min(2*length, n_remaining)
+
+def leaf_costs(rs, models, prefix_len : int = 64) -> np.ndarray:
+    """ NPB expected cost of finding rs[i] more positives by taking the top results of models[i].
+        all leaves are evaluated in a single batched tensor op over (zero padded) prefixes.
+    """
+    prefixes = [_desc_prefix(r, model, prefix_len) for (r, model) in zip(rs, models)]
+    length = max(max(p.shape[0] for p in prefixes), 1)
+    padded = np.zeros((len(prefixes), length))
+    for i, p in enumerate(prefixes):
+        padded[i, :p.shape[0]] = p
+
+    costs = npb_expectation_batch(torch.tensor(rs, dtype=torch.float64), torch.from_numpy(padded))
+    return costs.numpy()
+
 def expected_cost(idx, *, r : int,  t : int,  model : ProbabilityModel) -> float:
     p = model.predict_proba(np.array([idx])).item()
     # case y = 1
@@ -16,29 +44,49 @@ def expected_cost(idx, *, r : int,  t : int,  model : ProbabilityModel) -> float
     
     return p*res1.value + (1-p)*res0.value
 
-def min_expected_cost_approx(r : int, *,  top_k : int = None, t : int, model : ProbabilityModel) -> Result:
+def _branch_costs(r, t, model, idxs, prefix_len):
+    """ (expected costs if each of idxs turns out positive, if negative) """
+    k = idxs.shape[0]
+    if t == 2:
+        ## all 2*k leaves at once
+        models = [model.condition(idx, 1) for idx in idxs] + [model.condition(idx, 0) for idx in idxs]
+        costs = leaf_costs([r-1]*k + [r]*k, models, prefix_len=prefix_len)
+        costs1 = costs[:k]
+        costs0 = costs[k:]
+    else:
+        costs1 = np.array([min_expected_cost_approx(r-1, t=t-1, model=model.condition(idx, 1), prefix_len=prefix_len).value for idx in idxs])
+        costs0 = np.array([min_expected_cost_approx(r, t=t-1, model=model.condition(idx, 0), prefix_len=prefix_len).value for idx in idxs])
+    return costs1, costs0
+
+def min_expected_cost_approx(r : int, *,  top_k : int = None, t : int, model : ProbabilityModel, prefix_len : int = 64, 
+                                deadline=None, chunk_size : int = 4) -> Result:
+    """ deadline: (see loops.util.Deadline) candidates are evaluated chunk_size at a time, in descending probability order,
+        and once the deadline expires the best one evaluated so far is returned. applies to the top level only.
+    """
     if t == 1:
-        indices = model.dataset.remaining_indices()
-        probs = model.predict_proba(indices)
-        probs = torch.from_numpy(probs)
-        desc_order = torch.argsort(-probs)
-        desc_probs = probs[desc_order]        
-        cost =  NPBDistribution(r, desc_probs).expectation(method='accu_prime')
-        index = indices[desc_order[0]]
-        return Result(value=cost, index=index)
-
-    min_idx = None
-    min_cost = math.inf
-
-    idxs = model.dataset.remaining_indices()
-    curr_pred = model.predict_proba(idxs)
-    desc_order = np.argsort(-curr_pred)
-    top_k_idxs = idxs[desc_order[:top_k]]
-
-    for idx in top_k_idxs:
-        c = expected_cost(idx, r=r, t=t, model=model)
-        if c < min_cost:
-            min_idx = idx
-            min_cost = c
-            
-    return Result(value=min_cost, index=min_idx)
\ No newline at end of file
+        cost = leaf_costs([r], [model], prefix_len=prefix_len)[0]
+        index, _ = model.top_k_remaining(top_k=1)
+        return Result(value=cost, index=index[0])
+
+    if top_k is None:
+        top_k = _num_remaining(model)
+
+    top_k_idxs, top_k_probs = model.top_k_remaining(top_k=top_k)
+    if deadline is None:
+        chunk_size = max(top_k_idxs.shape[0], 1)
+
+    costs1 = []
+    costs0 = []
+    for start in range(0, top_k_idxs.shape[0], chunk_size):
+        c1, c0 = _branch_costs(r, t, model, top_k_idxs[start:start + chunk_size], prefix_len)
+        costs1.append(c1)
+        costs0.append(c0)
+        if deadline is not None and deadline.expired():
+            break
+
+    costs1 = np.concatenate(costs1)
+    costs0 = np.concatenate(costs0)
+    n = costs1.shape[0]
+    costs = top_k_probs[:n]*costs1 + (1-top_k_probs[:n])*costs0
+    pos = np.argmin(costs)
+    return Result(value=costs[pos], index=top_k_idxs[pos])
@@ -91,11 +91,18 @@ def _opt_expected_utility_helper(*, i : int,  lookahead_limit : int, t : int, mo
 import math
 
 
-def _top_sum(*, numerators,  denominators,  scores, neighbor_ids_sorted, N, K, D, debug=True):
-    """ returns the expected value after K steps for each index """
-
-    node_ids = np.arange(N).reshape(-1,1)
-    top_kpd_ids = np.argsort(scores)[-(K+D):]
+def _top_sum(*, numerators,  denominators,  scores, neighbor_ids_sorted, N, K, D, debug=True, rows=None, top_kpd_ids=None):
+    """ returns the expected value after K steps for each index (or only for the given rows).
+        top_kpd_ids: np.argsort(scores)[-(K+D):], if already computed
+    """
+
+    if rows is None:
+        rows = np.arange(N)
+    M = rows.shape[0]
+    node_ids = rows.reshape(-1,1)
+    neighbor_ids_sorted = neighbor_ids_sorted[rows]
+    if top_kpd_ids is None:
+        top_kpd_ids = np.argsort(scores)[-(K+D):]
     top_scores = scores[top_kpd_ids]    
 
     ## first detect the over-writes to top k scores
@@ -120,8 +127,8 @@ def _top_sum(*, numerators,  denominators,  scores, neighbor_ids_sorted, N, K, D
         assert (top_kpd_asc[jjs_in_topk] == neighbor_ids_sorted[iis,jjs]).all() , 'ids should match for there to be a conflict'
 
     ### expand the top k scores by copying because we will over-write them
-    top_score_by_kpd_rep = np.repeat(top_score_by_kpd, N).reshape(-1,N).T
-    top_id_rep = np.repeat(top_kpd_asc, N).reshape(-1,N).T
+    top_score_by_kpd_rep = np.repeat(top_score_by_kpd, M).reshape(-1,M).T
+    top_id_rep = np.repeat(top_kpd_asc, M).reshape(-1,M).T
     
     ## make overwritten score -inf to self, and to overwritten elements so it will be ignored when sorting
     self_id = top_kpd_asc.reshape(1,-1) == node_ids
@@ -165,10 +172,27 @@ def _top_sum(*, numerators,  denominators,  scores, neighbor_ids_sorted, N, K, D
     expected_scores0 = _compute_conditioned_scores(scores_given0)
     
     ## :NB: the infinity scores (which have been cancelled) will become nan when added to plus infinity
-    final_scores = scores*(1+expected_scores1) + (1-scores)*expected_scores0
+    row_scores = scores[rows]
+    final_scores = row_scores*(1+expected_scores1) + (1-row_scores)*expected_scores0
     return final_scores
 
-def _opt_expected_utility_helper_lknn2(*, i : int,  lookahead_limit : int, t : int, model : LKNNModel, pruning_on : bool):
+def _top_sum_until(*, scores, N, K, D, deadline, chunk_size=4096, **kwargs):
+    """ _top_sum evaluated a chunk of rows at a time, highest one step scores first, until the deadline expires.
+        rows not reached are nan. the first chunk is always evaluated.
+    """
+    order = np.argsort(-scores)
+    top_kpd_ids = np.argsort(scores)[-(K+D):]
+    expected_value = np.full(N, np.nan)
+    for start in range(0, N, chunk_size):
+        rows = order[start:start + chunk_size]
+        if scores[rows[0]] == -np.inf: # only seen indices left
+            break
+        expected_value[rows] = _top_sum(scores=scores, N=N, K=K, D=D, rows=rows, top_kpd_ids=top_kpd_ids, **kwargs)
+        if deadline.expired():
+            break
+    return expected_value
+
+def _opt_expected_utility_helper_lknn2(*, i : int,  lookahead_limit : int, t : int, model : LKNNModel, pruning_on : bool, deadline=None):
     assert i == 0
     assert lookahead_limit <=2
     assert t >= lookahead_limit
@@ -193,9 +217,13 @@ def _opt_expected_utility_helper_lknn2(*, i : int,  lookahead_limit : int, t : i
     assert (numerators <= denominators).all()
 
     if lookahead_limit == 2:
-        expected_value =  _top_sum(numerators=numerators, denominators=denominators, 
-                                    scores=scores,
-                                        neighbor_ids_sorted=neighbor_ids_sorted, N=N, K=t-1, D=D)
+        if deadline is None:
+            expected_value =  _top_sum(numerators=numerators, denominators=denominators, 
+                                        scores=scores,
+                                            neighbor_ids_sorted=neighbor_ids_sorted, N=N, K=t-1, D=D)
+        else:
+            expected_value = _top_sum_until(numerators=numerators, denominators=denominators, scores=scores,
+                                            neighbor_ids_sorted=neighbor_ids_sorted, N=N, K=t-1, D=D, deadline=deadline)
         best_idx = np.nanargmax(expected_value)
         return Result(value=expected_value[best_idx], index=best_idx, pruned_fraction=0.)
     else:
@@ -206,17 +234,18 @@ def _opt_expected_utility_helper_lknn2(*, i : int,  lookahead_limit : int, t : i
         return Result(value=scores[best_idx], index=best_idx, pruned_fraction=0.)
 
 
-def efficient_nonmyopic_search(model : ProbabilityModel, *, reward_horizon : int,  lookahead_limit : int, pruning_on : bool, implementation : str) -> Result:
+def efficient_nonmyopic_search(model : ProbabilityModel, *, reward_horizon : int,  lookahead_limit : int, pruning_on : bool, implementation : str, 
+                                deadline=None) -> Result:
     ''' lookahead_limit: 0 means no tree search, 1 
         time_horizon: how many moves into the future
+        deadline: (vectorized implementation only) once expired, picks the best of the candidates evaluated so far
     '''
     assert reward_horizon > 0
     assert 1 <= lookahead_limit <= 2, 'implementation assumes at most 1 lookahead (pruning)'
     assert lookahead_limit <= reward_horizon
 
     if implementation == 'vectorized':
-        return _opt_expected_utility_helper_lknn2(i=0, lookahead_limit=lookahead_limit, t=reward_horizon, model=model, pruning_on=pruning_on)
+        return _opt_expected_utility_helper_lknn2(i=0, lookahead_limit=lookahead_limit, t=reward_horizon, model=model, pruning_on=pruning_on, 
+                                                    deadline=deadline)
     elif implementation == 'loop':
         return _opt_expected_utility_helper(i=0, lookahead_limit=lookahead_limit, t=reward_horizon, model=model, pruning_on=pruning_on)
-
-
@@ -0,0 +1,23 @@
+from seesaw.research.active_search.efficient_nonmyopic_search import _top_sum, _top_sum_until
+from seesaw.loops.util import Deadline
+import numpy as np
+
+
+def test_top_sum_rows():
+    rng = np.random.default_rng(0)
+    N, D, K = 50, 3, 4
+    neighbor_ids = np.stack([rng.choice(np.delete(np.arange(N), i), size=D, replace=False) for i in range(N)])
+    neighbor_ids_sorted = np.sort(neighbor_ids)
+    denominators = rng.integers(1, 5, size=N).astype(float)
+    numerators = rng.uniform(0, 1, size=N) * denominators
+    scores = numerators/denominators
+    args = dict(numerators=numerators, denominators=denominators, scores=scores, neighbor_ids_sorted=neighbor_ids_sorted, N=N, K=K, D=D)
+
+    full = _top_sum(**args)
+    rows = rng.permutation(N)[:7]
+    assert np.allclose(_top_sum(**args, rows=rows), full[rows])
+
+    partial = _top_sum_until(**args, deadline=Deadline(0.), chunk_size=10)
+    first = np.argsort(-scores)[:10]
+    assert np.allclose(partial[first], full[first])
+    assert np.isnan(partial).sum() == N - 10
@@ -138,10 +138,10 @@ class BaseLabelPropagationRanker:
         else:
             self._current_scores = self._propagate(self.prior_scores)
 
-    def _propagate(self, scores):
+    def _propagate(self, scores, deadline=None):
         raise NotImplementedError('implement me')
 
-    def update(self, idxs, labels):
+    def update(self, idxs, labels, deadline=None):
         for idx, label in zip(idxs, labels):
             idx = int(idx)
             label = float(label)
@@ -152,7 +152,7 @@ class BaseLabelPropagationRanker:
         num_negatives = sum(self.labels[self.is_labeled > 0] == 0)
         if num_negatives > 0:
             print(' propagating')
-            pscores = self._propagate(self.prior_scores)
+            pscores = self._propagate(self.prior_scores, deadline=deadline)
             self._current_scores = pscores
         else:
             print(' no negatives yet, skipping propagation')
@@ -192,8 +192,9 @@ class LabelPropagationRanker2(BaseLabelPropagationRanker):
         #     self.weight_matrix_intra = get_weight_matrix(knng_intra, kfun=kfun, self_edges=self_edges, normalized=normalized_weights)
         #     self.lp = LabelPropagationComposite(weight_matrix_intra = self.weight_matrix_intra, **common_params)
     
-    def _propagate(self,  scores):
+    def _propagate(self,  scores, deadline=None):
         ids = np.nonzero(self.is_labeled.reshape(-1))
         labels = self.labels.reshape(-1)[ids]
-        scores = self.lp.fit_transform(label_ids=ids, label_values=labels, reg_values=self.prior_scores, start_value=scores)
+        scores = self.lp.fit_transform(label_ids=ids, label_values=labels, reg_values=self.prior_scores, start_value=scores, 
+                                        deadline=deadline)
         return scores
\ No newline at end of file
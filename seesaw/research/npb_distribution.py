@@ -1,5 +1,6 @@
 import torch
 import torch.distributions
+import math
 
 
 class NPBDistribution:
@@ -58,6 +59,23 @@ class NPBDistribution:
     def variance(self):
         pass
         
+def npb_expectation_batch(r, probs : torch.Tensor) -> torch.Tensor:
+    """ vectorized form of NPBDistribution(r, probs[i]).expectation(method='accu_prime') for every row i.
+        r: scalar or tensor of shape (B,), one target per row
+        probs: (B, n). rows can be truncated to a prefix (and zero padded), as long as the prefix reaches r.
+        rows whose probabilities never add up to r get inf, rows with r <= 0 get 0.
+    """
+    n = probs.shape[-1]
+    r = torch.as_tensor(r, dtype=probs.dtype).expand(probs.shape[0])
+    csum = probs.cumsum(dim=-1)
+    index = (csum < r.unsqueeze(-1)).sum(dim=-1) # zero based position of the crossing
+    safe_index = index.clamp(max=n-1).unsqueeze(-1)
+    excess = csum.gather(-1, safe_index).squeeze(-1) - r
+    p_crossing = probs.gather(-1, safe_index).squeeze(-1)
+    ans = (index + 1).to(probs.dtype) - excess/p_crossing
+    ans = torch.where(index < n, ans, torch.full_like(ans, math.inf))
+    return torch.where(r > 0, ans, torch.zeros_like(ans))
+
 class PBDistribution:
     """ params probs=[p1,p2,..., p_n]
     X = number of Heads we expect from tossing all n biased coins.
@@ -105,4 +123,4 @@ def test_npb_expectation():
     estimate1 = cost_dist.expectation(method='accu_prime')
     estimate0 = mm.mean()
     deviation =  (estimate1 - estimate0).abs()
-    assert deviation < max(3*mm.std().item(), 1)
\ No newline at end of file
+    assert deviation < max(3*mm.std().item(), 1)
@@ -0,0 +1,19 @@
+from seesaw.research.npb_distribution import npb_expectation_batch, NPBDistribution
+import torch
+
+
+def test_npb_expectation_batch():
+    n_points = 200
+    sample_p = torch.distributions.Beta(20, 200).sample((8, n_points)).double()
+    sample_p = torch.sort(sample_p, dim=-1, descending=True).values
+    rs = torch.tensor([1, 2, 3, 5, 5, 3, 2, 1])
+
+    batch = npb_expectation_batch(rs, sample_p)
+    for i in range(sample_p.shape[0]):
+        single = NPBDistribution(rs[i].item(), sample_p[i]).expectation(method='accu_prime')
+        assert torch.isclose(batch[i], single)
+
+    ## truncated prefix gives same answer as long as it crosses r
+    assert torch.isclose(npb_expectation_batch(1, sample_p[:, :100]), npb_expectation_batch(1, sample_p)).all()
+    assert torch.isinf(npb_expectation_batch(1000, sample_p)).all()
+    assert (npb_expectation_batch(0, sample_p) == 0).all()
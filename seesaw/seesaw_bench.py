@@ -14,7 +14,7 @@ import math
 from .util import *
 import pyroaring as pr
 from .seesaw_session import make_session, Session
-from .basic_types import Imdata, SessionParams, BenchParams, BenchResult, BenchSummary, Box, is_image_accepted
+from .basic_types import Imdata, SessionParams, SessionStateDelta, BenchParams, BenchResult, BenchSummary, Box, is_image_accepted
 from .metrics import compute_metrics
 from .dataset_manager import GlobalDataManager
 import numpy as np
@@ -322,15 +322,15 @@ def benchmark_loop(
         if len(idxbatch) == 0:
             break
 
-        s = copy.deepcopy(session.get_state())
-        last_batch = s.gdata[-1]
+        last_batch = copy.deepcopy(session.get_batch_data(-1))
         for j, imdata in enumerate(last_batch):
             if b.provide_textual_feedback:
                 last_batch[j] = fill_imdata(imdata, all_box_data, b)
             else:
                 last_batch[j] = fill_imdata(imdata, box_data, b)
 
-        session.update_state(s)
+        applied = session.apply_delta(SessionStateDelta(version=session.version, changes=last_batch))
+        assert applied
         batch_pos = np.array([is_image_accepted(imdata) for imdata in last_batch])
         total_results += batch_pos.sum()
         total_seen += idxbatch.shape[0]
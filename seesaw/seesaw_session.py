@@ -4,10 +4,12 @@ from .loops.registry import build_loop_from_params
 from .dataset import BaseDataset
 from .indices.interface import AccessMethod
 from .labeldb import LabelDB
-from .basic_types import BenchParams, SessionState, SessionParams, ActivationData, Box, Imdata, is_image_accepted
+from .basic_types import BenchParams, SessionState, SessionStateDelta, SessionParams, ActivationData, Box, Imdata, is_image_accepted
 
 import time
+import pickle
 import pyroaring as pr
+from typing import List
 
 class Session:
     current_dataset: str
@@ -41,6 +43,7 @@ class Session:
         self.init_q = None
         self.timing = []
         self.image_timing = {}
+        self.image_sizes = {} # dbidx -> (width, height), only needed with thumbnails
         self.index = hdb
         self.q = hdb.new_query()
 
@@ -59,7 +62,11 @@ class Session:
 
         self.loop = build_loop_from_params(self.gdm, self.q, params=self.params)
         self.action_log = []
-        self._last_change = None
+        self._last_change = None # changes not yet passed to refine, as sorted (dbidx, label) pairs
+        self._unrefined_changes = {}
+        self.version = 0
+        self._batch_cache = [] # serialized panel data per batch, None when it needs rebuilding
+        self._dbidx2batch = {}
         self._log("init")
 
     def get_totals(self):
@@ -68,11 +75,11 @@ class Session:
     def get_method_stats(self):
         return self.loop.get_stats()
 
-    def _log(self, message: str):
+    def _log(self, message: str, at=None):
         self.action_log.append(
             {
                 "logger": "server",
-                "time": time.time(),
+                "time": time.time() if at is None else at,
                 "message": message,
                 "seen": len(self.seen),
                 "accepted": len(self.accepted),
@@ -80,16 +87,39 @@ class Session:
         )
 
     def next(self):
-        self._log("next.start")
+        return self.commit_next(*self.prepare_next())
+
+    def prepare_next(self):
+        """ computes the next batch without adding it to the session, so it can be computed speculatively.
+            returns (batch, elapsed time, effects) to pass to commit_next. the loop stats and logs only
+            change on commit, so discarded batches leave no trace.
+        """
+        returned = self.q.returned.copy()
+        stats_before = self.loop.batch_stats()
 
         start = time.time()
         r = self.loop.next_batch_external()
-
         delta = time.time() - start
 
+        effects = {'start':start, 'loop_stats':self.loop.batch_stats()}
+        self.q.returned = returned # loops mark results as returned, undo until committed
+        self.loop.set_batch_stats(stats_before)
+        return r, delta, effects
+
+    def commit_next(self, r, delta, effects):
+        self._log("next.start", at=effects['start'])
+        self.loop.set_batch_stats(effects['loop_stats'])
+        self.q.returned.update(r["dbidxs"])
         self.acc_indices.append(r["dbidxs"])
         self.acc_activations.append(r["activations"])
         self.timing.append(delta)
+
+        if self.params.annotation_category is not None and len(self._batch_cache) > 0:
+            self._batch_cache[-1] = None # no longer the prefilled batch
+        self._batch_cache.append(None)
+        for dbidx in r["dbidxs"]:
+            self._dbidx2batch[int(dbidx)] = len(self.acc_indices) - 1
+
         self._log("next.end")
         return r["dbidxs"]
 
@@ -103,7 +133,39 @@ class Session:
         self.loop.set_text_vec(vec)
 
     def update_state(self, state: SessionState):
+        """ full resync from client state. """
         self._update_labeldb(state)
+        self._after_update()
+
+    def apply_delta(self, delta: SessionStateDelta) -> bool:
+        """ applies only the changed images. returns False without changing anything if the delta
+            was computed against an older version, in which case the caller should resync with update_state.
+        """
+        if delta.version != self.version:
+            print(f'stale delta {delta.version=} {self.version=}, need full state')
+            return False
+
+        self.action_log.extend(delta.action_log)
+        changes = []
+        for imdata in delta.changes:
+            newly_seen = imdata.dbidx not in self.seen
+            newly_accepted = is_image_accepted(imdata) and imdata.dbidx not in self.accepted
+            self._put_imdata(imdata)
+            if newly_seen or newly_accepted:
+                changes.append((imdata.dbidx, 1 if newly_accepted else 0))
+
+        print(f'updating: {changes=}')
+        self._add_changes(changes)
+        self._after_update()
+        return True
+
+    def _add_changes(self, changes):
+        """ changes accumulate until refine consumes them, so updates applied without a refine in between are not lost """
+        self._unrefined_changes.update(changes)
+        self._last_change = sorted(self._unrefined_changes.items())
+
+    def _after_update(self):
+        self.version += 1
         self._log(
             "update_state.end"
         )  # log this after updating so that it includes all new information
@@ -132,31 +194,62 @@ class Session:
     def refine(self):
         self._log("refine.start")
         self.loop.refine_external(self._last_change)
+        self._unrefined_changes = {}
         self._log("refine.end")
 
-    def get_state(self) -> SessionState:
-        gdata = []
-        for i, (indices, accs) in enumerate(zip(self.acc_indices, self.acc_activations)):
+    def get_batch_data(self, i: int) -> List[Imdata]:
+        """ panel data for the i-th batch returned so far (negative i counts from the end).
+            cached until the labels of some image in the batch change, callers should not modify it.
+        """
+        i = range(len(self.acc_indices))[i]
+        if self._batch_cache[i] is None:
             prefill = (self.params.annotation_category is not None) and (i == len(self.acc_indices) - 1)
-             # prefill last batch if annotation category is on (assumes last batch has no user annotations yet..)
-            imdata = self.get_panel_data(idxbatch=indices, activation_batch=accs, prefill=prefill)
-            gdata.append(imdata)
+            # prefill last batch if annotation category is on (assumes last batch has no user annotations yet..)
+            self._batch_cache[i] = self.get_panel_data(idxbatch=self.acc_indices[i], activation_batch=self.acc_activations[i], prefill=prefill)
+        return self._batch_cache[i]
+
+    def _invalidate(self, dbidx):
+        i = self._dbidx2batch.get(dbidx)
+        if i is not None:
+            self._batch_cache[i] = None
+
+    def get_state(self, since_batch: int = 0, since_log: int = 0) -> SessionState:
+        """ since_batch: only include batches from this one on (see SessionState.gdata_start)
+            since_log: only include action_log entries from this one on (see SessionState.action_log_start)
+        """
+        gdata = []
+        for i in range(since_batch, len(self.acc_indices)):
+            gdata.append(self.get_batch_data(i))
+        if since_log > len(self.action_log): # log was replaced by a full state update, resend all of it
+            since_log = 0
         dat = {}
-        dat["action_log"] = self.action_log
+        dat["gdata_start"] = since_batch
+        dat["action_log"] = self.action_log[since_log:]
+        dat["action_log_start"] = since_log
         dat["gdata"] = gdata
         dat["timing"] = self.timing
         dat["reference_categories"] = []
         dat["params"] = self.params
         dat["query_string"] = self.loop.state.curr_str
+        dat["version"] = self.version
         return SessionState(**dat)
 
     def get_panel_data(self, *, idxbatch, activation_batch=None, prefill=False):
         reslabs = []
         #urls = get_image_paths(self.dataset.image_root, self.dataset.paths, idxbatch)
         urls = self.dataset.get_urls(idxbatch)
+        if self.params.thumbnail_size is not None:
+            thumbnail_urls = self.dataset.get_urls(idxbatch, thumbnail_size=self.params.thumbnail_size)
+        else:
+            thumbnail_urls = [None]*len(urls)
 
-        for i, (url, dbidx) in enumerate(zip(urls, idxbatch)):
+        for i, (url, thumbnail_url, dbidx) in enumerate(zip(urls, thumbnail_urls, idxbatch)):
             dbidx = int(dbidx)
+            (width, height) = (None, None)
+            if thumbnail_url is not None:
+                if dbidx not in self.image_sizes:
+                    self.image_sizes[dbidx] = self.dataset.get_image_size(dbidx)
+                (width, height) = self.image_sizes[dbidx]
 
             if prefill:
                 boxes = self.label_db.get(dbidx, format="box")
@@ -181,6 +274,9 @@ class Session:
                 boxes=boxes,
                 activations=activations,
                 timing=self.image_timing.get(dbidx, []),
+                thumbnail_url=thumbnail_url,
+                width=width,
+                height=height,
             )
             reslabs.append(elt)
         return reslabs
@@ -195,11 +291,7 @@ class Session:
         self.seen.clear()
         for ldata in gdata:
             for imdata in ldata:
-                self.image_timing[imdata.dbidx] = imdata.timing
-                self.seen.add(imdata.dbidx)
-                if is_image_accepted(imdata):
-                    self.accepted.add(imdata.dbidx)
-                self.q.label_db.put(imdata.dbidx, imdata.boxes)
+                self._put_imdata(imdata)
 
 
         delta_accepted = self.accepted - old_accepted
@@ -210,7 +302,19 @@ class Session:
         changes = []
         for idx in changed:
             changes.append((idx, 1 if idx in delta_accepted else 0 ))
-        self._last_change = changes
+        self._add_changes(changes)
+
+    def _put_imdata(self, imdata: Imdata):
+        timing_changed = self.image_timing.get(imdata.dbidx) != imdata.timing
+        self.image_timing[imdata.dbidx] = imdata.timing
+        self.seen.add(imdata.dbidx)
+        if is_image_accepted(imdata):
+            self.accepted.add(imdata.dbidx)
+        else:
+            self.accepted.discard(imdata.dbidx)
+        labels_changed = self.q.label_db.put(imdata.dbidx, imdata.boxes)
+        if labels_changed or timing_changed:
+            self._invalidate(imdata.dbidx)
 
 
 def get_labeled_subset_dbdidxs(qgt, c_name):
@@ -243,3 +347,79 @@ def make_session(gdm: GlobalDataManager, p: SessionParams, b : BenchParams = Non
         "session": session,
         "dataset": ds,
     }
+
+
+_SNAPSHOT_FORMAT = 2
+_unshared_types = (str, bytes, int, float, bool, type(None), tuple)
+
+def _shared_objects(gdm: GlobalDataManager, dataset: BaseDataset, index: AccessMethod) -> dict:
+    """ objects a session points to but does not own: key -> object.
+        snapshots store these by key, and restoring resolves the keys against the current process.
+    """
+    shared = {('gdm',): gdm, ('dataset',): dataset, ('index',): index}
+    for (name, obj) in [('dataset', dataset), ('index', index)]:
+        for (attr, value) in vars(obj).items():
+            if not isinstance(value, _unshared_types):
+                shared[(name, attr)] = value
+    return shared
+
+class _SnapshotPickler(pickle.Pickler):
+    def __init__(self, file, shared: dict):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._shared_ids = {id(obj): key for (key, obj) in shared.items()}
+        self._shared = shared # keep alive while pickling so ids are not reused
+
+        from . import services # shared process-wide cache entries, eg. knn weight matrices
+        if services._cache is not None:
+            for (key, obj) in services._cache.mapping.items():
+                ## stored as the recipe that rebuilds them (through the cache) when restoring in another process.
+                ## entries without one are copied into the snapshot
+                if key in services._recipes:
+                    self._shared_ids.setdefault(id(obj), ('cache', key, services._recipes[key]))
+
+    def persistent_id(self, obj):
+        return self._shared_ids.get(id(obj))
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, shared: dict):
+        super().__init__(file)
+        self._shared = shared
+
+    def persistent_load(self, pid):
+        if pid[0] == 'cache':
+            (_, key, (fn, args, kwargs)) = pid
+            return fn(*args, **kwargs)
+        if pid not in self._shared:
+            raise pickle.UnpicklingError(f'snapshot references {pid=}, which the loaded index or dataset does not have')
+        return self._shared[pid]
+
+def save_session_snapshot(session: Session, file):
+    """ writes the full session state (loop, label db, bitmaps, models) in binary form to an open file.
+        the dataset, index and cached arrays are stored by reference, not copied (cached arrays by how to rebuild them).
+    """
+    header = {'format': _SNAPSHOT_FORMAT, 'params': session.params.json()}
+    pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+    _SnapshotPickler(file, _shared_objects(session.gdm, session.dataset, session.index)).dump(session)
+
+def load_session_snapshot(gdm: GlobalDataManager, file, *, reuse: Session = None) -> Session:
+    """ restores a session written by save_session_snapshot.
+        if reuse is a session over the same dataset and index, those are shared instead of loaded again,
+        so restoring only costs reading the session's own state.
+    """
+    header = pickle.load(file)
+    assert header['format'] == _SNAPSHOT_FORMAT, f'unknown snapshot format {header["format"]}'
+    p = SessionParams.parse_raw(header['params'])
+
+    if (reuse is not None and reuse.params.index_spec == p.index_spec 
+            and reuse.params.index_options == p.index_options):
+        dataset = reuse.dataset
+        index = reuse.index
+    else:
+        dataset = gdm.get_dataset(p.index_spec.d_name)
+        if p.index_spec.c_name is not None:
+            dataset = dataset.load_subset(p.index_spec.c_name)
+        index = dataset.load_index(p.index_spec.i_name, options=p.index_options)
+
+    session = _SnapshotUnpickler(file, _shared_objects(gdm, dataset, index)).load()
+    assert isinstance(session, Session)
+    return session
@@ -15,9 +15,16 @@ def _get_cache() -> LocalCache:
     
     return _cache
 
-def _cache_closure(closure, *, key: str, use_cache : bool):
+_recipes = {} # cache key -> (fn, args, kwargs) such that fn(*args, **kwargs) returns the cached value
+
+def _cache_closure(closure, *, key: str, use_cache : bool, recipe=None):
+    """ recipe: (fn, args, kwargs) with picklable parts that rebuilds the value, lets session snapshots 
+        store the value by reference and rebuild it in a fresh process.
+    """
     if use_cache:
         cache = _get_cache()
+        if recipe is not None:
+            _recipes[key] = recipe
         return cache.get_or_initialize(key, closure)
     else:
         return closure()
@@ -27,7 +34,8 @@ def get_parquet(path: str, columns=None, parallelism=-1, cache=True) -> pd.DataF
     path = resolve_path(path)
     def _init_fun():
         return parallel_read_parquet(path, columns, parallelism = parallelism)
-    return _cache_closure(_init_fun, key=path, use_cache=cache)
+    return _cache_closure(_init_fun, key=path, use_cache=cache, 
+                            recipe=(get_parquet, (path,), dict(columns=columns, parallelism=parallelism)))
 
 def read_state_dict(path: str, jit: bool, use_cache = True) -> dict:
     import torch
@@ -42,7 +50,7 @@ def read_state_dict(path: str, jit: bool, use_cache = True) -> dict:
             else:  # not sure what else to do here
                 return mod
     
-    return _cache_closure(_init_fun, key=path, use_cache=use_cache)
+    return _cache_closure(_init_fun, key=path, use_cache=use_cache, recipe=(read_state_dict, (path, jit), {}))
 
 def get_model_actor(model_path : str) -> ModelStub:
     import ray
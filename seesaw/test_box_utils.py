@@ -70,3 +70,18 @@ def test_segment_intersect():
     assert (zeros == is_disjoint).all()
 
     assert (intersect.to_x1x2()[~is_disjoint] == expected.to_x1x2()[~is_disjoint]).all()
+
+
+def test_max_iou_xyxy():
+    from .box_utils import max_iou_xyxy, box_iou
+    rng = np.random.default_rng(0)
+    def rand_boxes(n):
+        xy = rng.uniform(0, 100, size=(n, 2))
+        wh = rng.uniform(1, 50, size=(n, 2))
+        return pd.DataFrame(np.concatenate([xy, xy + wh], axis=1), columns=['x1', 'y1', 'x2', 'y2'])
+
+    tiles = rand_boxes(20)
+    labels = rand_boxes(3)
+    expected = box_iou(tiles, labels).max(axis=1)
+    assert np.isclose(max_iou_xyxy(tiles.values, labels.values), expected).all()
+    assert (max_iou_xyxy(tiles.values, np.zeros((0, 4))) == 0).all()
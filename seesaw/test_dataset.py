@@ -0,0 +1,19 @@
+from seesaw.dataset import thumbnail_url, list_image_paths, list_image_files
+import os
+
+
+def test_thumbnail_url():
+    assert thumbnail_url('coco', 3, 256) == '/api/thumb/coco/3?size=256'
+    assert thumbnail_url('coco', 3, 256, host='http://localhost:8000/') == 'http://localhost:8000/api/thumb/coco/3?size=256'
+    assert thumbnail_url('coco', 3, 64, box=(0, 10.5, 20, 30)).endswith('?size=64&box=0,10.5,20,30')
+
+def test_scan_image_files(tmp_path):
+    for p in ['a.jpg', 'b.txt', 'sub/c.PNG', 'sub/deeper/d.jpeg', '.hidden/e.jpg']:
+        os.makedirs(os.path.dirname(f'{tmp_path}/{p}'), exist_ok=True)
+        open(f'{tmp_path}/{p}', 'w').write('x')
+
+    assert list_image_paths(str(tmp_path)) == ['a.jpg', 'sub/c.PNG', 'sub/deeper/d.jpeg']
+    assert list_image_paths(str(tmp_path), prefixes=['sub/']) == ['sub/c.PNG', 'sub/deeper/d.jpeg']
+    files = list_image_files(str(tmp_path))
+    assert files.file_path.tolist() == ['a.jpg', 'sub/c.PNG', 'sub/deeper/d.jpeg']
+    assert (files['size'] == 1).all()
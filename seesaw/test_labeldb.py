@@ -0,0 +1,39 @@
+from seesaw.labeldb import LabelDB
+from seesaw.basic_types import Box
+import pandas as pd
+
+
+def test_labeldb():
+    db = LabelDB()
+    assert db.get(1, format='box') is None
+
+    db.put(1, None)
+    db.put(3, [Box(x1=0, y1=0, x2=10, y2=10, description='car', marked_accepted=True)])
+    db.put(2, [])
+    assert db.get(1, format='box') == []
+    assert db.get(2, format='binary') == 0
+    assert db.get(3, format='binary') == 1
+    assert db.get(3, format='box')[0].description == 'car'
+    assert set(db.get_seen()) == {1, 2, 3}
+
+    changed, pos = db.changes_since(0)
+    assert set(changed) == {1, 2, 3}
+
+    db.put(3, db.get(3, format='box')) # no change
+    changed, _ = db.changes_since(pos)
+    assert len(changed) == 0
+
+    db.put(3, [Box(x1=0, y1=0, x2=5, y2=5, description=None), Box(x1=1, y1=1, x2=2, y2=2, description='car')])
+    db.fill(pd.DataFrame({'dbidx':[5, 4, 5], 'x1':[0., 0., 1.], 'y1':[0., 0., 1.], 'x2':[1., 1., 2.], 'y2':[1., 1., 2.],
+                            'category':['dog', 'car', 'car']}))
+
+    boxdf = db.get_box_df(return_description=True)
+    assert boxdf.shape[0] == 5
+    assert (boxdf.groupby('dbidx').size() == pd.Series({3:2, 4:1, 5:2})).all()
+    assert db.get(3, format='box')[0].description is None
+    assert db.get(5, format='df').shape == (2, 4)
+    assert db.get(4, format='box')[0].marked_accepted
+
+    box = Box(x1=0.1, y1=1/3, x2=100.7, y2=2e5 + 0.3, description='car')
+    db.put(6, [box])
+    assert db.get(6, format='box') == [box]
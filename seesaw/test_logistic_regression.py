@@ -0,0 +1,31 @@
+from seesaw.logistic_regression import LogisticRegressionNP
+import numpy as np
+
+
+def test_logistic_regression_np_derivatives():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(30, 5))
+    y = (rng.random(30) > .5).astype(np.float64)
+    sample_weights = rng.random(30) + .5
+    for regularizer_vector in [rng.normal(size=5), 'norm1', 'norm', None]:
+        m = LogisticRegressionNP(class_weights=2., scale='centered', reg_lambda=3., 
+                            regularizer_vector=regularizer_vector, fit_intercept=True)
+        m.dim_ = 5
+        Xa = np.concatenate([X, np.ones((30,1))], axis=1)
+        args = (Xa, y, sample_weights, 2., .1)
+        theta = rng.normal(size=6)
+        _, grad, hess = m._objective(theta, *args, order=2)
+
+        eps = 1e-6
+        for i in range(6):
+            e = np.zeros(6)
+            e[i] = eps
+            fd = (m._objective(theta + e, *args, order=0)[0] - m._objective(theta - e, *args, order=0)[0])/(2*eps)
+            assert np.isclose(fd, grad[i], atol=1e-5)
+            fd_grad = (m._objective(theta + e, *args, order=2)[1] - m._objective(theta - e, *args, order=2)[1])/(2*eps)
+            assert np.allclose(fd_grad, hess[:,i], atol=1e-4)
+
+        m.fit(X, y, sample_weights)
+        Xc = np.concatenate([X - X.mean(axis=0), np.ones((30,1))], axis=1)
+        _, grad, _ = m._objective(np.append(m.coef_, m.intercept_), Xc, y, sample_weights, 2., 3./30, order=2)
+        assert np.abs(grad).max() < 1e-5
@@ -1,5 +1,6 @@
 from seesaw.rank_loss import (quick_pairwise_gradient_zero_margin,
            ref_signed_inversions, ref_pairwise_rank_loss, ref_pairwise_rank_loss_gradient,
+           fast_pairwise_rank_loss, ref_pairwise_logistic_loss, fast_pairwise_logistic_loss,
                 )
 
 import torch
@@ -275,4 +276,26 @@ def test_quick_pairwise_rank_loss_max_inversions():
     for test in get_test_cases():
           _, computed = quick_pairwise_gradient_zero_margin(test['target'], scores=test['scores'], return_max_inversions=True)
           expected = test['max_inversions']
-          assert torch.isclose(computed, expected).all(), f'{computed=} {expected=}'
\ No newline at end of file
+          assert torch.isclose(computed, expected).all(), f'{computed=} {expected=}'
+
+
+def test_fast_pairwise_rank_loss():
+    for test in get_test_cases():
+        scores = test['scores'].clone().requires_grad_(True)
+        computed, max_inv = fast_pairwise_rank_loss(test['target'], scores=scores, margin=test['margin'].item(), return_max_inversions=True)
+        expected = test['rank_loss'].sum(0) if len(test['rank_loss'].shape) == 2 else test['rank_loss']
+        assert torch.isclose(computed, expected).all(), f'{computed=} {expected=}'
+        assert torch.isclose(max_inv.float(), test['max_inversions']).all()
+
+        computed.sum().backward()
+        expected = ref_pairwise_rank_loss_gradient(test['target'], scores=test['scores'], margin=test['margin'])
+        assert torch.isclose(scores.grad, expected).all(), f'{scores.grad=} {expected=}'
+
+
+def test_fast_pairwise_logistic_loss():
+    torch.manual_seed(0)
+    target = torch.randint(0, 3, (200,)).float()
+    scores = torch.randn(200, dtype=torch.float64)*3
+    expected, max_inv = ref_pairwise_logistic_loss(target, scores=scores, aggregate='sum', return_max_inversions=True)
+    computed = fast_pairwise_logistic_loss(target, scores=scores, max_error=1e-3)
+    assert ((computed - expected).abs() <= 1e-3*max_inv + 1e-6).all()
@@ -0,0 +1,62 @@
+from seesaw.seesaw_session import _SnapshotPickler, _SnapshotUnpickler, _shared_objects
+from seesaw import services
+import numpy as np
+import io
+
+
+class _DictCache:
+    """ process local stand-in for services.LocalCache """
+    def __init__(self):
+        self.mapping = {}
+
+    def get_or_initialize(self, key, initializer_function):
+        if key not in self.mapping:
+            self.mapping[key] = initializer_function()
+        return self.mapping[key]
+
+def _cached_arange(n):
+    return services._cache_closure(lambda: np.arange(n), key=f'arange#{n}', use_cache=True, recipe=(_cached_arange, (n,), {}))
+
+def test_snapshot_rebuilds_cache_entries():
+    old_cache = services._cache
+    try:
+        services._cache = _DictCache()
+        state = {'cached': _cached_arange(5), 'uncached': np.arange(3)}
+        services._cache.mapping['no_recipe'] = state['uncached']
+
+        f = io.BytesIO()
+        _SnapshotPickler(f, {}).dump(state)
+        f.seek(0)
+
+        ## restoring after a restart: the cache starts empty
+        services._cache = _DictCache()
+        restored = _SnapshotUnpickler(f, {}).load()
+        assert restored['cached'] is services._cache.mapping['arange#5']
+        assert (restored['cached'] == np.arange(5)).all()
+        assert (restored['uncached'] == np.arange(3)).all() # copied into the snapshot
+    finally:
+        services._cache = old_cache
+
+
+def test_snapshot_shared_objects():
+    class Obj:
+        pass
+
+    gdm, dataset, index = Obj(), Obj(), Obj()
+    index.vectors = np.arange(10)
+    index.name = 'idx'
+    shared = _shared_objects(gdm, dataset, index)
+    assert ('index', 'name') not in shared
+
+    state = {'vectors': index.vectors, 'index': index, 'copy': index.vectors.copy()}
+    f = io.BytesIO()
+    _SnapshotPickler(f, shared).dump(state)
+    f.seek(0)
+
+    index2 = Obj()
+    index2.vectors = np.arange(10)
+    restored = _SnapshotUnpickler(f, _shared_objects(gdm, dataset, index2)).load()
+    assert restored['vectors'] is index2.vectors
+    assert restored['index'] is index2
+    assert restored['copy'] is not index2.vectors
+    assert (restored['copy'] == index.vectors).all()
@@ -0,0 +1,126 @@
+import threading
+from ..seesaw_session import Session
+from ..basic_types import SessionStateDelta
+from .common import StaleDeltaError
+
+
+class BackgroundRefiner:
+    """ applies label updates, refines and speculatively computes the next batch on a worker thread,
+        overlapping that work with the user labeling.
+        each label update makes in-flight work stale. stale work is abandoned at the next stage boundary
+        (after applying labels, after refine) and the worker starts over with the newer labels.
+        the session must only be accessed while holding self.lock.
+    """
+    def __init__(self, session: Session):
+        self.session = session
+        self.lock = threading.RLock() # guards session
+        self.cond = threading.Condition() # guards the fields below
+        self.pending = [] # deltas not yet applied
+        self.generation = 0 # bumped on every label update
+        self.queued_version = session.version # session version once pending deltas are applied
+        self.busy = False
+        self.prepared = None # (batch, elapsed, effects) from Session.prepare_next, for prepared_generation
+        self.prepared_generation = 0
+        self.error = None
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, delta: SessionStateDelta) -> int:
+        """ queues a label update, returns the session version it will result in """
+        with self.cond:
+            if delta.version != self.queued_version:
+                raise StaleDeltaError(f"stale delta {delta.version=} {self.queued_version=}, resend full session state")
+
+            self.pending.append(delta)
+            self.queued_version += 1
+            self.generation += 1
+            self.cond.notify_all()
+            return self.queued_version
+
+    def _is_stale(self, generation) -> bool:
+        with self.cond:
+            return generation != self.generation
+
+    def _work(self, deltas, generation):
+        with self.lock:
+            for delta in deltas:
+                applied = self.session.apply_delta(delta)
+                assert applied, 'versions are checked on submit'
+
+            if self._is_stale(generation):
+                return None # changes stay in the session until the next refine
+
+            self.session.refine()
+
+            if self._is_stale(generation):
+                return None
+
+            return self.session.prepare_next()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0 and not self.stopped:
+                    self.cond.wait()
+
+                if self.stopped:
+                    return
+
+                deltas, self.pending = self.pending, []
+                generation = self.generation
+                self.busy = True
+
+            batch = None
+            error = None
+            try:
+                batch = self._work(deltas, generation)
+            except Exception as e:
+                error = e
+
+            with self.cond:
+                self.busy = False
+                if generation == self.generation:
+                    self.prepared = batch
+                    self.prepared_generation = generation
+                    self.error = error
+                self.cond.notify_all()
+
+    def wait_idle(self):
+        with self.cond:
+            while self.busy or len(self.pending) > 0:
+                self.cond.wait()
+
+    def take_batch(self):
+        """ waits for any in-flight work, then commits the batch prepared for the latest labels,
+            computing it now if there is none
+        """
+        self.wait_idle()
+        with self.cond:
+            prepared = self.prepared if self.prepared_generation == self.generation else None
+            error = self.error
+            self.prepared = None
+            self.error = None
+
+        if error is not None:
+            raise error
+
+        with self.lock:
+            if prepared is None:
+                prepared = self.session.prepare_next()
+            return self.session.commit_next(*prepared)
+
+    def invalidate(self):
+        """ drops the prepared batch and resyncs the expected version, eg. after the query text changes
+            or a full state update. call after wait_idle, while holding self.lock
+        """
+        with self.cond:
+            assert not self.busy and len(self.pending) == 0
+            self.prepared = None
+            self.queued_version = self.session.version
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
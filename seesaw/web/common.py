@@ -5,7 +5,7 @@ from fastapi import Body, FastAPI, HTTPException
 
 from fastapi import HTTPException
 
-from ..basic_types import Box, SessionState, SessionParams, IndexSpec
+from ..basic_types import Box, SessionState, SessionStateDelta, SessionParams, IndexSpec
 
 import time
 
@@ -49,13 +49,37 @@ class NotificationState(BaseModel):
 
 
 class SessionReq(BaseModel):
-    client_data: AppState
+    client_data: Optional[AppState]
+    delta: Optional[SessionStateDelta] # when set, client_data.session may be omitted unless the delta is stale
+    since_batch: int = 0 # only return session batches from this one on
+    since_log: int = 0 # only return action_log entries from this one on
+
+
+class StaleDeltaError(Exception):
+    """ raised when a SessionStateDelta does not match the server version and no full state was sent """
+    pass
+
+def resolve_snapshot_path(save_path : str, name : str) -> str:
+    """ path of the snapshot for a saved session, given as its folder relative to save_path 
+        (eg. session_<id>/qkey_<qkey>/saved_<time>, see WebSession.save).
+        raises ValueError for anything resolving outside save_path, since snapshots are unpickled.
+    """
+    import os
+    root = os.path.realpath(save_path)
+    path = os.path.realpath(os.path.join(root, name.lstrip('/'), 'session.snapshot'))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f'{name=} is not a session saved under the save path')
+    return path
 
 
 class ResetReq(BaseModel):
     config: Optional[SessionParams]
 
 
+class LabelsResp(BaseModel):
+    version: int # session version once the labels are applied
+
+
 class SessionInfoReq(BaseModel):
     path: str
 
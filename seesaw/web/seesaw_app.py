@@ -244,6 +244,31 @@ async def annotate(dataset : str, category : str, pathfile : str):
         )
 
 
+@app.post("/resume", response_model=AppState)
+async def resume(name : str, response: Response, manager=Depends(get_manager), session_id=Cookie(default=None)):
+    """ continues a session from the snapshot written when it was saved (see /save).
+        name: the saved session folder relative to the server save path, eg. session_<id>/qkey_<qkey>/saved_<time>
+    """
+    save_path = await manager.get_save_path.remote()
+    try:
+        snapshot_path = resolve_snapshot_path(save_path, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(snapshot_path):
+        raise HTTPException(status_code=404, detail=f"no saved session {name=}")
+
+    if session_id is None or not await manager.session_exists.remote(session_id):
+        session_id = await manager.new_session.remote()
+        response.set_cookie(
+            key="session_id",
+            value=session_id,
+            max_age=pd.Timedelta("2 hours").total_seconds(),
+        )
+
+    handle = await get_handle(session_id)
+    return await handle.resume.remote(name)
+
+
 @app.post("/session_info", response_model=AppState)
 async def session_info(path : str,
                 annotation_category: str = None):
@@ -326,7 +351,7 @@ async def session_end(
         return EndSession(token=None)
     else:
         app_state = body.client_data
-        save_path = app_state.save_path
+        save_path = app_state.save_path if app_state is not None else None
         if save_path is None:
             print('session has no savepath, doing nothing')
             return EndSession(token=None)
@@ -342,8 +367,8 @@ async def session_end(
 
 
 @app.get("/getstate", response_model=AppState)
-async def getstate(handle=Depends(get_handle)):
-    return await handle.getstate.remote()
+async def getstate(since_batch: int = 0, since_log: int = 0, handle=Depends(get_handle)):
+    return await handle.getstate.remote(since_batch, since_log)
 
 
 @app.post("/reset", response_model=AppState)
@@ -353,12 +378,24 @@ async def reset(r: ResetReq, handle=Depends(get_handle)):
 
 @app.post("/next", response_model=AppState)
 async def next(body: SessionReq, handle=Depends(get_handle)):
-    return await handle.next.remote(body)
+    try:
+        return await handle.next.remote(body)
+    except StaleDeltaError as e:
+        # client should retry sending its full session state
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/labels", response_model=LabelsResp)
+async def labels(delta: SessionStateDelta, handle=Depends(get_handle)):
+    try:
+        return await handle.labels.remote(delta)
+    except StaleDeltaError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 
 @app.post("/text", response_model=AppState)
-async def text(key: str, handle=Depends(get_handle)):
-    return await handle.text.remote(key)
+async def text(key: str, since_batch: int = 0, since_log: int = 0, handle=Depends(get_handle)):
+    return await handle.text.remote(key, since_batch, since_log)
 
 
 @app.post("/save", response_model=SaveResp)
@@ -379,3 +416,45 @@ async def sleep(handle=Depends(get_handle)):
 @app.post("/test")
 async def test(handle=Depends(get_handle)):
     return await handle.test.remote()
+
+
+from .thumbnail_cache import ThumbnailCache, is_valid_box
+import asyncio
+
+_thumbnail_state = {} # cache and datasets, created on first use
+
+async def _get_thumbnail_state(manager):
+    if 'cache' not in _thumbnail_state:
+        root_dir = await manager.get_root_dir.remote()
+        _thumbnail_state['gdm'] = GlobalDataManager(root_dir)
+        _thumbnail_state['datasets'] = {}
+        _thumbnail_state['cache'] = ThumbnailCache(f'{root_dir}/.thumbnail_cache')
+    return _thumbnail_state
+
+@app.get("/thumb/{dataset}/{dbidx}")
+async def thumb(dataset: str, dbidx: int, size: int = 256, box: Optional[str] = None, manager=Depends(get_manager)):
+    """ thumbnail of the image, or of the box x1,y1,x2,y2 within it, from the local disk cache. see get_thumbnail_url """
+    if not (16 <= size <= 2048):
+        raise HTTPException(status_code=400, detail=f"{size=} out of range")
+
+    state = await _get_thumbnail_state(manager)
+    if dataset not in state['datasets']:
+        if dataset not in state['gdm'].list_datasets():
+            raise HTTPException(status_code=404, detail=f"unknown {dataset=}")
+        state['datasets'][dataset] = state['gdm'].get_dataset(dataset)
+    ds = state['datasets'][dataset]
+
+    if dbidx < 0 or dbidx >= len(ds.paths):
+        raise HTTPException(status_code=404, detail=f"unknown {dbidx=}")
+
+    if box is not None:
+        try:
+            box = tuple(float(v) for v in box.split(','))
+        except ValueError:
+            box = ()
+        if len(box) != 4 or not is_valid_box(box):
+            raise HTTPException(status_code=400, detail=f"{box=} should be x1,y1,x2,y2 with x2 > x1 >= 0 and y2 > y1 >= 0")
+
+    image_path = f'{ds.image_root}/{ds.paths[dbidx]}'
+    data = await asyncio.wrap_future(state['cache'].submit(image_path, size, box))
+    return Response(content=data, media_type='image/jpeg', headers={'Cache-Control':'public, max-age=86400'})
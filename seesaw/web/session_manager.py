@@ -34,22 +34,30 @@ WebSessionActor = ray.remote(WebSession)
 class SessionManager:
     sessions: Dict[str, ActorHandle]
 
-    def __init__(self, root_dir, save_path, num_cpus_per_session):
+    def __init__(self, root_dir, save_path, num_cpus_per_session, background_refine=False):
         self.root_dir = root_dir
         self.save_path = save_path
         self.num_cpus = num_cpus_per_session
+        self.background_refine = background_refine
         self.sessions = {}
 
     def ready(self):
         return True
 
+    def get_root_dir(self):
+        return self.root_dir
+
+    def get_save_path(self):
+        return self.save_path
+
     def _new_session(self, task_list):
         session_id = generate_id()
         worker = Worker(session_id=session_id, task_list=task_list)
         self.sessions[session_id] = WebSessionActor.options(
             name=f"web_session#{session_id}", num_cpus=self.num_cpus
         ).remote(
-            self.root_dir, self.save_path, session_id, worker, num_cpus=self.num_cpus
+            self.root_dir, self.save_path, session_id, worker, num_cpus=self.num_cpus,
+            background_refine=self.background_refine
         )
         return session_id
 
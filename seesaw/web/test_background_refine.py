@@ -0,0 +1,52 @@
+from seesaw.web.background_refine import BackgroundRefiner
+from seesaw.loops.LKNN_model import LKNNModel
+from seesaw.research.active_search.common import Dataset
+from types import SimpleNamespace
+import numpy as np
+import scipy.sparse as sp
+
+
+class _ModelSession:
+    """ the part of Session used by BackgroundRefiner, refining an LKNNModel the way LKNNSearch does """
+    def __init__(self, model):
+        self.model = model
+        self.version = 0
+        self.changes = []
+
+    def apply_delta(self, delta):
+        if delta.version != self.version:
+            return False
+        self.changes.extend(delta.changes)
+        self.version += 1
+        return True
+
+    def refine(self):
+        for (idx, y) in self.changes:
+            self.model.condition_(idx, y)
+        self.changes = []
+
+    def prepare_next(self):
+        idxs, _ = self.model.top_k_remaining(top_k=1)
+        return {'dbidxs': idxs}, 0., {}
+
+    def commit_next(self, r, delta, effects):
+        return r['dbidxs']
+
+
+def test_seen_then_accepted():
+    dataset = Dataset.from_vectors(np.random.random((5,10)))
+    matrix = sp.csr_array(np.roll(np.eye(5), 1, axis=1) + np.roll(np.eye(5), -1, axis=1))
+    session = _ModelSession(LKNNModel.from_dataset(dataset, weight_matrix=matrix, gamma=np.full(5, .5)))
+    refiner = BackgroundRefiner(session)
+    try:
+        ## first push of a batch reports the image as seen, accepting it later sends a 1 for the same image
+        refiner.submit(SimpleNamespace(version=0, changes=[(2, 0)]))
+        refiner.wait_idle()
+        refiner.submit(SimpleNamespace(version=1, changes=[(2, 1)]))
+        batch = refiner.take_batch()
+    finally:
+        refiner.stop()
+
+    assert session.model.dataset.idx2label[2] == 1
+    assert np.isclose(session.model.score[[1, 3]], 1.5/2).all()
+    assert 2 not in batch
@@ -0,0 +1,13 @@
+from seesaw.web.common import resolve_snapshot_path
+import os
+import pytest
+
+
+def test_resolve_snapshot_path(tmp_path):
+    os.makedirs(f'{tmp_path}/saved/session_a/qkey_other/saved_1')
+    os.symlink(f'{tmp_path}', f'{tmp_path}/saved/link')
+    save_path = f'{tmp_path}/saved'
+    assert resolve_snapshot_path(save_path, 'session_a/qkey_other/saved_1') == os.path.realpath(f'{save_path}/session_a/qkey_other/saved_1/session.snapshot')
+    for name in ['../other', '..', 'session_a/../../x', 'link/other']:
+        with pytest.raises(ValueError):
+            resolve_snapshot_path(save_path, name)
@@ -0,0 +1,45 @@
+from seesaw.web.thumbnail_cache import ThumbnailCache, is_valid_box, make_thumbnail, oriented_size
+import PIL.Image
+import io
+
+
+def test_thumbnail_cache(tmp_path):
+    image_path = f'{tmp_path}/im.jpg'
+    PIL.Image.new('RGB', (1000, 600), color=(200, 10, 10)).save(image_path)
+
+    cache = ThumbnailCache(f'{tmp_path}/cache', max_bytes=2**20)
+    data = cache.get(image_path, 100)
+    assert PIL.Image.open(io.BytesIO(data)).size == (100, 60)
+    assert cache.get(image_path, 100) == data
+    assert cache.stats()['hits'] == 1
+
+    crop = cache.get(image_path, 50, box=(0, 0, 200, 200))
+    assert PIL.Image.open(io.BytesIO(crop)).size == (50, 50)
+
+    ## reloads existing entries
+    assert ThumbnailCache(f'{tmp_path}/cache').stats()['entries'] == 2
+
+    small = ThumbnailCache(f'{tmp_path}/cache', max_bytes=1)
+    small.get(image_path, 80)
+    assert small.stats()['entries'] == 1
+    assert is_valid_box((0, 0, 1, 1)) and not is_valid_box((10, 10, 10, 10)) and not is_valid_box((5, 0, 1, 1))
+
+
+def test_exif_orientation(tmp_path):
+    ## stored 1000x600 with the left half red, displayed rotated 90 degrees clockwise: 600x1000, red on top
+    image_path = f'{tmp_path}/rotated.jpg'
+    im = PIL.Image.new('RGB', (1000, 600), color=(10, 10, 200))
+    im.paste((200, 10, 10), (0, 0, 500, 600))
+    exif = PIL.Image.Exif()
+    exif[0x0112] = 6
+    im.save(image_path, exif=exif)
+
+    with PIL.Image.open(image_path) as im:
+        assert oriented_size(im) == (600, 1000)
+
+    thumb = PIL.Image.open(io.BytesIO(make_thumbnail(image_path, 100)))
+    assert thumb.size == (60, 100)
+
+    top = PIL.Image.open(io.BytesIO(make_thumbnail(image_path, 50, box=(0, 0, 600, 450))))
+    (r, g, b) = top.getpixel((top.size[0]//2, top.size[1]//2))
+    assert r > 150 and b < 50
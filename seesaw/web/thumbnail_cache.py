@@ -0,0 +1,140 @@
+import os
+import threading
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Tuple
+import PIL.Image
+import PIL.ImageOps
+
+_transposed_orientations = (5, 6, 7, 8) # exif orientations that swap width and height
+
+def oriented_size(im) -> Tuple[int, int]:
+    """ (width, height) as displayed, ie. after applying the exif orientation like browsers do """
+    (w, h) = im.size
+    if im.getexif().get(0x0112) in _transposed_orientations:
+        return (h, w)
+    return (w, h)
+
+def is_valid_box(box) -> bool:
+    (x1, y1, x2, y2) = box
+    return x1 >= 0 and y1 >= 0 and x2 > x1 and y2 > y1
+
+def make_thumbnail(image_path, size, box=None, quality=85) -> bytes:
+    """ jpeg of the image (or of the box x1, y1, x2, y2 within it, in original pixels) with its longest side at most size.
+        the exif orientation is applied, so the output and the box are in the frame browsers display the image in
+        (the one of user boxes and of oriented_size).
+        jpegs are decoded at reduced resolution when the output is much smaller than the original.
+    """
+    import io
+    im = PIL.Image.open(image_path)
+    (w, h) = oriented_size(im)
+    if box is None:
+        box = (0, 0, w, h)
+    assert is_valid_box(box), f'empty or negative {box=}'
+    (x1, y1, x2, y2) = box
+    scale = size/max(x2 - x1, y2 - y1)
+    if scale < 1:
+        (rw, rh) = im.size
+        im.draft('RGB', (max(1, int(rw*scale)), max(1, int(rh*scale)))) # only has effect on jpegs, decodes at >= the requested size
+
+    ## the draft may have reduced the image, map the box to its coordinates
+    im = PIL.ImageOps.exif_transpose(im)
+    (dw, dh) = im.size
+    im = im.convert('RGB').crop((x1*dw/w, y1*dh/h, x2*dw/w, y2*dh/h))
+    im.thumbnail((size, size), PIL.Image.BILINEAR)
+
+    out = io.BytesIO()
+    im.save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+class ThumbnailCache:
+    """ local disk LRU of thumbnails and tile crops, keyed by (image path, size, box).
+        misses are generated on a thread pool, concurrent requests for the same key share one generation.
+        the cache is rebuilt from the files in cache_dir on start, ordered by modification time.
+        returns the jpeg bytes rather than a path, since a concurrent eviction can remove the file before it is served.
+    """
+    def __init__(self, cache_dir, max_bytes=2**30, num_threads=8):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.pool = ThreadPoolExecutor(num_threads)
+        self.lock = threading.Lock() # guards the fields below
+        self.entries = OrderedDict() # key hash -> file size, least recently used first
+        self.total_bytes = 0
+        self.inflight = {} # key hash -> Future
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        files = [e for e in os.scandir(cache_dir) if e.name.endswith('.jpg')]
+        for e in sorted(files, key=lambda e: e.stat().st_mtime):
+            self.entries[e.name[:-len('.jpg')]] = e.stat().st_size
+            self.total_bytes += e.stat().st_size
+
+    @staticmethod
+    def _key(image_path, size, box) -> str:
+        return hashlib.sha1(f'{image_path}|{size}|{box}'.encode()).hexdigest()
+
+    def _path(self, key):
+        return f'{self.cache_dir}/{key}.jpg'
+
+    def _generate(self, key, image_path, size, box):
+        try:
+            data = make_thumbnail(image_path, size, box)
+            tmp_path = f'{self._path(key)}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+
+            with self.lock:
+                self.entries[key] = len(data)
+                self.total_bytes += len(data)
+                self._evict()
+            return data
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            (key, nbytes) = self.entries.popitem(last=False)
+            self.total_bytes -= nbytes
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _read_cached(self, key):
+        """ returns None if the file was evicted (or removed) in the meantime """
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def submit(self, image_path, size, box : Optional[Tuple[float, float, float, float]] = None) -> Future:
+        """ returns a future for the jpeg bytes """
+        key = self._key(image_path, size, box)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                ## read while holding the lock so the entry cannot be evicted in between
+                data = self._read_cached(key)
+                if data is not None:
+                    self.hits += 1
+                    fut = Future()
+                    fut.set_result(data)
+                    return fut
+                self.total_bytes -= self.entries.pop(key)
+
+            if key not in self.inflight:
+                self.misses += 1
+                self.inflight[key] = self.pool.submit(self._generate, key, image_path, size, box)
+            return self.inflight[key]
+
+    def get(self, image_path, size, box=None) -> bytes:
+        return self.submit(image_path, size, box).result()
+
+    def stats(self):
+        with self.lock:
+            return {'entries':len(self.entries), 'bytes':self.total_bytes, 'hits':self.hits, 'misses':self.misses}
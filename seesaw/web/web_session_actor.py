@@ -2,12 +2,14 @@ from typing import Optional, List, Dict, Callable
 import seesaw.seesaw_session
 import importlib
 import seesaw
-from seesaw.seesaw_session import Session
+from seesaw.seesaw_session import Session, save_session_snapshot, load_session_snapshot
 from seesaw.util import reset_num_cpus, vls_init_logger
 import os
 import json
+import contextlib
 from seesaw.dataset_manager import GlobalDataManager
 from seesaw.web.common import *
+from seesaw.web.background_refine import BackgroundRefiner
 
 
 class WebSession:
@@ -18,9 +20,10 @@ class WebSession:
     session_id: str
     session: Optional[Session]
     worker: Optional[Worker]
+    refiner: Optional[BackgroundRefiner]
 
     def __init__(
-        self, root_dir, save_path, session_id, worker: Worker = None, num_cpus=None
+        self, root_dir, save_path, session_id, worker: Worker = None, num_cpus=None, background_refine=False
     ):
         import importlib
         importlib.reload(seesaw)
@@ -36,6 +39,8 @@ class WebSession:
 
         self.gdm = GlobalDataManager(root_dir)
         self.session = None
+        self.background_refine = background_refine # refine and prefetch the next batch while the user labels
+        self.refiner = None
         print("web session constructed")
 
     def _reset_dataset(self, s: SessionParams):
@@ -43,7 +48,20 @@ class WebSession:
         from seesaw.seesaw_session import Session, make_session
 
         res = make_session(self.gdm, s)
-        self.session = res["session"]
+        self._set_session(res["session"])
+
+    def _set_session(self, session: Session):
+        if self.refiner is not None:
+            self.refiner.stop()
+            self.refiner = None
+
+        self.session = session
+        if self.background_refine:
+            self.refiner = BackgroundRefiner(self.session)
+
+    def _session_lock(self):
+        """ the background refiner may be using the session """
+        return self.refiner.lock if self.refiner is not None else contextlib.nullcontext()
 
     def next_task(self, body: SessionReq):
         if self.session:  # null the first time
@@ -54,37 +72,109 @@ class WebSession:
         self._reset_dataset(params)
         return self.getstate()
 
-    def getstate(self):
-        return AppState(
-            indices=None,
-            default_params=None,
-            worker_state=self.worker.get_state() if self.worker else None,
-            session=self.session.get_state() if self.session else None,
-        )
+    def getstate(self, since_batch: int = 0, since_log: int = 0):
+        with self._session_lock():
+            return AppState(
+                indices=None,
+                default_params=None,
+                worker_state=self.worker.get_state() if self.worker else None,
+                session=self.session.get_state(since_batch=since_batch, since_log=since_log) if self.session else None,
+            )
 
     def reset(self, r: ResetReq):
         if r.config is not None:
             self._reset_dataset(r.config)
         return self.getstate()
 
-    def next(self, body: SessionReq):
-        # self.save(body)
-        state = body.client_data.session
-        if state is not None:  ## refinement code
+    def _update_session(self, body: SessionReq) -> bool:
+        """ applies client labels, preferring the delta and falling back to the full state.
+            returns False if there was nothing to apply
+        """
+        if body.delta is not None and self.session.apply_delta(body.delta):
+            return True
+
+        state = body.client_data.session if body.client_data else None
+        if state is not None:
             self.session.update_state(state)
-            self.session.refine()
-        self.session.next()
-        return self.getstate()
+            return True
+        elif body.delta is not None:
+            raise StaleDeltaError(f"stale delta {body.delta.version=}, resend full session state")
+
+        return False
+
+    def _sync_update(self, body: SessionReq, refine=True):
+        """ applies (and refines) in the foreground, after any background work is done """
+        if self.refiner is not None:
+            self.refiner.wait_idle()
+
+        with self._session_lock():
+            if self._update_session(body) and refine:  ## refinement code
+                self.session.refine()
+            if self.refiner is not None:
+                self.refiner.invalidate()
+
+    def labels(self, delta: SessionStateDelta):
+        """ label updates sent while the user is still labeling. with background refine on,
+            refining and preparing the next batch starts right away
+        """
+        if self.refiner is not None:
+            return LabelsResp(version=self.refiner.submit(delta))
+
+        if not self.session.apply_delta(delta):
+            raise StaleDeltaError(f"stale delta {delta.version=}, resend full session state")
+        return LabelsResp(version=self.session.version)
 
-    def text(self, key: str):
-        self.session.set_text(key=key)
-        self.session.next()
+    def next(self, body: SessionReq):
+        # self.save(body)
+        if self.refiner is None:
+            self._sync_update(body)
+            self.session.next()
+        else:
+            delta = body.delta
+            if delta is not None and delta.version == self.refiner.queued_version:
+                if len(delta.changes) > 0 or len(delta.action_log) > 0:
+                    self.refiner.submit(delta)
+            elif delta is not None or body.client_data is not None:
+                self._sync_update(body)
+            self.refiner.take_batch()
+
+        return self.getstate(since_batch=body.since_batch, since_log=body.since_log)
+
+    def text(self, key: str, since_batch: int = 0, since_log: int = 0):
+        if self.refiner is not None:
+            self.refiner.wait_idle()
+
+        with self._session_lock():
+            if self.refiner is not None:
+                self.refiner.invalidate()
+            self.session.set_text(key=key)
+            self.session.next()
+        return self.getstate(since_batch=since_batch, since_log=since_log)
+
+    def snapshot(self, path: str):
+        """ writes a binary snapshot that resume can load, eg. after a restart or on another node """
+        if self.refiner is not None:
+            self.refiner.wait_idle()
+
+        with self._session_lock(), open(path, 'wb') as f:
+            save_session_snapshot(self.session, f)
+
+    def resume(self, name: str):
+        """ name: folder of the saved session, relative to the save path (see resolve_snapshot_path) """
+        path = resolve_snapshot_path(self.save_path, name)
+        with open(path, 'rb') as f:
+            session = load_session_snapshot(self.gdm, f, reuse=self.session)
+        self._set_session(session)
+        self.session._log("resume")
         return self.getstate()
 
     def save(self, body: SessionReq = None):
         if self.session is not None:
-            if body and body.client_data and body.client_data.session:
-                self.session.update_state(body.client_data.session)
+            if self.refiner is not None:
+                self.refiner.wait_idle()
+
+            if body:
+                self._sync_update(body, refine=False)
 
             self.session._log("save")
             if self.session.params.other_params is None:
@@ -103,6 +193,7 @@ class WebSession:
             os.makedirs(output_path, exist_ok=True)
             base = self.getstate().dict()
             json.dump(base, open(f"{output_path}/summary.json", "w"))
+            self.snapshot(f"{output_path}/session.snapshot")
             print(f"saved session {output_path}")
             return SaveResp(path="")
 